@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class AccountConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'account'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+        from account.authentication import forget_user_state
+        from account.blacklist import remember_blacklisted
+        from account.models import User
+
+        post_save.connect(forget_user_state, sender=User)
+        post_delete.connect(forget_user_state, sender=User)
+        post_save.connect(remember_blacklisted, sender=BlacklistedToken)
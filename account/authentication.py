@@ -0,0 +1,139 @@
+"""
+JWT authentication without a user query per request.
+
+MyTokenObtainPairSerializer already puts email, full_name and username in
+the token, so request.user is built from the claims (ClaimsUser) instead of
+being loaded from account_user. What still needs the database is whether
+the account is active or staff, read once per user and kept in a process-local
+cache for AUTH_USER_STATE_TTL seconds (saving the user drops the entry in
+this process, other workers catch up within the TTL), and whether the
+token's login session was revoked: its refresh token blacklisted on
+logout, see the `sid` claim. That is asked of the blacklist front in
+account/blacklist.py.
+
+Views that need the full model load it themselves with request.user.id.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from account.blacklist import blacklist
+from account.models import User
+
+# claim naming the refresh token of the login an access token comes from
+SESSION_CLAIM = 'sid'
+
+
+class ClaimsUser(TokenUser):
+    """request.user for JWT requests, backed by the token claims and the cached user state."""
+
+    def __init__(self, token, state=None):
+        super().__init__(token)
+        self.state = state or {}
+
+    @cached_property
+    def is_staff(self):
+        # not a claim, so granting or revoking staff takes effect within AUTH_USER_STATE_TTL
+        return self.state.get('is_staff', False)
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    @cached_property
+    def full_name(self):
+        return self.token.get('full_name', '')
+
+    def __str__(self):
+        return self.email
+
+
+class UserStateCache:
+    """user id -> (expiry, state) with LRU eviction past max_entries."""
+
+    def __init__(self, max_entries=10_000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= self.clock():
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user_id, state, ttl):
+        with self._lock:
+            self._entries[user_id] = (self.clock() + ttl, state)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_states = UserStateCache()
+
+
+def load_user_state(user_id):
+    """{'is_active', 'is_staff'} of a user from the database, None when it does not exist."""
+    fields = ('is_active', 'is_staff')
+    # the password hash is only kept when tokens carry its fingerprint
+    if api_settings.CHECK_REVOKE_TOKEN:
+        fields += ('password',)
+    return User.objects.filter(pk=user_id).values(*fields).first()
+
+
+def get_user_state(user_id):
+    state = user_states.get(user_id)
+    if state is None:
+        state = load_user_state(user_id)
+        # unknown ids are cached too, so a deleted user's tokens cannot hammer the table
+        user_states.set(user_id, state or {}, getattr(settings, 'AUTH_USER_STATE_TTL', 30))
+    return state or None
+
+
+def forget_user_state(sender, instance, **kwargs):
+    """post_save/post_delete of User."""
+    user_states.forget(instance.pk)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        state = get_user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not state['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        for jti in (validated_token.get(SESSION_CLAIM), validated_token.get(api_settings.JTI_CLAIM)):
+            if jti and blacklist.is_blacklisted(jti):
+                raise InvalidToken(_("Token is blacklisted"))
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(state['password']):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return ClaimsUser(validated_token, state)
@@ -0,0 +1,174 @@
+"""
+Blacklisted JTIs in front of the token_blacklist tables.
+
+simplejwt checks a token against the blacklist with a join of
+BlacklistedToken and OutstandingToken on every refresh, and the auth
+layer checks the login session of every access token. Almost every
+token asked about is not blacklisted, so each worker keeps a Bloom filter
+of the blacklisted, unexpired JTIs:
+
+- a JTI the filter does not contain is not blacklisted, no query
+- a JTI it does contain (blacklisted, or a false positive at about
+  TOKEN_BLACKLIST_ERROR_RATE) is confirmed with the usual indexed lookup
+
+The filter is built from the table on first use. Every
+TOKEN_BLACKLIST_SYNC_SECONDS it pulls the rows blacklisted since (one
+range query on the primary key), and tokens blacklisted in this process
+are added at once by the post_save signal. Ids are handed out when a row
+is inserted, not when it commits, so a logout can commit after a higher
+id was already synced; each sync therefore re-reads the last
+TOKEN_BLACKLIST_SYNC_WINDOW ids as well, skipping the rows it has seen. A token blacklisted by another
+worker is therefore honoured here within the sync interval; 0 syncs
+before every check. Every TOKEN_BLACKLIST_REBUILD_SECONDS, or when more
+JTIs arrived than it was sized for, the filter is rebuilt from scratch,
+which drops expired tokens. Its size follows the unexpired blacklisted
+tokens, not the token history; `manage.py prune_tokens` keeps the tables
+themselves small.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# smallest filter built, so a near empty blacklist does not rebuild on every few logouts
+MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    """Set of strings in a bit array; no false negatives, about error_rate false positives up to capacity keys."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # double hashing: k positions out of one 128 bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BlacklistFront:
+    def __init__(self, sync_interval=2, rebuild_interval=600, error_rate=0.001, sync_window=100,
+                 clock=time.monotonic):
+        self.sync_interval = sync_interval
+        self.sync_window = sync_window
+        self.rebuild_interval = rebuild_interval
+        self.error_rate = error_rate
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        self.reset()
+
+    def reset(self):
+        """Forget the filter; the next check builds it again."""
+        with self._lock:
+            self.filter = None
+            self.last_id = 0
+            # ids in the trailing window already added to the filter
+            self.seen = set()
+            self.built_at = self.synced_at = None
+
+    def refresh(self, force=False):
+        """Pull newly blacklisted JTIs once the sync interval has passed, rebuilding when due."""
+        if not force and self._fresh():
+            return
+        with self._lock:
+            if not force and self._fresh():
+                return
+            now = self.clock()
+            if force or self.filter is None or now - self.built_at >= self.rebuild_interval:
+                self._rebuild(now)
+            else:
+                self._sync(now)
+                if self.filter.count > self.filter.capacity:
+                    self._rebuild(now)
+
+    def _fresh(self):
+        return self.filter is not None and self.clock() - self.synced_at < self.sync_interval
+
+    def _unexpired(self):
+        return BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+
+    def _rebuild(self, now):
+        rows = self._unexpired()
+        bloom = BloomFilter(max(MIN_CAPACITY, 2 * rows.count()), self.error_rate)
+        last_id = 0
+        seen = set()
+        for pk, jti in rows.values_list('id', 'token__jti').iterator(chunk_size=10_000):
+            bloom.add(jti)
+            last_id = max(last_id, pk)
+            if pk > last_id - self.sync_window:
+                seen.add(pk)
+        # ids at or below the newest unexpired row are covered; expired rows above it are harmless to re-read
+        self.filter, self.last_id = bloom, max(self.last_id, last_id)
+        self.seen = {pk for pk in seen if pk > self.last_id - self.sync_window}
+        self.built_at = self.synced_at = now
+        self.stats['rebuilds'] += 1
+
+    def _sync(self, now):
+        rows = self._unexpired().filter(id__gt=self.last_id - self.sync_window)
+        for pk, jti in rows.values_list('id', 'token__jti'):
+            if pk not in self.seen:
+                self.filter.add(jti)
+                self.seen.add(pk)
+            self.last_id = max(self.last_id, pk)
+        self.seen = {pk for pk in self.seen if pk > self.last_id - self.sync_window}
+        self.synced_at = now
+
+    def add(self, jti):
+        bloom = self.filter
+        if bloom is not None:
+            bloom.add(jti)
+
+    def is_blacklisted(self, jti):
+        self.refresh()
+        if jti not in self.filter:
+            self.stats['negative'] += 1
+            return False
+        blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+        self.stats['confirmed' if blacklisted else 'false_positive'] += 1
+        return blacklisted
+
+
+blacklist = BlacklistFront(
+    sync_interval=getattr(settings, 'TOKEN_BLACKLIST_SYNC_SECONDS', 2),
+    rebuild_interval=getattr(settings, 'TOKEN_BLACKLIST_REBUILD_SECONDS', 600),
+    error_rate=getattr(settings, 'TOKEN_BLACKLIST_ERROR_RATE', 0.001),
+    sync_window=getattr(settings, 'TOKEN_BLACKLIST_SYNC_WINDOW', 100),
+)
+
+
+def remember_blacklisted(sender, instance, created, **kwargs):
+    """post_save of BlacklistedToken."""
+    if created:
+        blacklist.add(instance.token.jti)
+
+
+class FilteredRefreshToken(RefreshToken):
+    """RefreshToken checked against the blacklist front instead of a query per refresh."""
+
+    def check_blacklist(self):
+        if blacklist.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import AbstractUser
 from django.db.models.signals import post_save
 from shortuuid.django_fields import ShortUUIDField
@@ -6,6 +7,10 @@ from shortuuid.django_fields import ShortUUIDField
 
 
 # Create your models here.
+# User fields a Profile copies (Profile.save fills an empty full_name from the user)
+PROFILE_SYNC_FIELDS = ('full_name',)
+
+
 class User(AbstractUser):
      username = models.CharField(max_length=100)
      email = models.EmailField(unique=True)
@@ -18,6 +23,23 @@ class User(AbstractUser):
      
      def __str__(self):
          return self.email
+
+     @classmethod
+     def from_db(cls, db, field_names, values):
+       instance = super().from_db(db, field_names, values)
+       instance.remember_profile_fields()
+       return instance
+
+     def remember_profile_fields(self):
+       """Note the synced field values as saved, for profile_fields_changed()."""
+       loaded = self.get_deferred_fields()
+       self._profile_fields = {name: getattr(self, name) for name in PROFILE_SYNC_FIELDS if name not in loaded}
+
+     def profile_fields_changed(self, update_fields=None):
+       """Synced fields written by a save(update_fields=...) that differ from what was loaded."""
+       saved = getattr(self, '_profile_fields', {})
+       names = PROFILE_SYNC_FIELDS if update_fields is None else [name for name in PROFILE_SYNC_FIELDS if name in update_fields]
+       return [name for name in names if name not in saved or saved[name] != getattr(self, name)]
     
      def save(self, *args, **kwargs):
        email_username,mobail=self.email.split('@')
@@ -58,8 +80,11 @@ def create_user_profile(sender, instance, created, **kwargs):
   if created:
     Profile.objects.create(user=instance)
 
-def save_user_profile(sender, instance, **kwargs):
-  instance.profile.save()
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+  # only a changed full_name can matter to the profile, and only while the profile has none of its own
+  if not created and instance.profile_fields_changed(update_fields):
+    Profile.objects.filter(Q(full_name='') | Q(full_name__isnull=True), user=instance).update(full_name=instance.full_name)
+  instance.remember_profile_fields()
   
 post_save.connect(create_user_profile, sender=User)
 post_save.connect(save_user_profile, sender=User)
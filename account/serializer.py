@@ -1,6 +1,10 @@
+from django.db import transaction
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from account.models import User, Profile
+from account.authentication import SESSION_CLAIM
+from account.blacklist import FilteredRefreshToken
+from store.metrics import TimedSerializerMixin
 from django.contrib.auth.password_validation import validate_password
 
 
@@ -12,13 +16,20 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
           token['full_name'] = user.full_name
           token['email'] = user.email
           token['username'] = user.username
+          # copied into the access tokens, so logging out (blacklisting this refresh token) revokes them too
+          token[SESSION_CLAIM] = token['jti']
           try:
                token['vendor_id'] = user.vendor.id
           except:
                token['vendor_id'] = 0
           return token
+
+
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+     token_class = FilteredRefreshToken
+
      
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password=serializers.CharField(write_only=True,required=True,validators=[validate_password])
     password2=serializers.CharField(write_only=True,required=True)
     
@@ -36,7 +47,7 @@ class RegisterSerializer(serializers.ModelSerializer):
         return attrs
    
     def create(self, validated_data):
-        user=User.objects.create(
+        user=User(
              full_name=validated_data['full_name'],
              email=validated_data['email'],
              phone=validated_data['phone'],
@@ -44,15 +55,17 @@ class RegisterSerializer(serializers.ModelSerializer):
         email_user,mobail=user.email.split('@')
         user.username=email_user
         user.set_password(validated_data['password'])
-        user.save()
+        # one INSERT for the user and one for its profile, or neither
+        with transaction.atomic():
+             user.save()
         return user
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
      class Meta:
           model = User
           fields = '__all__'
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
      user=UserSerializer()
      class Meta:
           model = Profile
@@ -1,3 +1,253 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from account.authentication import CachedJWTAuthentication, ClaimsUser, user_states
+from account.blacklist import BloomFilter, blacklist
+from account.models import Profile, User
+from account.serializer import MyTokenObtainPairSerializer
+from account.views import AsyncPasswordResetEmailView
+from api.models import EmailOutbox
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class PasswordResetEmailTest(TestCase):
+    def test_reset_mail_is_queued(self):
+        user = User.objects.create(email='user@example.com', username='user')
+
+        response = APIClient().get(reverse('password-reset', kwargs={'email': user.email}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        entry = EmailOutbox.objects.get()
+        self.assertEqual(entry.to, ['user@example.com'])
+        self.assertIn(response.data['reset_link'], entry.text_body)
+
+
+class AsyncPasswordResetEmailTest(TestCase):
+    async def test_reset_mail_is_queued(self):
+        user = await User.objects.acreate(email='user@example.com', username='user')
+        request = AsyncRequestFactory().get(f'/api/user/password-reset/{user.email}/')
+
+        response = await AsyncPasswordResetEmailView.as_view()(request, email=user.email)
+
+        self.assertEqual(response.status_code, 200)
+        entry = await EmailOutbox.objects.aget()
+        self.assertEqual(entry.to, ['user@example.com'])
+        self.assertIn(response.data['reset_link'], entry.text_body)
+
+    async def test_unknown_email_is_404(self):
+        response = await AsyncPasswordResetEmailView.as_view()(AsyncRequestFactory().get('/'), email='nobody@example.com')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data, {'message': 'User not found'})
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        user_states.clear()
+        self.user = User.objects.create(email='buyer@example.com', username='buyer', full_name='Buyer One')
+        self.refresh = MyTokenObtainPairSerializer.get_token(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+        blacklist.refresh(force=True)
+
+    def auth_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart-create-list'))
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries if 'account_user' in q['sql'] or 'token_blacklist' in q['sql']]
+
+    def test_user_comes_from_the_claims(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+        user, token = CachedJWTAuthentication().authenticate(request)
+
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual((user.id, user.email, user.full_name, user.username), (self.user.id, 'buyer@example.com', 'Buyer One', 'buyer'))
+        self.assertTrue(user.is_authenticated)
+
+    def test_authenticated_reads_need_no_auth_queries_once_cached(self):
+        self.assertEqual(len(self.auth_queries()), 1)
+        self.assertEqual(self.auth_queries(), [])
+
+    def test_logout_revokes_the_access_tokens_of_that_login(self):
+        self.auth_queries()
+        self.refresh.blacklist()
+
+        self.assertEqual(self.client.get(reverse('cart-create-list')).status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.auth_queries()
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.client.get(reverse('cart-create-list')).status_code, 401)
+
+    def test_state_expires_after_the_ttl(self):
+        clock = [0.0]
+        with mock.patch.object(user_states, 'clock', lambda: clock[0]):
+            self.auth_queries()
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+            self.assertEqual(self.client.get(reverse('cart-create-list')).status_code, 200)
+
+            clock[0] = 31
+            self.assertEqual(self.client.get(reverse('cart-create-list')).status_code, 401)
+
+
+class TokenBlacklistFrontTest(TestCase):
+    def setUp(self):
+        blacklist.reset()
+        self.clock = [0.0]
+        patcher = mock.patch.object(blacklist, 'clock', lambda: self.clock[0])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(email='buyer@example.com', username='buyer')
+        self.refresh = MyTokenObtainPairSerializer.get_token(self.user)
+
+    def refresh_token(self, token):
+        return APIClient().post(reverse('token_refresh'), {'refresh': str(token)}, format='json')
+
+    def blacklist_queries(self, token):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.refresh_token(token)
+        return response, [q['sql'] for q in queries if 'token_blacklist' in q['sql']]
+
+    def test_refresh_skips_the_blacklist_table_once_the_filter_is_built(self):
+        self.refresh_token(self.refresh)
+
+        response, queries = self.blacklist_queries(self.refresh)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_blacklisted_refresh_token_is_rejected(self):
+        self.refresh_token(self.refresh)
+        self.refresh.blacklist()
+
+        response, queries = self.blacklist_queries(self.refresh)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(queries), 1)
+
+    def test_tokens_blacklisted_by_other_workers_are_picked_up_at_the_next_sync(self):
+        self.refresh_token(self.refresh)
+        # bulk_create sends no post_save, as if another process had blacklisted it
+        outstanding = OutstandingToken.objects.get(jti=self.refresh['jti'])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 200)
+
+        self.clock[0] = 2
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 401)
+
+    def test_rows_committed_out_of_id_order_are_picked_up(self):
+        self.refresh_token(self.refresh)
+        late = MyTokenObtainPairSerializer.get_token(self.user)
+        self.refresh_token(late)
+        early, late = OutstandingToken.objects.get(jti=self.refresh['jti']), OutstandingToken.objects.get(jti=late['jti'])
+        # the higher id commits and is synced while the lower one is still in flight
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(id=20, token=late)])
+        self.clock[0] = 2
+        blacklist.refresh()
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(id=10, token=early)])
+
+        self.clock[0] = 4
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 401)
+        self.assertEqual(blacklist.filter.count, 2)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        keys = [f'jti-{n}' for n in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum(f'other-{n}' in bloom for n in range(10_000))
+        self.assertLess(false_positives, 300)
+
+
+class PruneTokensTest(TestCase):
+    def test_expired_tokens_and_their_blacklist_entries_are_deleted(self):
+        now = timezone.now()
+        tokens = OutstandingToken.objects.bulk_create([
+            OutstandingToken(jti=f'jti-{n}', token='', expires_at=now + timedelta(days=1 if n % 3 == 0 else -1))
+            for n in range(12)
+        ])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token) for token in tokens[:6]])
+
+        out = StringIO()
+        call_command('prune_tokens', batch_size=5, stdout=out)
+
+        self.assertEqual(sorted(OutstandingToken.objects.values_list('jti', flat=True)), ['jti-0', 'jti-3', 'jti-6', 'jti-9'])
+        self.assertEqual(sorted(BlacklistedToken.objects.values_list('token__jti', flat=True)), ['jti-0', 'jti-3'])
+        self.assertIn('Pruned 8 outstanding and 4 blacklisted tokens in 3 batches.', out.getvalue())
+
+
+class UserProfileSyncTest(TestCase):
+    def register(self):
+        return APIClient().post(reverse('register'), {
+            'full_name': 'New Buyer', 'email': 'new@example.com', 'phone': '0123',
+            'password': 'a-Long-pass-123', 'password2': 'a-Long-pass-123',
+        }, format='json')
+
+    def profile_queries(self, queries):
+        return [q['sql'] for q in queries if 'account_profile' in q['sql']]
+
+    def test_registration_is_one_transaction_with_a_constant_query_count(self):
+        # email uniqueness check, then the user and profile INSERTs in one transaction (a savepoint under TestCase)
+        with self.assertNumQueries(5):
+            response = self.register()
+
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(email='new@example.com')
+        self.assertEqual((user.username, user.profile.full_name), ('new', 'New Buyer'))
+        self.assertTrue(user.check_password('a-Long-pass-123'))
+
+    def test_failed_profile_insert_rolls_the_user_back(self):
+        with mock.patch('account.models.Profile.objects.create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.register()
+
+        self.assertFalse(User.objects.filter(email='new@example.com').exists())
+
+    def test_otp_and_password_saves_leave_the_profile_alone(self):
+        user = User.objects.create(email='user@example.com', username='user')
+        user = User.objects.get(pk=user.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(reverse('password-reset', kwargs={'email': user.email}))
+            user.refresh_from_db()
+            APIClient().post(reverse('password-change'), {'otp': user.otp, 'uidb64': user.pk, 'password': 'new-Pass-456'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.profile_queries(queries), [])
+        user.refresh_from_db()
+        self.assertEqual(user.otp, '')
+        self.assertTrue(user.check_password('new-Pass-456'))
+
+    def test_unchanged_full_name_writes_no_profile(self):
+        user = User.objects.get(pk=User.objects.create(email='user@example.com', username='user', full_name='Old').pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            user.phone = '555'
+            user.save()
+        self.assertEqual(self.profile_queries(queries), [])
+
+    def test_full_name_reaches_a_profile_without_one(self):
+        user = User.objects.create(email='user@example.com', username='user', full_name='Old')
+        Profile.objects.filter(user=user).update(full_name='')
+
+        user.full_name = 'New'
+        user.save(update_fields=['full_name'])
+
+        self.assertEqual(Profile.objects.get(user=user).full_name, 'New')
@@ -1,19 +1,25 @@
 from django.shortcuts import render
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework import generics
 from rest_framework.permissions import AllowAny,IsAuthenticated
 from account.models import User, Profile
 from rest_framework.response import Response
 from rest_framework import status
-from django.core.mail import EmailMultiAlternatives
+from api.outbox import aenqueue_email, enqueue_email
 from django.template.loader import render_to_string
 from django.conf import settings
-from account.serializer import MyTokenObtainPairSerializer,RegisterSerializer,UserSerializer,ProfileSerializer
+from django.views import View
+from store.fast_serializer import FastJSONResponse
+from account.serializer import MyTokenObtainPairSerializer,MyTokenRefreshSerializer,RegisterSerializer,UserSerializer,ProfileSerializer
 import random
 import shortuuid
 # Create your views here.
 class MyTokenObtainPairView(TokenObtainPairView):
      serializer_class = MyTokenObtainPairSerializer
+
+
+class MyTokenRefreshView(TokenRefreshView):
+     serializer_class = MyTokenRefreshSerializer
      
 class RegisterView(generics.CreateAPIView):
      queryset=User.objects.all()
@@ -27,6 +33,27 @@ def generate_otp():
      return unique_key
      
      
+def password_reset_email(user):
+    """(subject, text, html, reset link) of the password reset mail for user."""
+    uidb64 = user.pk
+    otp = user.otp
+    reset_link = f'http://localhost:5173/create-new-password?otp={otp}&uidb64={uidb64}'
+
+    # Email subject
+    subject = "Password Reset Request"
+
+    # Context data for email template
+    context = {
+        'user': user,
+        'reset_link': reset_link,
+    }
+
+    # Email content (HTML)
+    html_content = render_to_string('emails/password_reset_email.html', context)
+    text_content = f"Hi {user.username},\n\nআপনার পাসওয়ার্ড রিসেট করতে নিচের লিঙ্কে ক্লিক করুন:\n\n{reset_link}\n\nযদি আপনি এই রিকোয়েস্ট না করে থাকেন, তাহলে ইমেইলটি উপেক্ষা করুন।"
+    return subject, text_content, html_content, reset_link
+
+
 class PasswordResetEmailView(generics.GenericAPIView):
     permission_classes = (AllowAny,)
     serializer_class = UserSerializer
@@ -38,36 +65,31 @@ class PasswordResetEmailView(generics.GenericAPIView):
             return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
         user.otp = generate_otp()
-        user.save()
+        user.save(update_fields=['otp'])
 
-        uidb64 = user.pk
-        otp = user.otp
-        reset_link = f'http://localhost:5173/create-new-password?otp={otp}&uidb64={uidb64}'
+        subject, text_content, html_content, reset_link = password_reset_email(user)
+        enqueue_email(subject, text_content, [user.email], html_body=html_content, from_email=settings.DEFAULT_FROM_EMAIL)
 
-        # Email subject
-        subject = "Password Reset Request"
+        return Response({'message': 'Password reset link sent', 'reset_link': reset_link})
 
-        # Context data for email template
-        context = {
-            'user': user,
-            'reset_link': reset_link,
-        }
 
-        # Email content (HTML)
-        html_content = render_to_string('emails/password_reset_email.html', context)
-        text_content = f"Hi {user.username},\n\nআপনার পাসওয়ার্ড রিসেট করতে নিচের লিঙ্কে ক্লিক করুন:\n\n{reset_link}\n\nযদি আপনি এই রিকোয়েস্ট না করে থাকেন, তাহলে ইমেইলটি উপেক্ষা করুন।"
+class AsyncPasswordResetEmailView(View):
+    """PasswordResetEmailView for ASGI servers, with async ORM calls; the mail goes through the outbox as well."""
 
-        email_message = EmailMultiAlternatives(subject, text_content, settings.DEFAULT_FROM_EMAIL, [user.email])
-        email_message.attach_alternative(html_content, "text/html")
+    async def get(self, request, email, *args, **kwargs):
+        user = await User.objects.filter(email=email).afirst()
+        if user is None:
+            return FastJSONResponse({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        try:
-            email_message.send()
-        except Exception as e:
-            return Response({'message': 'Failed to send email', 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        user.otp = generate_otp()
+        await user.asave(update_fields=['otp'])
+
+        subject, text_content, html_content, reset_link = password_reset_email(user)
+        await aenqueue_email(subject, text_content, [user.email], html_body=html_content, from_email=settings.DEFAULT_FROM_EMAIL)
+
+        return FastJSONResponse({'message': 'Password reset link sent', 'reset_link': reset_link})
 
-        return Response({'message': 'Password reset link sent', 'reset_link': reset_link})
 
-        
     
 
 class PasswordChangeView(generics.CreateAPIView):
@@ -87,7 +109,7 @@ class PasswordChangeView(generics.CreateAPIView):
             user = User.objects.get(id=uidb64, otp=otp)
             user.set_password(password)
             user.otp = ""
-            user.save()
+            user.save(update_fields=['password', 'otp'])
 
             return Response({'message': 'Password changed successfully'}, status=status.HTTP_201_CREATED)
         except User.DoesNotExist:
@@ -1,3 +1,11 @@
 from django.contrib import admin
+from api.models import EmailOutbox
 
 # Register your models here.
+
+class EmailOutboxAdmin(admin.ModelAdmin):
+     list_display=['subject','to','status','attempts','date','sent_date']
+     list_filter=['status','date']
+     search_fields=['subject']
+
+admin.site.register(EmailOutbox,EmailOutboxAdmin)
@@ -0,0 +1,302 @@
+"""
+Streaming bulk import of products and users from CSV or JSONL files.
+
+Rows are read one at a time and written in chunks with bulk_create, one
+transaction per chunk, so memory stays flat whatever the size of the
+file. bulk_create bypasses save() and the post_save signals, so what they
+do is done here once per chunk instead:
+
+- Product.save(): the slug comes from the title and gets the pid appended
+  when it is taken; taken slugs are looked up with one query per chunk
+- pids and gallery gids come from their ShortUUIDField defaults, no query
+- the product search vectors are refreshed per chunk; the catalog cache
+  version is bumped once at the end
+- User.save(): username and full_name default to the email's local part;
+  the Profile rows the post_save signal would create go in the same chunk
+
+Product rows have the Product field names, `category` holding a category
+slug (unknown slugs are created) and optional lists `gallery` (image
+paths), `colors` ({title, color_code}), `sizes` ({title, price}) and
+`specifications` ({title, content}). In CSV files list cells are JSON.
+User rows have email, username, full_name and phone, plus either
+`password` (hashed here, the slow part of a user import) or
+`password_hash` (an already hashed Django password); users without either
+get an unusable password. Rows whose email exists already are skipped.
+"""
+import csv
+import json
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils.text import slugify
+
+from account.models import Profile, User
+from store.cache import bump_catalog_version
+from store.models import Category, Color, Gallery, Product, ProductSearch, Size, Specification
+
+FORMATS = ('csv', 'jsonl')
+
+PRODUCT_FIELDS = ('title', 'description', 'image', 'price', 'old_price', 'shipping_amount', 'stock_qty',
+                  'inStock', 'status', 'featured', 'slug')
+DECIMAL_FIELDS = ('price', 'old_price', 'shipping_amount')
+RELATED_NAMES = {Gallery: 'gallery images', Color: 'colors', Size: 'sizes', Specification: 'specifications'}
+USER_FIELDS = ('email', 'username', 'full_name', 'phone')
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_rows(stream, format):
+    """Yield (line number, row dict) from an open CSV or JSONL text stream, without reading it all."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {name: value for name, value in row.items() if value not in ('', None)}
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, ImportRowError(f'invalid JSON: {error}')
+            continue
+        yield number, row if isinstance(row, dict) else ImportRowError('not a JSON object')
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ImportReport:
+    """Counts of what an import wrote, and its speed."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.created = Counter()
+        self.errors = []
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def error(self, number, message):
+        self.errors.append((number, str(message)))
+
+
+def _decimal(value, field):
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ImportRowError(f'{field}: {value!r} is not a number')
+
+
+def _boolean(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def _list(row, field):
+    value = row.get(field) or []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ImportRowError(f'{field}: not a JSON list')
+    if not isinstance(value, list):
+        raise ImportRowError(f'{field}: not a list')
+    return value
+
+
+class ProductImporter:
+    # the slug column's max_length
+    slug_length = Product._meta.get_field('slug').max_length
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.categories = {}
+
+    def run(self, rows, report=None, progress=None):
+        report = report or ImportReport()
+        for chunk in chunked(rows, self.batch_size):
+            self.import_chunk(chunk, report)
+            if progress:
+                progress(report)
+        if report.created['products']:
+            bump_catalog_version()
+        return report
+
+    def build(self, row):
+        """(Product, [related rows]) of one row; the related rows get their product once it is saved."""
+        if not row.get('title'):
+            raise ImportRowError('title is required')
+        if 'price' not in row:
+            raise ImportRowError('price is required')
+        values = {field: row[field] for field in PRODUCT_FIELDS if field in row}
+        for field in DECIMAL_FIELDS:
+            if field in values:
+                values[field] = _decimal(values[field], field)
+        for field in ('inStock', 'featured'):
+            if field in values:
+                values[field] = _boolean(values[field])
+        if 'stock_qty' in values:
+            try:
+                values['stock_qty'] = int(values['stock_qty'])
+            except (TypeError, ValueError):
+                raise ImportRowError(f"stock_qty: {values['stock_qty']!r} is not a whole number")
+        if values.get('status', 'published') not in dict(Product.STATUS):
+            raise ImportRowError(f"status: unknown status {values['status']!r}")
+        product = Product(**values)
+
+        related = [Gallery(image=image) for image in _list(row, 'gallery')]
+        try:
+            related += [Color(title=color.get('title'), color_code=color.get('color_code')) for color in _list(row, 'colors')]
+            related += [
+                Size(title=size.get('title'), price=_decimal(size.get('price', 0), 'sizes'))
+                for size in _list(row, 'sizes')
+            ]
+            related += [Specification(title=spec.get('title'), content=spec.get('content')) for spec in _list(row, 'specifications')]
+        except AttributeError:
+            raise ImportRowError('colors, sizes and specifications must be lists of objects')
+        return product, related
+
+    def resolve_categories(self, slugs):
+        missing = set(slugs) - self.categories.keys()
+        if not missing:
+            return
+        self.categories.update(Category.objects.filter(slug__in=missing).values_list('slug', 'id'))
+        new = missing - self.categories.keys()
+        if new:
+            Category.objects.bulk_create(
+                [Category(slug=slug, title=slug.replace('-', ' ').title()) for slug in new], ignore_conflicts=True,
+            )
+            self.categories.update(Category.objects.filter(slug__in=new).values_list('slug', 'id'))
+
+    def assign_slugs(self, products):
+        """Product.save()'s slug rule for a whole chunk, with one lookup of the slugs already taken."""
+        for product in products:
+            product.slug = (product.slug or slugify(product.title))[:self.slug_length] or product.pid
+        taken = set(Product.objects.filter(slug__in=[product.slug for product in products]).values_list('slug', flat=True))
+        for product in products:
+            if product.slug in taken:
+                product.slug = f'{product.slug[:self.slug_length - len(product.pid) - 1]}-{product.pid}'
+            taken.add(product.slug)
+
+    def import_chunk(self, chunk, report):
+        built = []
+        for number, row in chunk:
+            report.rows += 1
+            if isinstance(row, ImportRowError):
+                report.error(number, row)
+                continue
+            try:
+                product, related = self.build(row)
+            except ImportRowError as error:
+                report.error(number, error)
+                continue
+            built.append((product, related, row.get('category')))
+        if not built:
+            return
+
+        self.resolve_categories({category for product, related, category in built if category})
+        for product, related, category in built:
+            product.category_id = self.categories.get(category)
+        products = [product for product, related, category in built]
+        self.assign_slugs(products)
+
+        with transaction.atomic():
+            Product.objects.bulk_create(products)
+            report.created['products'] += len(products)
+            by_model = {}
+            for product, related, category in built:
+                for row in related:
+                    row.product = product
+                    by_model.setdefault(type(row), []).append(row)
+            for model, rows in by_model.items():
+                model.objects.bulk_create(rows)
+                report.created[RELATED_NAMES[model]] += len(rows)
+            ProductSearch.objects.refresh([product.pk for product in products])
+
+
+class UserImporter:
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+
+    def run(self, rows, report=None, progress=None):
+        report = report or ImportReport()
+        for chunk in chunked(rows, self.batch_size):
+            self.import_chunk(chunk, report)
+            if progress:
+                progress(report)
+        return report
+
+    def build(self, row):
+        email = (row.get('email') or '').strip()
+        if email.count('@') != 1:
+            raise ImportRowError(f'email: {email!r} is not an email address')
+        user = User(**{field: row[field] for field in USER_FIELDS if field in row})
+        user.email = email
+        # User.save()'s defaults
+        local_part = email.split('@')[0]
+        user.username = user.username or local_part
+        user.full_name = user.full_name or local_part
+        user.password = row.get('password_hash', '')
+        return user, row.get('password')
+
+    def import_chunk(self, chunk, report):
+        users = {}
+        for number, row in chunk:
+            report.rows += 1
+            if isinstance(row, ImportRowError):
+                report.error(number, row)
+                continue
+            try:
+                user, password = self.build(row)
+            except ImportRowError as error:
+                report.error(number, error)
+                continue
+            if user.email in users:
+                report.created['skipped'] += 1
+                continue
+            users[user.email] = user, password
+        if not users:
+            return
+
+        existing = set(User.objects.filter(email__in=users.keys()).values_list('email', flat=True))
+        report.created['skipped'] += len(existing)
+        users = [(user, password) for email, (user, password) in users.items() if email not in existing]
+        if not users:
+            return
+        # hashed only for the users actually created, it is the expensive step
+        for user, password in users:
+            if not user.password:
+                user.password = make_password(password or None)
+        users = [user for user, password in users]
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            Profile.objects.bulk_create([Profile(user=user, full_name=user.full_name) for user in users])
+        report.created['users'] += len(users)
+        report.created['profiles'] += len(users)
+
+
+IMPORTERS = {
+    'products': ProductImporter,
+    'users': UserImporter,
+}
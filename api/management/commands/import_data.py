@@ -0,0 +1,59 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import FORMATS, IMPORTERS, ImportReport, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import products (with their gallery, colors, sizes and specifications) "
+        "or users (with their profiles) from a CSV or JSONL file, streamed and written "
+        "in chunks of --batch-size rows. Row formats are described in api/importer.py. "
+        "Use - as the path to read standard input."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if format not in FORMATS:
+            raise CommandError(f"Cannot tell the format of {options['path']}; pass --format csv or --format jsonl.")
+
+        importer = IMPORTERS[options['kind']](batch_size=options['batch_size'])
+        report = ImportReport()
+        reported = 0
+
+        def progress(report):
+            nonlocal reported
+            for number, message in report.errors[reported:]:
+                self.stderr.write(f"line {number}: {message}")
+            reported = len(report.errors)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{report.rows} rows, {report.rows_per_second:,.0f} rows/s")
+
+        if options['path'] == '-':
+            importer.run(read_rows(sys.stdin, format), report, progress)
+        else:
+            try:
+                stream = open(options['path'], newline='', encoding='utf-8-sig')
+            except OSError as error:
+                raise CommandError(error)
+            with stream:
+                importer.run(read_rows(stream, format), report, progress)
+
+        created = ', '.join(f"{count} {name}" for name, count in report.created.items() if name != 'skipped' and count)
+        summary = (
+            f"Imported {created or 'nothing'} from {report.rows} rows in {report.elapsed:.1f}s "
+            f"({report.rows_per_second:,.0f} rows/s)."
+        )
+        if report.created['skipped']:
+            summary += f" {report.created['skipped']} rows skipped as duplicates."
+        if report.errors:
+            summary += f" {len(report.errors)} rows rejected."
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,137 @@
+"""
+Per-endpoint request metrics, exported at /metrics (api/views.py).
+
+For every request PerformanceMiddleware records, labelled with the URL
+route that matched (not the raw path, to keep the series bounded):
+
+- latency, by method and status code
+- number of SQL queries and time spent in them, counted with
+  connection.execute_wrapper()
+- time spent building and rendering the payload: serializer
+  representations (store.metrics.TimedSerializerMixin), the values() fast
+  path and JSON rendering (store.metrics.timed('serialize'))
+- response size in bytes
+
+Requests slower than SLOW_REQUEST_SECONDS are logged to `api.performance`
+with their SQL. The metrics live in the worker process: scrape each worker,
+or run one per host.
+
+Async views keep their latency, payload and size metrics, but their
+queries run on other threads than the one the wrapper is installed on, so
+their query counts are not recorded.
+"""
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+
+from store.metrics import HistogramFamily, add_stage_time, start_stage_timings
+
+logger = logging.getLogger('api.performance')
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# statements kept per request for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+request_latency = HistogramFamily(
+    'http_request_duration_seconds', 'Request latency.', ('endpoint', 'method', 'status'),
+)
+request_queries = HistogramFamily(
+    'http_request_db_queries', 'SQL queries per request.', ('endpoint',), buckets=QUERY_BUCKETS,
+)
+request_db_time = HistogramFamily(
+    'http_request_db_duration_seconds', 'Time per request spent in SQL queries.', ('endpoint',),
+)
+request_serialize_time = HistogramFamily(
+    'http_request_serialize_duration_seconds', 'Time per request spent serializing and rendering the payload.', ('endpoint',),
+)
+response_size = HistogramFamily(
+    'http_response_size_bytes', 'Response body size.', ('endpoint',), buckets=SIZE_BUCKETS,
+)
+FAMILIES = (request_latency, request_queries, request_db_time, request_serialize_time, response_size)
+
+
+class QueryRecorder:
+    """execute_wrapper() callable counting queries and their time."""
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if self.keep_sql and len(self.statements) < MAX_LOGGED_QUERIES:
+                self.statements.append((elapsed, sql))
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        timings = start_stage_timings()
+        slow_after = getattr(settings, 'SLOW_REQUEST_SECONDS', 0)
+        queries = QueryRecorder(keep_sql=bool(slow_after))
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timings, queries, slow_after)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        timings = start_stage_timings()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timings, None, getattr(settings, 'SLOW_REQUEST_SECONDS', 0))
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered by the handler after the view returns
+        started = time.perf_counter()
+        response.add_post_render_callback(lambda rendered: add_stage_time('serialize', time.perf_counter() - started))
+        return response
+
+    def record(self, request, response, elapsed, timings, queries, slow_after):
+        endpoint = self.endpoint(request)
+        request_latency.labels(endpoint, request.method, str(response.status_code)).observe(elapsed)
+        request_serialize_time.labels(endpoint).observe(timings.get('serialize', 0.0))
+        if queries is not None:
+            request_queries.labels(endpoint).observe(queries.count)
+            request_db_time.labels(endpoint).observe(queries.duration)
+        if not response.streaming:
+            response_size.labels(endpoint).observe(len(response.content))
+
+        if slow_after and elapsed >= slow_after:
+            lines = [
+                f'{request.method} {request.get_full_path()} ({endpoint}) took {elapsed * 1000:.0f} ms, '
+                f'status {response.status_code}'
+            ]
+            if queries is not None:
+                lines.append(f'{queries.count} queries in {queries.duration * 1000:.0f} ms:')
+                lines.extend(f'  {duration * 1000:.1f} ms  {sql}' for duration, sql in queries.statements)
+            logger.warning('\n'.join(lines))
+
+    def endpoint(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unmatched'
+        return '/' + match.route if match.route else match.view_name
+
@@ -1,3 +1,31 @@
 from django.db import models
 
-# Create your models here.
+
+class EmailOutbox(models.Model):
+    STATUS = (
+        ("pending", "Pending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    )
+
+    subject = models.CharField(max_length=255)
+    from_email = models.CharField(max_length=255, blank=True, null=True)
+    to = models.JSONField(default=list)
+    text_body = models.TextField(blank=True, default="")
+    html_body = models.TextField(blank=True, null=True)
+
+    status = models.CharField(max_length=20, choices=STATUS, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    next_attempt = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(auto_now_add=True)
+    sent_date = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)}"
+
+    class Meta:
+        verbose_name_plural = "Email Outbox"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt', 'id'], name='outbox_due_idx'),
+        ]
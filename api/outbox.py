@@ -0,0 +1,104 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import EmailOutbox
+
+
+def enqueue_email(subject, text_body, to, html_body=None, from_email=None):
+    """Store a message for the outbox worker instead of talking SMTP in the request."""
+    return EmailOutbox.objects.create(
+        subject=subject,
+        text_body=text_body,
+        html_body=html_body,
+        from_email=from_email,
+        to=list(to),
+    )
+
+
+async def aenqueue_email(subject, text_body, to, html_body=None, from_email=None):
+    """enqueue_email() for async views."""
+    return await EmailOutbox.objects.acreate(
+        subject=subject,
+        text_body=text_body,
+        html_body=html_body,
+        from_email=from_email,
+        to=list(to),
+    )
+
+
+def _retry_delay(attempts):
+    base = getattr(settings, 'EMAIL_OUTBOX_RETRY_DELAY', 30)
+    return timedelta(seconds=base * 2 ** (attempts - 1) + random.uniform(0, base))
+
+
+def _mark_failed(entry, error, max_attempts):
+    entry.attempts += 1
+    entry.last_error = str(error)
+    if entry.attempts >= max_attempts:
+        entry.status = 'failed'
+    else:
+        entry.next_attempt = timezone.now() + _retry_delay(entry.attempts)
+
+
+def _build_message(entry, connection):
+    msg = EmailMultiAlternatives(
+        entry.subject, entry.text_body, entry.from_email or settings.DEFAULT_FROM_EMAIL,
+        entry.to, connection=connection,
+    )
+    if entry.html_body:
+        msg.attach_alternative(entry.html_body, 'text/html')
+    return msg
+
+
+def send_pending(batch_size=50, max_attempts=5):
+    """
+    Send one batch of due messages over a single SMTP connection.
+
+    Rows are claimed with SKIP LOCKED so several workers can drain the outbox
+    side by side. Failed sends are retried with exponential backoff and marked
+    failed after max_attempts. Returns (sent, failed) counts for the batch.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt__lte=now)
+            .order_by('next_attempt', 'id')[:batch_size]
+        )
+        if not entries:
+            return 0, 0
+
+        sent = failed = 0
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            # no connection at all, push the whole batch back
+            for entry in entries:
+                _mark_failed(entry, e, max_attempts)
+            failed = len(entries)
+        else:
+            for entry in entries:
+                try:
+                    _build_message(entry, connection).send()
+                except Exception as e:
+                    _mark_failed(entry, e, max_attempts)
+                    failed += 1
+                else:
+                    entry.attempts += 1
+                    entry.status = 'sent'
+                    entry.sent_date = timezone.now()
+                    entry.last_error = None
+                    sent += 1
+        finally:
+            connection.close()
+
+        EmailOutbox.objects.bulk_update(
+            entries, ['status', 'attempts', 'last_error', 'next_attempt', 'sent_date']
+        )
+    return sent, failed
@@ -1,3 +1,220 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from account.models import Profile, User
+from api.importer import ProductImporter, read_rows
+from api.middleware import FAMILIES, request_queries, request_serialize_time
+from api.models import EmailOutbox
+from api.outbox import enqueue_email, send_pending
+from store.cache import catalog_cache
+from store.models import Category, Color, Gallery, Product, Size, Specification
+from store.serializer import ProductSerializer
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTest(TestCase):
+    def test_enqueue_does_not_send(self):
+        enqueue_email('Hello', 'text', ['a@example.com'], html_body='<p>html</p>')
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutbox.objects.get().status, 'pending')
+
+    def test_batch_is_sent_over_one_connection(self):
+        for i in range(3):
+            enqueue_email(f'Hello {i}', 'text', [f'user{i}@example.com'], html_body='<p>html</p>')
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(send_pending(), (3, 0))
+        open_connection.assert_called_once()
+
+        self.assertEqual([m.subject for m in mail.outbox], ['Hello 0', 'Hello 1', 'Hello 2'])
+        self.assertEqual(mail.outbox[0].alternatives[0][0], '<p>html</p>')
+        self.assertFalse(EmailOutbox.objects.exclude(status='sent').exists())
+
+    def test_failures_are_retried_then_given_up(self):
+        entry = enqueue_email('Hello', 'text', ['a@example.com'])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=SMTPException('down')):
+            self.assertEqual(send_pending(max_attempts=2), (0, 1))
+            entry.refresh_from_db()
+            self.assertEqual((entry.status, entry.attempts, entry.last_error), ('pending', 1, 'down'))
+            self.assertGreater(entry.next_attempt, timezone.now())
+
+            # not due yet
+            self.assertEqual(send_pending(max_attempts=2), (0, 0))
+
+            EmailOutbox.objects.update(next_attempt=timezone.now())
+            self.assertEqual(send_pending(max_attempts=2), (0, 1))
+            entry.refresh_from_db()
+            self.assertEqual((entry.status, entry.attempts), ('failed', 2))
+
+    def test_worker_command_drains_outbox(self):
+        for i in range(5):
+            enqueue_email(f'Hello {i}', 'text', ['a@example.com'])
+
+        call_command('send_outbox', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 5)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class PerformanceMetricsTest(TestCase):
+    def setUp(self):
+        for family in FAMILIES:
+            family.clear()
+        catalog_cache().clear()
+        category = Category.objects.create(title='Shirts', slug='shirts')
+        for i in range(3):
+            Product.objects.create(category=category, title=f'Shirt {i}', price=Decimal('10.00'))
+        self.client = APIClient()
+
+    def metrics(self, authorization='Bearer secret'):
+        return self.client.get(reverse('metrics'), headers={'authorization': authorization})
+
+    def test_product_list_is_measured_per_route(self):
+        self.client.get(reverse('product-list'))
+        self.client.get(reverse('product-list'))
+
+        body = self.metrics().content.decode()
+        endpoint = 'endpoint="/api/v1/products/"'
+        self.assertIn(f'http_request_duration_seconds_count{{{endpoint},method="GET",status="200"}} 2', body)
+        self.assertIn(f'http_request_db_queries_count{{{endpoint}}} 2', body)
+        self.assertIn(f'http_response_size_bytes_count{{{endpoint}}} 2', body)
+        self.assertIn('store_catalog_cache_lookups_total{result="hit"}', body)
+        self.assertIn('# TYPE stripe_request_duration_seconds histogram', body)
+
+    def test_query_counts_and_serializer_time_are_recorded(self):
+        self.client.get(reverse('category-list'))
+
+        endpoint = '/api/v1/categories/'
+        queries = request_queries.labels(endpoint).snapshot()
+        self.assertEqual(queries['count'], 1)
+        self.assertGreater(queries['sum'], 0)
+        self.assertGreater(request_serialize_time.labels(endpoint).snapshot()['sum'], 0)
+
+    def test_serializer_time_is_only_kept_inside_requests(self):
+        product = Product.objects.first()
+        ProductSerializer(product).data
+        self.assertEqual(request_serialize_time.children, {})
+
+        self.client.get(reverse('product-detail', kwargs={'slug': product.slug}))
+
+        self.assertGreater(request_serialize_time.labels('/api/v1/products/<slug:slug>/').snapshot()['sum'], 0)
+
+    @override_settings(SLOW_REQUEST_SECONDS=1e-9)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('api.performance', level='WARNING') as logs:
+            self.client.get(reverse('product-list'))
+
+        self.assertIn('/api/v1/products/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_token_is_required(self):
+        self.assertEqual(self.metrics(authorization='').status_code, 403)
+        self.assertEqual(self.metrics(authorization='Bearer wrong').status_code, 403)
+        self.assertEqual(self.metrics().status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_are_closed_without_a_token(self):
+        self.assertEqual(self.metrics(authorization='').status_code, 403)
+        self.assertEqual(self.metrics(authorization='Bearer ').status_code, 403)
+
+
+class ImportDataTest(TestCase):
+    def write(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_data(self, kind, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_data', kind, path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def product_row(self, n, **extra):
+        return {
+            'title': 'Linen Shirt', 'price': '19.99', 'category': 'shirts', 'stock_qty': n,
+            'gallery': [f'product/{n}-front.jpg', f'product/{n}-back.jpg'],
+            'colors': [{'title': 'Sand', 'color_code': '#c2b280'}],
+            'sizes': [{'title': 'M', 'price': '0'}, {'title': 'L', 'price': '2.50'}],
+            'specifications': [{'title': 'Material', 'content': 'Linen'}],
+            **extra,
+        }
+
+    def test_products_with_their_related_rows_from_jsonl(self):
+        Product.objects.create(title='Linen Shirt', price=Decimal('10.00'))
+        lines = [json.dumps(self.product_row(n)) for n in range(5)] + ['{"title": "No price"}', 'not json']
+        path = self.write('.jsonl', '\n'.join(lines) + '\n')
+
+        out, err = self.import_data('products', path, batch_size=2)
+
+        products = Product.objects.filter(category__slug='shirts')
+        self.assertEqual(products.count(), 5)
+        slugs = list(Product.objects.values_list('slug', flat=True))
+        self.assertEqual(len(set(slugs)), 6)
+        self.assertTrue(all(slug.startswith('linen-shirt') for slug in slugs))
+        self.assertEqual(Category.objects.get(slug='shirts').title, 'Shirts')
+        self.assertEqual(Gallery.objects.filter(product__in=products).count(), 10)
+        self.assertEqual(Size.objects.filter(product__in=products).count(), 10)
+        self.assertEqual(Color.objects.filter(product__in=products).count(), 5)
+        self.assertEqual(Specification.objects.get(product__stock_qty=3).content, 'Linen')
+        self.assertIn('line 6: price is required', err)
+        self.assertIn('line 7: invalid JSON', err)
+        self.assertIn('Imported 5 products, 10 gallery images, 5 colors, 10 sizes, 5 specifications from 7 rows', out)
+        self.assertIn('rows/s', out)
+
+    def test_queries_per_chunk_do_not_grow_with_the_chunk(self):
+        def queries(count):
+            rows = [(n, self.product_row(n, title=f'Shirt {count}-{n}')) for n in range(count)]
+            importer = ProductImporter(batch_size=count)
+            importer.resolve_categories({'shirts'})
+            # slug lookup, then the product and its four related INSERTs in a savepoint
+            with self.assertNumQueries(8):
+                importer.run(rows)
+
+        queries(2)
+        queries(50)
+
+    def test_users_with_profiles_from_csv(self):
+        User.objects.create(email='taken@example.com', username='taken')
+        hashed = make_password('s3cret-pass')
+        path = self.write('.csv', (
+            'email,full_name,phone,password_hash\n'
+            f'ann@example.com,Ann Lee,0123,{hashed}\n'
+            'bob@example.com,,,\n'
+            'taken@example.com,Someone,,\n'
+            'ann@example.com,Ann Again,,\n'
+            'not-an-email,,,\n'
+        ))
+
+        out, err = self.import_data('users', path)
+
+        ann = User.objects.get(email='ann@example.com')
+        self.assertEqual((ann.username, ann.full_name, ann.profile.full_name), ('ann', 'Ann Lee', 'Ann Lee'))
+        self.assertTrue(ann.check_password('s3cret-pass'))
+        bob = User.objects.get(email='bob@example.com')
+        self.assertEqual((bob.full_name, bob.has_usable_password()), ('bob', False))
+        self.assertEqual(Profile.objects.filter(user__in=[ann, bob]).count(), 2)
+        self.assertIn("line 6: email: 'not-an-email' is not an email address", err)
+        self.assertIn('Imported 2 users, 2 profiles from 5 rows', out)
+        self.assertIn('2 rows skipped as duplicates', out)
+
+    def test_rows_are_read_lazily(self):
+        rows = read_rows(iter(['{"title": "a"}\n', '{"title": "b"}\n']), 'jsonl')
+
+        self.assertEqual(next(rows), (1, {'title': 'a'}))
@@ -1,27 +1,40 @@
+from django.conf import settings
 from django.urls import path
 from account import views as userauths_views
 from store import views as store_views
-from rest_framework_simplejwt.views import TokenRefreshView
 
 
+if settings.ASYNC_IO_VIEWS:
+    password_reset_view = userauths_views.AsyncPasswordResetEmailView.as_view()
+    checkout_view = store_views.AsyncStripeCheckoutView.as_view()
+    payment_success_view = store_views.AsyncPaymentSuccessView.as_view()
+else:
+    password_reset_view = userauths_views.PasswordResetEmailView.as_view()
+    checkout_view = store_views.StripeCheckoutView.as_view()
+    payment_success_view = store_views.PaymentSuccessView.as_view()
 
 urlpatterns = [
      path('user/token/', userauths_views.MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
-     path('user/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+     path('user/token/refresh/', userauths_views.MyTokenRefreshView.as_view(), name='token_refresh'),
      path('user/register/', userauths_views.RegisterView.as_view(), name='register'),
-     path('user/password-reset/<str:email>/', userauths_views.PasswordResetEmailView.as_view(), name='password-reset'),
+     path('user/password-reset/<str:email>/', password_reset_view, name='password-reset'),
      path('user/password-change/', userauths_views.PasswordChangeView.as_view(), name='password-change'),
      path('user/profile/<user_id>/', userauths_views.ProfileView.as_view(), name='profile'),
      
      # store-view
      path('categories/', store_views.CategoryListAPIView.as_view(), name='category-list'),
     path('products/', store_views.ProductListAPIView.as_view(), name='product-list'),
+    path('products/search/', store_views.ProductSearchAPIView.as_view(), name='product-search'),
+    path('products/autocomplete/', store_views.ProductAutocompleteAPIView.as_view(), name='product-autocomplete'),
     path('products/<slug:slug>/', store_views.ProductDetailsAPIView.as_view(), name='product-detail'),
     path('cart/', store_views.CartAPIView.as_view(), name='cart-create-list'),
     path('cart/<str:cart_id>/', store_views.CartListView.as_view(), name='cart-list'),
+    path('cart/<str:cart_id>/batch/', store_views.CartBatchAPIView.as_view(), name='cart-batch'),
     path('cart/details/<str:cart_id>/', store_views.CartDetailsView.as_view(), name='cart-details'),
     path('cart/<str:cart_id>/item/<int:item_id>/delete/', store_views.CartItemDeleteAPIView.as_view(), name='cart-item-delete'),
     path('order/', store_views.CartOrderAPIView.as_view(), name='cart-order-create'),
-    path('checkout/<str:order_oid>/', store_views.StripeCheckoutView.as_view(), name='stripe-checkout'),
-    path('payment-success/', store_views.PaymentSuccessView.as_view(), name='payment-success'),
+    path('orders/export/', store_views.OrderExportAPIView.as_view(), name='order-export'),
+    path('checkout/<str:order_oid>/', checkout_view, name='stripe-checkout'),
+    path('payment-success/', payment_success_view, name='payment-success'),
+    path('stripe/webhook/', store_views.StripeWebhookView.as_view(), name='stripe-webhook'),
 ]
@@ -1,3 +1,45 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse
+
+from account.blacklist import blacklist
+from api.middleware import FAMILIES
+from store import cache as catalog_cache
+from store.metrics import render_histogram, render_samples
+from store.payments import get_gateway
+
+
+def metrics(request):
+    """Request, catalog cache, token blacklist and Stripe gateway metrics of this worker in Prometheus text format."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    # closed until a token is configured
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=403)
+
+    lines = []
+    for family in FAMILIES:
+        lines.extend(family.render())
+    lines.extend(render_samples(
+        'store_catalog_cache_lookups_total', 'Catalog cache lookups.', 'counter',
+        [({'result': 'hit'}, catalog_cache.stats['hits']), ({'result': 'miss'}, catalog_cache.stats['misses'])],
+    ))
+    lines.extend(render_samples(
+        'token_blacklist_checks_total', 'Token blacklist checks by how the Bloom filter answered.', 'counter',
+        [({'result': result}, blacklist.stats[result]) for result in ('negative', 'confirmed', 'false_positive')],
+    ))
+
+    gateway = get_gateway()
+    lines.extend(render_histogram(
+        'stripe_request_duration_seconds', 'Stripe API call latency, per attempt.',
+        [({'operation': operation}, histogram) for operation, histogram in gateway.latency.items()],
+    ))
+    lines.extend(render_samples(
+        'stripe_calls_total', 'Stripe API calls by outcome.', 'counter',
+        [({'operation': operation, 'outcome': outcome}, count) for (operation, outcome), count in sorted(gateway.outcomes.items())],
+    ))
+    lines.extend(render_samples(
+        'stripe_circuit_open', '1 while the Stripe circuit breaker rejects calls.', 'gauge',
+        [({}, int(gateway.breaker.state == 'open'))],
+    ))
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
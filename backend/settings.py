@@ -63,6 +63,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -188,9 +189,83 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True
 
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'account.authentication.CachedJWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ),
+}
+# seconds a worker trusts its cached is_active/is_staff state of a JWT user
+AUTH_USER_STATE_TTL = 30
+# blacklist front (account/blacklist.py): seconds between pulls of newly
+# blacklisted tokens (how late another worker's logout is honoured here),
+# trailing ids each pull re-reads for rows committed out of id order,
+# seconds between full rebuilds, and the Bloom filter's false positive rate
+TOKEN_BLACKLIST_SYNC_SECONDS = 2
+TOKEN_BLACKLIST_SYNC_WINDOW = 100
+TOKEN_BLACKLIST_REBUILD_SECONDS = 600
+TOKEN_BLACKLIST_ERROR_RATE = 0.001
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# catalog backend can be swapped for FileBasedCache or RedisCache from the env
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': config('CATALOG_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CATALOG_CACHE_LOCATION', default='catalog'),
+    },
+}
+
+# cached cart summary totals (seconds), set to 0 to always aggregate; they go
+# in the catalog cache, so they stay off until it is shared between workers
+CART_TOTALS_CACHE_ALIAS = 'catalog'
+CART_TOTALS_CACHE_TIMEOUT = 0 if CACHES['catalog']['BACKEND'].endswith('.LocMemCache') else 300
+
+# product/category payloads, invalidated on every catalog write
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 300
+# product detail views are buffered in the catalog cache and written in batches
+PRODUCT_VIEWS_FLUSH_EVERY = 20
+# /products/ and /cart/<cart_id>/ JSON built from values() rows (store/fast_serializer.py)
+STORE_FAST_SERIALIZERS = config('STORE_FAST_SERIALIZERS', default=True, cast=bool)
+# text search configuration for /products/search/ (store_productsearch vectors)
+PRODUCT_SEARCH_CONFIG = 'english'
+# 'postgres', or 'memory' for the in-process index (store/search_index.py) on SQLite/dev setups
+PRODUCT_SEARCH_BACKEND = config('PRODUCT_SEARCH_BACKEND', default='postgres')
+# ranked hits the in-process index hands to /products/search/
+PRODUCT_SEARCH_MAX_HITS = 1000
+# lower bounds of the price facet bands on /products/search/
+PRODUCT_PRICE_BANDS = (0, 25, 50, 100, 250)
+
+# request metrics at /metrics (api/middleware.py), for scrapers sending this bearer
+# token; the endpoint answers 403 to everyone while it is blank
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# log requests slower than this many seconds with their SQL to `api.performance`, 0 to disable
+SLOW_REQUEST_SECONDS = config('SLOW_REQUEST_SECONDS', default=0, cast=float)
+
 
 STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
+STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET')
+# point at `python manage.py fake_stripe` to develop offline
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')
+# store/payments.py: (connect, read) timeouts in seconds, retries of failed
+# calls, pooled connections, failed calls in a row that open the circuit
+# breaker and seconds it stays open, retrieved session cache lifetime
+STRIPE_TIMEOUT = (3, 10)
+STRIPE_MAX_RETRIES = 2
+STRIPE_POOL_SIZE = 10
+STRIPE_BREAKER_THRESHOLD = 5
+STRIPE_BREAKER_RESET = 30
+STRIPE_SESSION_CACHE_TIMEOUT = 60
+# route checkout, payment-success and password-reset to their async views
+# (store/views.py, account/views.py); turn on when serving backend.asgi
+ASYNC_IO_VIEWS = config('ASYNC_IO_VIEWS', default=False, cast=bool)
 
 # email settings
 # normal domain smtp set
@@ -202,6 +277,9 @@ EMAIL_USE_SSL = True
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 
+# outbox worker (python manage.py send_outbox --loop), base retry delay in seconds
+EMAIL_OUTBOX_RETRY_DELAY = 30
+
 
 # AUTHENTICATION_BACKENDS = [
 #     'django.contrib.auth.backends.ModelBackend',  
@@ -7,6 +7,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from api import views as api_views
+
 get_schema_view = get_schema_view(
     openapi.Info(
         title="E-Commerce Cart Api",
@@ -23,6 +25,7 @@ get_schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('api.urls')),
+    path('metrics', api_views.metrics, name='metrics'),
     # path('accounts/', include('allauth.urls')),
     
     path('', get_schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
@@ -0,0 +1,134 @@
+"""
+Read-through cache for catalog payloads.
+
+Entries are keyed under a catalog version number; any write to a product,
+its gallery/colors/sizes/specifications or a category bumps the version once
+it commits, so stale payloads are simply never read again and expire on
+their own.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from rest_framework.response import Response
+
+from store.fast_serializer import FastJSONResponse, fast_serializers_enabled
+
+VERSION_KEY = 'catalog:version'
+MODIFIED_KEY = 'catalog:modified'
+
+_stats_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0}
+
+
+def catalog_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+def get_catalog_version():
+    cache = catalog_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # a fresh value, so entries written under an evicted version are not revived
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_catalog_modified():
+    """Unix time of the last catalog write, for Last-Modified headers."""
+    cache = catalog_cache()
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        # unknown after an eviction or restart, so claim it changed now
+        cache.add(MODIFIED_KEY, time.time(), None)
+        modified = cache.get(MODIFIED_KEY)
+    return modified
+
+
+def bump_catalog_version(*args, using=None, **kwargs):
+    """
+    Invalidate every cached catalog payload once the current transaction
+    commits, or at once outside one. Bumped earlier, a request could rebuild
+    a payload from the old rows under the new version before the write
+    commits. Usable directly as a signal receiver.
+    """
+    transaction.on_commit(_bump, using=using)
+
+
+def _bump():
+    cache = catalog_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+    cache.set(MODIFIED_KEY, time.time(), None)
+
+
+def cached_payload(namespace, key, build):
+    """Return (payload, hit) for key, calling build() and storing its result on a miss."""
+    cache = catalog_cache()
+    digest = hashlib.md5(str(key).encode('utf-8')).hexdigest()
+    cache_key = f'catalog:{get_catalog_version()}:{namespace}:{digest}'
+
+    payload = cache.get(cache_key)
+    if payload is not None:
+        _count('hits')
+        return payload, True
+
+    _count('misses')
+    payload = build()
+    cache.set(cache_key, payload, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+    return payload, False
+
+
+def record_product_view(product_id):
+    """
+    Count a product view in the cache and write it to the database in batches
+    of PRODUCT_VIEWS_FLUSH_EVERY, so cached product pages stay off the database.
+    Each batch bumps the catalog version, as the payloads carry the count.
+    """
+    flush_every = getattr(settings, 'PRODUCT_VIEWS_FLUSH_EVERY', 1)
+    if flush_every <= 1:
+        flush = 1
+    else:
+        cache = catalog_cache()
+        key = f'catalog:views:{product_id}'
+        cache.add(key, 0, None)
+        try:
+            pending = cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+            pending = 1
+        # incr is atomic, so exactly one request sees the threshold and flushes it
+        if pending != flush_every:
+            return
+        cache.decr(key, flush_every)
+        flush = flush_every
+
+    from store.models import Product
+    Product.objects.filter(pk=product_id).update(views=F('views') + flush)
+    bump_catalog_version()
+
+
+class CatalogCacheMixin:
+    """Serve a view's payload through cached_payload(); sets an X-Cache header."""
+    cache_namespace = None
+
+    def cached_response(self, key, build):
+        payload, hit = cached_payload(self.cache_namespace, key, build)
+        if fast_serializers_enabled(self.request):
+            response = FastJSONResponse(payload)
+        else:
+            response = Response(payload)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
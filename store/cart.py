@@ -0,0 +1,72 @@
+"""
+Cached cart summary totals.
+
+Totals live in the CART_TOTALS_CACHE_ALIAS cache, which has to be shared
+by every worker, under a per-cart version that each write to the cart
+bumps. A read takes the version before it aggregates, so a fill racing a
+write lands under the old version and is never read again.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from store.models import Cart
+
+
+def _cache():
+    return caches[getattr(settings, 'CART_TOTALS_CACHE_ALIAS', 'default')]
+
+
+def _version_key(cart_id):
+    return f'store:cart-version:{cart_id}'
+
+
+def _cart_version(cache, cart_id):
+    version = cache.get(_version_key(cart_id))
+    if version is None:
+        # a fresh value, so totals written under an evicted version are not revived
+        cache.add(_version_key(cart_id), time.time_ns(), None)
+        version = cache.get(_version_key(cart_id))
+    return version
+
+
+def get_cart_totals(cart_id):
+    """
+    Summary totals for a cart, read from the cache when CART_TOTALS_CACHE_TIMEOUT
+    is set and computed with a single aggregate query otherwise.
+    """
+    timeout = getattr(settings, 'CART_TOTALS_CACHE_TIMEOUT', None)
+    if timeout:
+        cache = _cache()
+        key = f'store:cart-totals:{cart_id}:{_cart_version(cache, cart_id)}'
+        totals = cache.get(key)
+        if totals is not None:
+            return totals
+
+    totals = Cart.objects.filter(cart_id=cart_id).totals()
+    if timeout:
+        cache.set(key, totals, timeout)
+    return totals
+
+
+def invalidate_cart_totals(cart_id):
+    """Called by every view that adds, changes or removes lines of a cart."""
+    if not getattr(settings, 'CART_TOTALS_CACHE_TIMEOUT', None):
+        return
+    cache = _cache()
+    try:
+        cache.incr(_version_key(cart_id))
+    except ValueError:
+        cache.set(_version_key(cart_id), time.time_ns(), None)
+
+
+def totals_summary(totals):
+    """Shape Cart.objects.totals() the way the cart endpoints return it."""
+    return {
+        "shipping": totals['shipping_amount'],
+        "tax": totals['text_fee'],
+        "service_fee": totals['service_fee'],
+        "sub_total": totals['sub_total'],
+        "total": totals['total'],
+    }
@@ -0,0 +1,61 @@
+"""
+ETag / Last-Modified validators for conditional GETs, worked out before the
+view runs so a matching If-None-Match or If-Modified-Since answers 304
+without serializing anything.
+
+Catalog endpoints use the catalog version from store.cache: every catalog
+write bumps it, the order, unit and view counters included, so it needs no
+database query at all. A cart listing is
+validated by one aggregate over its lines plus the catalog version, since
+the lines embed their products.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from store.cache import get_catalog_modified, get_catalog_version
+from store.models import Cart
+
+
+def _representation(request):
+    # one URL can be rendered as JSON or the browsable API, with host-dependent image URLs
+    key = f"{request.build_absolute_uri()}|{request.META.get('HTTP_ACCEPT', '')}"
+    return hashlib.md5(key.encode('utf-8')).hexdigest()[:16]
+
+
+def catalog_etag(request, *args, **kwargs):
+    return f'{get_catalog_version()}-{_representation(request)}'
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return datetime.fromtimestamp(get_catalog_modified(), tz=dt_timezone.utc)
+
+
+def _cart_state(request, cart_id, user_id=None):
+    """(lines, last update) of the cart, aggregated once per request."""
+    state = getattr(request, '_cart_state', None)
+    if state is None:
+        lines = Cart.objects.filter(cart_id=cart_id)
+        if user_id:
+            lines = lines.filter(user_id=user_id)
+        state = lines.aggregate(lines=Count('id'), updated=Max('updated'))
+        request._cart_state = state
+    return state
+
+
+def cart_etag(request, cart_id, user_id=None):
+    state = _cart_state(request, cart_id, user_id)
+    updated = state['updated'].timestamp() if state['updated'] else 0
+    return f"{state['lines']}-{updated}-{get_catalog_version()}-{_representation(request)}"
+
+
+def cart_last_modified(request, cart_id, user_id=None):
+    updated = _cart_state(request, cart_id, user_id)['updated']
+    catalog = catalog_last_modified(request)
+    return max(updated, catalog) if updated else catalog
+
+
+catalog_condition = condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+cart_condition = condition(etag_func=cart_etag, last_modified_func=cart_last_modified)
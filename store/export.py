@@ -0,0 +1,165 @@
+"""
+Streaming export of orders with their lines, for accounting.
+
+Shared by the orders/export/ endpoint and `manage.py export_orders`.
+Orders are read with .iterator(chunk_size), a server-side cursor on
+PostgreSQL, and their CartOrderItem rows (with the product title) are
+prefetched once per chunk, so an export holds one chunk in memory whatever
+its length and costs one items query per chunk rather than one per order.
+
+CSV has one row per order line, the order columns repeated on each (an
+order without lines gets one row with empty line columns); JSONL has one
+object per order with its lines under "items". Output comes in blocks of
+about BLOCK_SIZE bytes. CSV text cells a spreadsheet would read as a
+formula (names and addresses are typed by buyers) get a leading quote.
+"""
+import csv
+import datetime
+import re
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+
+from store.fast_serializer import dumps
+from store.models import CartOrder, CartOrderItem
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+BLOCK_SIZE = 64 * 1024
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+NUMBER_RE = re.compile(r'[-+]?\d+(\.\d+)?')
+
+ORDER_FIELDS = (
+    'oid', 'date', 'buyer_id', 'full_name', 'email', 'phone', 'address', 'city', 'state', 'country', 'zipcode',
+    'payment_Status', 'order_status', 'sub_total', 'shipping_amount', 'service_fee', 'text_fee', 'initial_total',
+    'discount', 'total', 'stripe_session_id',
+)
+ITEM_FIELDS = (
+    'oid', 'product_id', 'qty', 'price', 'sub_total', 'shipping_amount', 'service_fee', 'text_fee', 'initial_total',
+    'discount', 'total', 'size', 'color', 'country',
+)
+
+
+class ExportFilterError(ValueError):
+    pass
+
+
+def _moment(value, name, end=False):
+    """An aware datetime from an ISO date or datetime; a bare end date includes its whole day."""
+    try:
+        # parse_datetime() would also take a bare date, as midnight
+        day = parse_date(value)
+        moment = parse_datetime(value) if day is None else None
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=1) if end else day, datetime.time())
+    elif moment is None:
+        raise ExportFilterError(f'{name}: expected an ISO date or datetime, got {value!r}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def order_export_queryset(start=None, end=None, payment_status=None, order_status=None):
+    """
+    Orders placed from start up to end with the given statuses, oldest
+    first, lines prefetched. A bare end date includes its day, an end
+    datetime is exclusive.
+    """
+    orders = CartOrder.objects.only(*ORDER_FIELDS)
+    if start:
+        orders = orders.filter(date__gte=_moment(start, 'from'))
+    if end:
+        orders = orders.filter(date__lt=_moment(end, 'to', end=True))
+    for field, value, choices in (
+        ('payment_Status', payment_status, CartOrder.PAYMENT_STATUS),
+        ('order_status', order_status, CartOrder.ORDER_STATUS),
+    ):
+        if value:
+            if value not in dict(choices):
+                raise ExportFilterError(f'{field}: unknown status {value!r}')
+            orders = orders.filter(**{field: value})
+    items = CartOrderItem.objects.select_related('product').only(
+        'order_id', 'product__title', *ITEM_FIELDS,
+    ).order_by('id')
+    return orders.prefetch_related(Prefetch('cartorderitem_set', queryset=items)).order_by('date', 'id')
+
+
+def _value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def order_record(order):
+    record = {field: _value(getattr(order, field)) for field in ORDER_FIELDS}
+    record['items'] = [
+        {**{field: _value(getattr(item, field)) for field in ITEM_FIELDS}, 'product_title': item.product.title}
+        for item in order.cartorderitem_set.all()
+    ]
+    return record
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each written row back."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_cell(value):
+    """value, quoted when a spreadsheet would evaluate it; signed amounts are left alone."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not NUMBER_RE.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def _csv_lines(orders):
+    writer = csv.writer(_Echo())
+    item_columns = (*ITEM_FIELDS, 'product_title')
+    yield writer.writerow([f'order_{field}' for field in ORDER_FIELDS] + [f'item_{field}' for field in item_columns])
+    empty = [''] * len(item_columns)
+    for order in orders:
+        record = order_record(order)
+        head = [_csv_cell(record[field]) for field in ORDER_FIELDS]
+        if not record['items']:
+            yield writer.writerow(head + empty)
+        for item in record['items']:
+            yield writer.writerow(head + [_csv_cell(item[field]) for field in item_columns])
+
+
+def _jsonl_lines(orders):
+    for order in orders:
+        yield dumps(order_record(order)).decode() + '\n'
+
+
+def export_blocks(queryset, format, chunk_size=2000):
+    """Encoded blocks of the export of queryset, reading chunk_size orders per round trip."""
+    lines = (_csv_lines if format == 'csv' else _jsonl_lines)(queryset.iterator(chunk_size=chunk_size))
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield ''.join(block).encode()
+            block, size = [], 0
+    if block:
+        yield ''.join(block).encode()
+
+
+async def aexport_blocks(blocks):
+    """
+    export_blocks() for ASGI servers, which would otherwise read a sync
+    iterator to the end before sending anything. Each block is produced in
+    the request's sync thread, where its database connection lives.
+    """
+    done = object()
+    blocks = iter(blocks)
+    while (block := await sync_to_async(next)(blocks, done)) is not done:
+        yield block
@@ -0,0 +1,261 @@
+"""
+A local stand-in for the parts of the Stripe API this project uses.
+
+FakeStripe serves checkout session create/retrieve over HTTP so the real
+stripe SDK can be pointed at it (STRIPE_API_BASE), and produces webhook
+events signed the same way Stripe signs them. Opening a session's url pays
+it: the fake posts checkout.session.completed to webhook_url and redirects
+to the session's success_url. It backs the test suite and
+`python manage.py fake_stripe` for working offline.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qsl
+from urllib.request import Request, urlopen
+
+import stripe
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Return the Stripe-Signature header value for a webhook payload."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signed = f"{timestamp}.{payload}".encode('utf-8')
+    signature = hmac.new(secret.encode('utf-8'), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, so clients can reuse their connections
+    protocol_version = 'HTTP/1.1'
+    session_path = re.compile(r'^/v1/checkout/sessions/(?P<id>[^/?]+)$')
+    pay_path = re.compile(r'^/pay/(?P<id>[^/?]+)$')
+
+    def setup(self):
+        super().setup()
+        self.server.fake.count_connection()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        try:
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client timed out and hung up
+            self.close_connection = True
+
+    def _redirect(self, location):
+        self.send_response(303)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _not_found(self):
+        self._reply(404, {'error': {'type': 'invalid_request_error', 'message': f'No such resource: {self.path}'}})
+
+    def _fail(self):
+        status = self.server.fake.take_failure()
+        if status:
+            self._reply(status, {'error': {'type': 'api_error', 'message': 'Injected failure.'}})
+        return status
+
+    def do_POST(self):
+        fake = self.server.fake
+        fake.record(self.command, self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        form = dict(parse_qsl(self.rfile.read(length).decode('utf-8')))
+        if self._fail():
+            return
+        if self.path != '/v1/checkout/sessions':
+            return self._not_found()
+        self._reply(200, fake.create_session(form, self.headers.get('Idempotency-Key')))
+
+    def do_GET(self):
+        fake = self.server.fake
+        fake.record(self.command, self.path)
+        if self._fail():
+            return
+        path = self.path.split('?')[0]
+        match = self.pay_path.match(path)
+        if match and match.group('id') in fake.sessions:
+            # the hosted checkout page: the buyer pays and is sent back to the shop
+            session_id = match.group('id')
+            fake.deliver(*fake.pay(session_id))
+            success_url = fake.sessions[session_id]['success_url']
+            if not success_url:
+                return self._reply(200, fake.sessions[session_id])
+            return self._redirect(success_url.replace('{CHECKOUT_SESSION_ID}', session_id))
+        match = self.session_path.match(path)
+        session = fake.sessions.get(match.group('id')) if match else None
+        if session is None:
+            return self._not_found()
+        self._reply(200, session)
+
+
+class FakeStripe:
+    """
+    In-process fake Stripe HTTP server.
+
+        with FakeStripe(latency=0.2) as fake:
+            session = get_gateway().create_checkout_session(...)
+            payload, signature = fake.pay(session.id)
+
+    webhook_url is where opening a session's /pay/ url delivers the
+    checkout.session.completed event; without one the event is only built.
+    """
+
+    def __init__(self, latency=0.0, webhook_secret='whsec_test', host='127.0.0.1', port=0, webhook_url=None):
+        self.latency = latency
+        self.webhook_secret = webhook_secret
+        self.webhook_url = webhook_url
+        # (status, payload) of each delivery to webhook_url
+        self.deliveries = []
+        self.sessions = {}
+        self.requests = []
+        # most requests being answered at the same time, for load tests
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # status codes the next requests are answered with, see fail()
+        self.failures = []
+        self.idempotent = {}
+        self.connections = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+        self._previous_api_base = None
+
+    @property
+    def api_base(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, method, path):
+        with self._lock:
+            self.requests.append((method, path))
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def fail(self, count=1, status=500):
+        """Answer the next count requests with an error status."""
+        with self._lock:
+            self.failures.extend([status] * count)
+
+    def take_failure(self):
+        with self._lock:
+            return self.failures.pop(0) if self.failures else None
+
+    def create_session(self, form, idempotency_key=None):
+        # a retried create with the same key gets the session made the first time
+        with self._lock:
+            if idempotency_key in self.idempotent:
+                return self.idempotent[idempotency_key]
+        amount_total = 0
+        for key, value in form.items():
+            match = re.match(r'^line_items\[(\d+)\]\[price_data\]\[unit_amount\]$', key)
+            if match:
+                amount_total += int(value) * int(form.get(f'line_items[{match.group(1)}][quantity]', 1))
+
+        with self._lock:
+            session_id = f"cs_test_{next(self._ids):06d}"
+            session = {
+                'id': session_id,
+                'object': 'checkout.session',
+                'url': f"{self.api_base}/pay/{session_id}",
+                'status': 'open',
+                'payment_status': 'unpaid',
+                'mode': form.get('mode', 'payment'),
+                'amount_total': amount_total,
+                'customer_email': form.get('customer_email'),
+                'client_reference_id': form.get('client_reference_id'),
+                'success_url': form.get('success_url'),
+                'cancel_url': form.get('cancel_url'),
+            }
+            self.sessions[session_id] = session
+            if idempotency_key:
+                self.idempotent[idempotency_key] = session
+        return session
+
+    def event(self, event_type, session):
+        """Build a signed webhook delivery; returns (payload, Stripe-Signature)."""
+        event = {
+            'id': f"evt_test_{next(self._ids):06d}",
+            'object': 'event',
+            'type': event_type,
+            'data': {'object': session},
+        }
+        payload = json.dumps(event)
+        return payload, sign_payload(payload, self.webhook_secret)
+
+    def pay(self, session_id, payment_status='paid'):
+        session = self.sessions[session_id]
+        session.update(status='complete', payment_status=payment_status)
+        return self.event('checkout.session.completed', session)
+
+    def deliver(self, payload, signature):
+        """POST a signed event to webhook_url, the way Stripe delivers it."""
+        if not self.webhook_url:
+            return None
+        request = Request(self.webhook_url, data=payload.encode('utf-8'), method='POST',
+                          headers={'Content-Type': 'application/json', 'Stripe-Signature': signature})
+        try:
+            with urlopen(request, timeout=10) as response:
+                status = response.status
+        except HTTPError as exc:
+            status = exc.code
+        except URLError:
+            status = None
+        with self._lock:
+            self.deliveries.append((status, payload))
+        return status
+
+    def expire(self, session_id):
+        session = self.sessions[session_id]
+        session.update(status='expired')
+        return self.event('checkout.session.expired', session)
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        self._previous_api_base = stripe.api_base
+        stripe.api_base = self.api_base
+        return self
+
+    def __exit__(self, *exc):
+        stripe.api_base = self._previous_api_base
+        self.stop()
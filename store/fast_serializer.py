@@ -0,0 +1,285 @@
+"""
+Read-only fast path for the hot list endpoints.
+
+A serializer class is compiled once into a plan: which `.values()` columns to
+select, how to format each one, and which extra queries fetch nested lists.
+Rows are then turned straight into plain dicts, skipping model instances and
+the per-field dispatch in Serializer.to_representation. The output must match
+the DRF serializer exactly; store/tests.py checks it against golden files.
+"""
+import json
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.db.models import ForeignKey, ManyToManyField, ManyToOneRel, OneToOneField
+from rest_framework import serializers
+
+from store.metrics import timed
+
+
+class NotCompilable(Exception):
+    pass
+
+
+def _format_char(field):
+    return lambda value: value if type(value) is str else field.to_representation(value)
+
+
+def _format_int(field):
+    return lambda value: value if type(value) is int else field.to_representation(value)
+
+
+def _format_bool(field):
+    return lambda value: value if type(value) is bool else field.to_representation(value)
+
+
+def _format_passthrough(field):
+    # None marks values emitted exactly as the database returns them.
+    return None
+
+
+def _format_file(model_field):
+    storage = model_field.storage
+
+    def format_file(value, request):
+        if not value:
+            return None
+        url = storage.url(value)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+    return format_file
+
+
+FORMATTERS = {
+    serializers.CharField: _format_char,
+    serializers.SlugField: _format_char,
+    serializers.EmailField: _format_char,
+    serializers.IntegerField: _format_int,
+    serializers.BooleanField: _format_bool,
+    serializers.PrimaryKeyRelatedField: _format_passthrough,
+}
+
+
+class Plan:
+    """How to build one serialized object from a values() row."""
+
+    def __init__(self, model):
+        self.model = model
+        self.pk = model._meta.pk.name
+        # (kind, key, ...) in serializer field order
+        self.entries = []
+        self.columns = []
+        self.many = []
+
+    def add_leaf(self, key, column, formatter, needs_request=False):
+        self.entries.append(('leaf', key, column, formatter, needs_request))
+        self.columns.append(column)
+
+    def add_one(self, key, column, plan):
+        self.entries.append(('one', key, column, plan))
+        self.columns.append(column)
+        self.columns.extend(f'{column}__{child}' for child in plan.all_columns())
+
+    def add_many(self, key, link, plan, pk_only=False):
+        self.entries.append(('many', key, link, plan, pk_only))
+        self.many.append((key, link, plan, pk_only))
+
+    def all_columns(self):
+        columns = [self.pk] if self.many or self._has_nested_many() else []
+        return columns + [column for column in self.columns if column not in columns]
+
+    def _has_nested_many(self):
+        return any(entry[0] == 'one' and (entry[3].many or entry[3]._has_nested_many()) for entry in self.entries)
+
+
+def compile_serializer(serializer):
+    """Compile a ModelSerializer instance into a Plan, or raise NotCompilable."""
+    model = serializer.Meta.model
+    plan = Plan(model)
+    for key, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if len(field.source_attrs) != 1:
+            raise NotCompilable(f"{key}: dotted or '*' sources are not supported")
+        source = field.source_attrs[0]
+        model_field = _get_model_field(model, source)
+
+        if isinstance(field, serializers.ListSerializer):
+            link, child_model = _many_link(model_field, key)
+            plan.add_many(key, link, compile_serializer(field.child))
+        elif isinstance(field, serializers.ManyRelatedField):
+            if type(field.child_relation) is not serializers.PrimaryKeyRelatedField:
+                raise NotCompilable(f"{key}: only primary key many relations are supported")
+            link, child_model = _many_link(model_field, key)
+            child_plan = Plan(child_model)
+            child_plan.add_leaf('pk', child_model._meta.pk.name, _format_passthrough(field))
+            plan.add_many(key, link, child_plan, pk_only=True)
+        elif isinstance(field, serializers.ModelSerializer):
+            if not isinstance(model_field, (ForeignKey, OneToOneField)):
+                raise NotCompilable(f"{key}: nested serializers need a forward foreign key")
+            plan.add_one(key, model_field.name, compile_serializer(field))
+        elif isinstance(field, serializers.FileField):
+            plan.add_leaf(key, model_field.name, _format_file(model_field), needs_request=True)
+        elif getattr(model_field, 'is_relation', False) and not isinstance(field, serializers.PrimaryKeyRelatedField):
+            raise NotCompilable(f"{key}: unsupported relation field {type(field).__name__}")
+        elif type(field) in FORMATTERS:
+            plan.add_leaf(key, model_field.name, FORMATTERS[type(field)](field))
+        elif isinstance(field, (serializers.DecimalField, serializers.DateTimeField, serializers.ChoiceField)):
+            plan.add_leaf(key, model_field.name, field.to_representation)
+        else:
+            raise NotCompilable(f"{key}: unsupported field {type(field).__name__}")
+    return plan
+
+
+def _get_model_field(model, source):
+    for field in model._meta.get_fields():
+        name = field.get_accessor_name() if field.auto_created and not field.concrete else field.name
+        if name == source:
+            return field
+    raise NotCompilable(f"{model.__name__}.{source} is not a model field")
+
+
+def _many_link(model_field, key):
+    """Return (lookup on the child model that yields the parent pk, child model)."""
+    if isinstance(model_field, ManyToOneRel):
+        return model_field.field.name, model_field.related_model
+    if isinstance(model_field, ManyToManyField):
+        return model_field.related_query_name(), model_field.related_model
+    raise NotCompilable(f"{key}: unsupported many relation")
+
+
+_plans = {}
+
+
+def get_plan(serializer_class):
+    """Compiled plan for a serializer class, or None when it cannot be compiled."""
+    if serializer_class not in _plans:
+        try:
+            _plans[serializer_class] = compile_serializer(serializer_class(context={}))
+        except NotCompilable:
+            _plans[serializer_class] = None
+    return _plans[serializer_class]
+
+
+def build(plan, rows, request, prefix=''):
+    """Turn values() rows into serialized dicts following plan."""
+    children = {}
+    pk_column = prefix + plan.pk
+    for key, link, child_plan, pk_only in plan.many:
+        parent_ids = {row[pk_column] for row in rows if row[pk_column] is not None}
+        children[key] = _fetch_many(link, child_plan, parent_ids, request, pk_only)
+
+    nested = {}
+    for entry in plan.entries:
+        if entry[0] == 'one':
+            column, child_plan = prefix + entry[2], entry[3]
+            present = [row for row in rows if row[column] is not None]
+            nested[entry[1]] = dict(zip(
+                (id(row) for row in present),
+                build(child_plan, present, request, prefix=f'{column}__'),
+            ))
+
+    results = []
+    for row in rows:
+        item = {}
+        for entry in plan.entries:
+            kind, key = entry[0], entry[1]
+            if kind == 'leaf':
+                value = row[prefix + entry[2]]
+                if value is None or entry[3] is None:
+                    item[key] = value
+                elif entry[4]:
+                    item[key] = entry[3](value, request)
+                else:
+                    item[key] = entry[3](value)
+            elif kind == 'one':
+                item[key] = nested[key].get(id(row))
+            else:
+                item[key] = children[key].get(row[pk_column], [])
+        results.append(item)
+    return results
+
+
+def _fetch_many(link, plan, parent_ids, request, pk_only):
+    if not parent_ids:
+        return {}
+    ordering = plan.model._meta.ordering or [plan.pk]
+    rows = list(
+        plan.model._default_manager.filter(**{f'{link}__in': parent_ids})
+        .order_by(*ordering)
+        .values(*_unique([link], plan.all_columns()))
+    )
+    grouped = {}
+    for row, item in zip(rows, build(plan, rows, request)):
+        grouped.setdefault(row[link], []).append(item['pk'] if pk_only else item)
+    return grouped
+
+
+def _unique(*groups):
+    columns = []
+    for group in groups:
+        columns.extend(column for column in group if column not in columns)
+    return columns
+
+
+def values_queryset(plan, queryset, extra_columns=()):
+    """queryset as values() rows carrying every column plan reads, plus extra_columns."""
+    return queryset.prefetch_related(None).values(*_unique(plan.all_columns(), extra_columns))
+
+
+def fast_serializers_enabled(request):
+    """The fast path only stands in for compact JSON responses."""
+    if not getattr(settings, 'STORE_FAST_SERIALIZERS', False):
+        return False
+    renderer = getattr(request, 'accepted_renderer', None)
+    media_type = getattr(request, 'accepted_media_type', '') or ''
+    return renderer is not None and renderer.format == 'json' and 'indent' not in media_type
+
+
+def dumps(data):
+    """Encode like DRF's JSONRenderer with its default compact, unicode settings."""
+    ret = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+class FastJSONResponse(HttpResponse):
+    """Pre-encoded JSON response; keeps the payload on .data like a DRF Response."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        with timed('serialize'):
+            content = dumps(data)
+        super().__init__(content, **kwargs)
+        self.data = data
+
+
+class FastListMixin:
+    """
+    For list views: build the page from values() rows through the compiled
+    plan of the view's serializer class. fast_list_data() returns None when
+    the fast path does not apply and the regular serializer must be used.
+    """
+
+    def fast_list_data(self, request):
+        plan = get_plan(self.get_serializer_class())
+        if plan is None or not fast_serializers_enabled(request):
+            return None
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is None:
+            rows = list(values_queryset(plan, queryset))
+            with timed('serialize'):
+                return build(plan, rows, request)
+        extra_columns = []
+        if hasattr(self.paginator, 'get_ordering'):
+            # KeysetPagination reads the position from the ordering columns of each row.
+            extra_columns = [field.lstrip('-') for field in self.paginator.get_ordering(request, queryset, self)]
+        rows = self.paginator.paginate_queryset(values_queryset(plan, queryset, extra_columns), request, view=self)
+        with timed('serialize'):
+            return self.get_paginated_response(build(plan, rows, request)).data
+
+    def list(self, request, *args, **kwargs):
+        data = self.fast_list_data(request)
+        if data is None:
+            return super().list(request, *args, **kwargs)
+        return FastJSONResponse(data)
@@ -0,0 +1,81 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from account.models import User
+from store.models import Cart, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Load N synthetic cart rows and print the query plans of the cart and "
+        "product lookups with and without their indexes. Runs in a transaction "
+        "that is rolled back, so nothing is left behind."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--lines-per-cart', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user, products, cart_id = self.load(options['rows'], options['lines_per_cart'], options['batch_size'])
+
+            lookups = {
+                'cart lines by cart_id': lambda: Cart.objects.filter(cart_id=cart_id),
+                'cart line by (cart_id, user, product)': lambda: Cart.objects.filter(
+                    cart_id=cart_id, user=user, product=products[0]),
+                'product by slug': lambda: Product.objects.filter(slug=products[-1].slug),
+            }
+
+            self.report('with indexes', lookups)
+            if connection.vendor == 'postgresql':
+                # DDL is transactional on PostgreSQL, the rollback restores the constraint
+                with connection.schema_editor() as editor:
+                    for constraint in Cart._meta.constraints:
+                        editor.remove_constraint(Cart, constraint)
+                self.report('without the cart_id constraint index', lookups)
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"\nSkipping the unindexed comparison, {connection.vendor} cannot drop constraints inside the benchmark transaction."
+                ))
+
+            transaction.set_rollback(True)
+
+    def load(self, rows, lines_per_cart, batch_size):
+        started = time.perf_counter()
+        user = User.objects.create(email='bench-cart@example.com', username='bench-cart')
+        products = Product.objects.bulk_create([
+            Product(title=f'Bench product {i}', slug=f'bench-product-{i}', price=Decimal('10.00'))
+            for i in range(lines_per_cart)
+        ])
+
+        batch = []
+        for n in range(rows):
+            batch.append(Cart(
+                cart_id=f'bench-{n // lines_per_cart}', user=user, product=products[n % lines_per_cart],
+                price=Decimal('10.00'), sub_total=Decimal('10.00'), total=Decimal('10.00'),
+            ))
+            if len(batch) == batch_size:
+                Cart.objects.bulk_create(batch)
+                batch = []
+        Cart.objects.bulk_create(batch)
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Cart._meta.db_table}')
+        self.stdout.write(f"Loaded {rows} cart rows in {time.perf_counter() - started:.1f}s")
+        return user, products, f'bench-{rows // lines_per_cart // 2}'
+
+    def report(self, title, lookups):
+        analyze = {'analyze': True} if connection.vendor == 'postgresql' else {}
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {title}"))
+        for name, build in lookups.items():
+            started = time.perf_counter()
+            list(build())
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(self.style.SUCCESS(f"-- {name}: {elapsed:.2f} ms"))
+            self.stdout.write(build().explain(**analyze))
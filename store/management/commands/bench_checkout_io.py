@@ -0,0 +1,104 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from django.urls import path
+
+from store.fake_stripe import FakeStripe
+from store.models import CartOrder
+from store.views import AsyncStripeCheckoutView, StripeCheckoutView
+
+# both checkout views side by side, whatever ASYNC_IO_VIEWS is set to
+urlpatterns = [
+    path('wsgi/checkout/<str:order_oid>/', StripeCheckoutView.as_view()),
+    path('asgi/checkout/<str:order_oid>/', AsyncStripeCheckoutView.as_view()),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive checkout requests against a local fake Stripe with added latency "
+        "and compare one WSGI worker (a pool of --threads threads, like gunicorn's "
+        "gthread worker) with one ASGI worker (a single event loop running the "
+        "async view). Requests go through the full Django handler and middleware "
+        "in-process. Needs a database that several threads can share (PostgreSQL, "
+        "or a file-backed SQLite); the orders it creates are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests the clients keep in flight.")
+        parser.add_argument('--threads', type=int, default=4, help="Worker threads of the WSGI worker.")
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds the fake Stripe takes per call.")
+
+    def handle(self, *args, **options):
+        orders = [
+            CartOrder.objects.create(email=f'load{n}@example.com', full_name='Load Test', total=Decimal('20.00'))
+            for n in range(options['requests'] * 2)
+        ]
+        fake = FakeStripe(latency=options['latency'])
+        try:
+            # the test clients send Host: testserver
+            with fake, override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                                         STRIPE_API_BASE=fake.api_base):
+                self.stdout.write(
+                    f"{options['requests']} checkouts, {options['concurrency']} in flight, "
+                    f"Stripe latency {options['latency'] * 1000:.0f} ms\n"
+                )
+                self.stdout.write(f"{'worker':<20}{'wall s':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'Stripe calls at once':>22}")
+                runs = (
+                    (f"WSGI, {options['threads']} threads", self.run_wsgi, orders[:options['requests']]),
+                    ('ASGI, 1 event loop', self.run_asgi, orders[options['requests']:]),
+                )
+                for label, run, batch in runs:
+                    fake.peak_in_flight = 0
+                    started = time.perf_counter()
+                    results = run([order.oid for order in batch], options)
+                    wall = time.perf_counter() - started
+                    failed = sum(1 for code, latency in results if code != 302)
+                    latencies = sorted(latency * 1000 for code, latency in results)
+                    self.stdout.write(
+                        f"{label:<20}{wall:>8.2f}{len(results) / wall:>8.1f}{statistics.median(latencies):>9.0f}"
+                        f"{latencies[int(len(latencies) * 0.95) - 1]:>9.0f}{fake.peak_in_flight:>22}"
+                        + (f"  ({failed} failed)" if failed else '')
+                    )
+        finally:
+            CartOrder.objects.filter(pk__in=[order.pk for order in orders]).delete()
+
+    def run_wsgi(self, oids, options):
+        workers = ThreadPoolExecutor(options['threads'])
+        local = threading.local()
+
+        def handle(oid, issued):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            response = local.client.post(f'/wsgi/checkout/{oid}/')
+            return response.status_code, time.perf_counter() - issued
+
+        def request(oid):
+            # a request waits for a free worker thread, as it would in the listen backlog
+            return workers.submit(handle, oid, time.perf_counter()).result()
+
+        with workers, ThreadPoolExecutor(options['concurrency']) as clients:
+            return list(clients.map(request, oids))
+
+    def run_asgi(self, oids, options):
+        async def run():
+            client = AsyncClient()
+            slots = asyncio.Semaphore(options['concurrency'])
+
+            async def request(oid):
+                async with slots:
+                    issued = time.perf_counter()
+                    response = await client.post(f'/asgi/checkout/{oid}/')
+                    return response.status_code, time.perf_counter() - issued
+
+            return await asyncio.gather(*[request(oid) for oid in oids])
+
+        return asyncio.run(run())
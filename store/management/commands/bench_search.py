@@ -0,0 +1,110 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from store.models import Color, Product, Size, Specification
+from store.search_index import build_index
+
+ADJECTIVES = ['classic', 'slim', 'relaxed', 'vintage', 'premium', 'light', 'heavy', 'washed', 'striped', 'plain']
+MATERIALS = ['cotton', 'linen', 'wool', 'denim', 'silk', 'leather', 'cashmere', 'velvet', 'canvas', 'jersey']
+NOUNS = ['shirt', 'jacket', 'cap', 'sweater', 'trousers', 'dress', 'scarf', 'hoodie', 'shorts', 'coat']
+COLORS = ['red', 'blue', 'black', 'white', 'green', 'olive', 'navy', 'sand']
+SIZES = ['XS', 'S', 'M', 'L', 'XL']
+
+
+class Command(BaseCommand):
+    help = (
+        "Load N synthetic products and compare query latency of the in-process "
+        "search index with an icontains (ILIKE) scan over title, description and "
+        "specifications. Runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--baseline-repeat', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(15)
+        with transaction.atomic():
+            products = self.load(rng, options['products'], options['batch_size'])
+
+            started = time.perf_counter()
+            index = build_index(products)
+            self.stdout.write(f"Built index over {len(index)} products, {len(index.postings)} terms in {time.perf_counter() - started:.1f}s")
+
+            # a unique word per product, a common word, several common words, a rare and a common word, a prefix
+            rare = f"sku{options['products'] // 2}"
+            queries = [
+                (rare, False), ('cashmere', False), ('velvet scarf', False), ('cotton shirt', False),
+                ('classic cotton shirt', False), ('plain wool coat', False), ('washed denim jacket red', False),
+                (f'{rare} classic', False), ('vel', True),
+            ]
+
+            self.stdout.write(
+                f"\n{'query':<24}{'cold p50 ms':>13}{'cold p95 ms':>13}{'cached p50 ms':>15}{'ILIKE p50 ms':>14}{'hits':>6}"
+            )
+            for text, prefix in queries:
+                def cold():
+                    index._results.clear()
+                    index.search(text, prefix=prefix)
+                cold_times = self.measure(cold, options['repeat'])
+                cached_times = self.measure(lambda: index.search(text, prefix=prefix), options['repeat'])
+                baseline_times = self.measure(lambda: list(self.baseline(products, text)), options['baseline_repeat'])
+                hits = len(index.search(text, prefix=prefix))
+                label = f"{text}{'*' if prefix else ''}"
+                self.stdout.write(
+                    f"{label:<24}{statistics.median(cold_times):>13.3f}{self.p95(cold_times):>13.3f}"
+                    f"{statistics.median(cached_times):>15.3f}{statistics.median(baseline_times):>14.1f}{hits:>6}"
+                )
+
+            transaction.set_rollback(True)
+
+    def load(self, rng, count, batch_size):
+        started = time.perf_counter()
+        first = None
+        for offset in range(0, count, batch_size):
+            batch = []
+            for n in range(offset, min(offset + batch_size, count)):
+                words = [rng.choice(ADJECTIVES), rng.choice(MATERIALS), rng.choice(NOUNS)]
+                batch.append(Product(
+                    # random pids collide at this volume
+                    pid=f'b{n:09d}',
+                    title=' '.join(word.capitalize() for word in words),
+                    description=f"{' '.join(rng.choices(ADJECTIVES + MATERIALS, k=12))} sku{n}",
+                    price=Decimal(rng.randrange(5, 300)),
+                ))
+            created = Product.objects.bulk_create(batch)
+            first = first or created[0].pk
+            Specification.objects.bulk_create(
+                Specification(product=product, title='Material', content=rng.choice(MATERIALS)) for product in created
+            )
+            Color.objects.bulk_create(Color(product=product, title=rng.choice(COLORS)) for product in created)
+            Size.objects.bulk_create(Size(product=product, title=rng.choice(SIZES)) for product in created)
+        self.stdout.write(f"Loaded {count} products in {time.perf_counter() - started:.1f}s")
+        return Product.objects.filter(pk__gte=first)
+
+    def baseline(self, products, text):
+        queryset = products
+        for word in text.split():
+            queryset = queryset.filter(
+                Q(title__icontains=word) | Q(description__icontains=word) | Q(specification__content__icontains=word)
+            )
+        return queryset.distinct()[:20]
+
+    def measure(self, run, repeat):
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            times.append((time.perf_counter() - started) * 1000)
+        return times
+
+    def p95(self, times):
+        return sorted(times)[int(len(times) * 0.95) - 1] if len(times) > 1 else times[0]
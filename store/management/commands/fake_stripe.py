@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.fake_stripe import FakeStripe
+
+
+class Command(BaseCommand):
+    help = "Serve a local fake of the Stripe checkout API (set STRIPE_API_BASE to its address)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response.")
+        parser.add_argument('--webhook-url', help="Where paying a session posts checkout.session.completed, "
+                                                  "e.g. http://localhost:8000/api/v1/stripe/webhook/.")
+
+    def handle(self, *args, **options):
+        fake = FakeStripe(latency=options['latency'], webhook_secret=settings.STRIPE_WEBHOOK_SECRET or 'whsec_test',
+                          port=options['port'], webhook_url=options['webhook_url'])
+        self.stdout.write(f"Fake Stripe listening on {fake.api_base}")
+        try:
+            fake.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            fake.stop()
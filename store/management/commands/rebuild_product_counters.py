@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from store.cache import bump_catalog_version
+from store.models import Product, CartOrderItem
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.orders_count and Product.units_sold from CartOrderItem rows."
+
+    def handle(self, *args, **options):
+        items = CartOrderItem.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        order_items = items.annotate(n=Count('id')).values('n')
+        units = items.annotate(n=Sum('qty')).values('n')
+
+        updated = Product.objects.update(
+            orders_count=Coalesce(Subquery(order_items, output_field=IntegerField()), 0),
+            units_sold=Coalesce(Subquery(units, output_field=IntegerField()), 0),
+        )
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {updated} products."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from store.models import Product, ProductSearch
+
+
+class Command(BaseCommand):
+    help = "Recompute the full-text search vectors of every product (PostgreSQL only)."
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write("Product search needs PostgreSQL; nothing to rebuild.")
+            return
+        ProductSearch.objects.refresh()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search vectors for {Product.objects.count()} products."))
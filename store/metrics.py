@@ -0,0 +1,162 @@
+"""
+Process-local latency histograms and their Prometheus text format.
+
+Buckets are fixed upper bounds in seconds, counted the way Prometheus
+histograms are, so a snapshot can be exported as-is. timed() adds time to
+the stage timings of the current request (api/middleware.py), and
+TimedSerializerMixin does so for the serializers that use it.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (inf past the last bucket)."""
+        with self._lock:
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+                seen += count
+                if seen >= rank and seen:
+                    return bound
+        return None
+
+    def snapshot(self):
+        """{'buckets': [(upper bound, cumulative count)], 'count', 'sum'}; the last bound is '+Inf'."""
+        with self._lock:
+            cumulative, buckets = 0, []
+            for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            return {'buckets': buckets, 'count': self.count, 'sum': self.sum}
+
+
+_stage_timings = contextvars.ContextVar('stage_timings', default=None)
+
+
+def start_stage_timings():
+    """Collect timed() stages of the current request into the returned dict."""
+    timings = {}
+    _stage_timings.set(timings)
+    return timings
+
+
+def add_stage_time(stage, seconds):
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage):
+    """Add the time spent in the block to stage; nested blocks of one stage count once."""
+    timings = _stage_timings.get()
+    depth_key = (stage, 'depth')
+    if timings is None or timings.get(depth_key):
+        yield
+        return
+    timings[depth_key] = 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[depth_key] = 0
+        add_stage_time(stage, time.perf_counter() - started)
+
+
+class TimedSerializerMixin:
+    """Count the serializer's to_representation() as the 'serialize' stage."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class HistogramFamily:
+    """Histograms of one metric, one per combination of label values."""
+
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, *values):
+        histogram = self.children.get(values)
+        if histogram is None:
+            with self._lock:
+                histogram = self.children.setdefault(values, Histogram(self.buckets))
+        return histogram
+
+    def clear(self):
+        with self._lock:
+            self.children = {}
+
+    def render(self):
+        series = [(dict(zip(self.label_names, values)), histogram) for values, histogram in list(self.children.items())]
+        return render_histogram(self.name, self.help, series)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_histogram(name, help, series):
+    """Prometheus text lines of histogram name from [(labels, Histogram)]."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+    for labels, histogram in series:
+        snapshot = histogram.snapshot()
+        for bound, count in snapshot['buckets']:
+            le = bound if bound == '+Inf' else _number(float(bound))
+            lines.append(f'{name}_bucket{_labels({**labels, "le": le})} {count}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(snapshot["sum"])}')
+        lines.append(f'{name}_count{_labels(labels)} {snapshot["count"]}')
+    return lines
+
+
+def render_samples(name, help, kind, series):
+    """Prometheus text lines of a counter or gauge from [(labels, value)]."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+    lines.extend(f'{name}{_labels(labels)} {_number(value)}' for labels, value in series)
+    return lines
@@ -1,14 +1,27 @@
-from django.db import models
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.db.models import Case, F, Prefetch, Sum, Value, When
+from django.db.models.functions import Coalesce
 from account.models import User
 from shortuuid.django_fields import ShortUUIDField
+from django.utils import timezone
 from django.utils.text import slugify
 
+from store.cache import bump_catalog_version
+from store.search_index import index_product_changed
+
 
 class Category(models.Model):
     title = models.CharField(max_length=100, blank=True, null=True)
     image = models.FileField(upload_to='category', default='category/default.jpg', blank=True, null=True)
     active = models.BooleanField(default=True)
     slug = models.SlugField(unique=True)
+    updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
@@ -18,6 +31,40 @@ class Category(models.Model):
         ordering = ['title']
 
 
+class ProductQuerySet(models.QuerySet):
+    def catalog(self):
+        """Everything ProductSerializer reads, fetched in a fixed number of queries."""
+        return self.select_related('category').prefetch_related(
+            Prefetch('gallery_set', queryset=Gallery.objects.order_by('id')),
+            Prefetch('color_set', queryset=Color.objects.order_by('id')),
+            Prefetch('size_set', queryset=Size.objects.order_by('id')),
+            Prefetch('specification_set', queryset=Specification.objects.order_by('id')),
+        )
+
+    def add_order_counts(self, deltas):
+        """
+        Apply {product_id: (order_items, units)} to the popularity counters
+        in a single UPDATE. The counters are part of the cached catalog
+        payloads, so the catalog version is bumped once the write commits.
+        """
+        if not deltas:
+            return 0
+        orders_case = Case(
+            *[When(pk=pk, then=Value(items)) for pk, (items, units) in deltas.items()],
+            default=Value(0), output_field=models.PositiveIntegerField(),
+        )
+        units_case = Case(
+            *[When(pk=pk, then=Value(units)) for pk, (items, units) in deltas.items()],
+            default=Value(0), output_field=models.PositiveIntegerField(),
+        )
+        updated = self.filter(pk__in=deltas.keys()).update(
+            orders_count=F('orders_count') + orders_case,
+            units_sold=F('units_sold') + units_case,
+        )
+        bump_catalog_version(using=self.db)
+        return updated
+
+
 class Product(models.Model):
     STATUS = (
         ("draft", "Draft"),
@@ -38,15 +85,28 @@ class Product(models.Model):
     status = models.CharField(max_length=100, choices=STATUS, default="published")
     featured = models.BooleanField(default=False)
     views = models.PositiveIntegerField(default=0)
+    orders_count = models.PositiveIntegerField(default=0)
+    units_sold = models.PositiveIntegerField(default=0)
     rating = models.PositiveIntegerField(default=0, blank=True, null=True)
 
     pid = ShortUUIDField(unique=True, length=10, alphabet="abcdefg12345")
-    slug = models.SlugField(null=True, blank=True)
+    slug = models.SlugField(unique=True, null=True, blank=True)
     date = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='product_date_id_idx'),
+            models.Index(fields=['-orders_count', '-id'], name='product_orders_id_idx'),
+            models.Index(fields=['-units_sold', '-id'], name='product_units_id_idx'),
+            models.Index(fields=['-views', '-id'], name='product_views_id_idx'),
+        ]
+
     def gallery(self):
         return Gallery.objects.filter(product=self)
 
@@ -66,6 +126,8 @@ class Product(models.Model):
         is_new = self.pk is None
         if self.slug == "" or self.slug is None:
             self.slug = slugify(self.title)
+            if Product.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
+                self.slug = f"{self.slug}-{self.pid}"
         super(Product, self).save(*args, **kwargs)
 
 
@@ -112,6 +174,114 @@ class Color(models.Model):
         return self.title
 
 
+class ProductSearchQuerySet(models.QuerySet):
+    def refresh(self, product_ids=None):
+        """
+        Recompute the search vectors of product_ids (every product when None)
+        in one INSERT ... SELECT ... ON CONFLICT: title weighs A, description
+        B and the product's specification contents C.
+        """
+        if connection.vendor != 'postgresql':
+            return
+        qn = connection.ops.quote_name
+        product = qn(Product._meta.db_table)
+        specification = qn(Specification._meta.db_table)
+        vector = (
+            "setweight(to_tsvector(%s::regconfig, coalesce(p.{title}, '')), 'A') || "
+            "setweight(to_tsvector(%s::regconfig, coalesce(p.{description}, '')), 'B') || "
+            "setweight(to_tsvector(%s::regconfig, coalesce(("
+            "SELECT string_agg(s.{content}, ' ' ORDER BY s.{id}) FROM {specification} s WHERE s.{product_id} = p.{id}"
+            "), '')), 'C')"
+        ).format(
+            title=qn('title'), description=qn('description'), content=qn('content'), id=qn('id'),
+            product_id=qn('product_id'), specification=specification,
+        )
+        params = [settings.PRODUCT_SEARCH_CONFIG] * 3
+        where = ''
+        if product_ids is not None:
+            product_ids = list(product_ids)
+            if not product_ids:
+                return
+            where = f"WHERE p.{qn('id')} IN ({', '.join(['%s'] * len(product_ids))}) "
+            params += product_ids
+
+        sql = (
+            f"INSERT INTO {qn(self.model._meta.db_table)} ({qn('product_id')}, {qn('vector')}) "
+            f"SELECT p.{qn('id')}, {vector} FROM {product} p {where}"
+            f"ON CONFLICT ({qn('product_id')}) DO UPDATE SET {qn('vector')} = EXCLUDED.{qn('vector')}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+class ProductSearch(models.Model):
+    """
+    Full-text document for a product, kept in its own table so the tsvector
+    never shows up in the `fields = '__all__'` product payloads.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search')
+    vector = SearchVectorField(null=True)
+
+    objects = ProductSearchQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['vector'], name='product_search_vector_idx'),
+        ]
+
+
+class CartQuerySet(models.QuerySet):
+    TOTAL_FIELDS = ('shipping_amount', 'text_fee', 'service_fee', 'sub_total', 'total')
+
+    def totals(self):
+        """Sum the money columns of the selected cart lines in one query."""
+        zero = Value(Decimal('0.00'), output_field=models.DecimalField(decimal_places=2, max_digits=12))
+        return self.aggregate(**{
+            field: Coalesce(Sum(field), zero) for field in self.TOTAL_FIELDS
+        })
+
+    def upsert_line(self, cart_id, user_id, product_id, **values):
+        """
+        Insert or update the (cart_id, user, product) line in one statement.
+
+        The row is selected from the user and product tables, so a missing user
+        or product inserts nothing and None is returned. Otherwise the stored
+        row comes back through RETURNING, with `created` telling an insert from
+        an update of an existing line: PostgreSQL returns it (a row inserted by
+        the statement has no xmax), other backends look the line up first in
+        the same transaction. A NULL cart_id never conflicts, so callers must
+        pass one.
+        """
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        now = timezone.now()
+        row = dict(values, cart_id=cart_id, date=now, updated=now)
+        columns = [meta.get_field(name) for name in row]
+        updated = [field.column for field in columns if field.name not in ('cart_id', 'date')]
+
+        sql = (
+            f"INSERT INTO {qn(meta.db_table)} ({qn('user_id')}, {qn('product_id')}, "
+            f"{', '.join(qn(field.column) for field in columns)}) "
+            f"SELECT u.{qn('id')}, p.{qn('id')}, {', '.join(['%s'] * len(columns))} "
+            f"FROM {qn(User._meta.db_table)} u, {qn(Product._meta.db_table)} p "
+            f"WHERE u.{qn('id')} = %s AND p.{qn('id')} = %s "
+            f"ON CONFLICT ({qn('cart_id')}, {qn('user_id')}, {qn('product_id')}) DO UPDATE SET "
+            f"{', '.join(f'{qn(column)} = EXCLUDED.{qn(column)}' for column in updated)} "
+            f"RETURNING *"
+        )
+        params = [field.get_db_prep_save(row[field.name], connection) for field in columns]
+        params += [user_id, product_id]
+
+        if connection.vendor == 'postgresql':
+            return next(iter(self.model.objects.raw(f"{sql}, (xmax = 0) AS created", params)), None)
+        with transaction.atomic(savepoint=False):
+            existed = self.filter(cart_id=cart_id, user_id=user_id, product_id=product_id).exists()
+            cart = next(iter(self.model.objects.raw(sql, params)), None)
+        if cart is not None:
+            cart.created = not existed
+        return cart
+
+
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -127,10 +297,22 @@ class Cart(models.Model):
     color = models.CharField(max_length=100, blank=True, null=True)
     cart_id = models.CharField(max_length=100, blank=True, null=True)
     date = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = CartQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.cart_id} - {self.product.title}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='cart_date_id_idx'),
+        ]
+        constraints = [
+            # every cart endpoint filters on cart_id first; this also backs the add-to-cart upsert
+            models.UniqueConstraint(fields=['cart_id', 'user', 'product'], name='cart_line_unique'),
+        ]
+
 
 class CartOrder(models.Model):
     PAYMENT_STATUS = (
@@ -175,6 +357,12 @@ class CartOrder(models.Model):
     def __str__(self):
         return self.oid
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='cartorder_date_id_idx'),
+            models.Index(fields=['buyer', '-date'], name='cartorder_buyer_date_idx'),
+        ]
+
     def orderItem(self):
         return CartOrderItem.objects.filter(order=self)
 
@@ -203,3 +391,42 @@ class CartOrderItem(models.Model):
 
     def __str__(self):
         return self.oid
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'product'], name='cartorderitem_order_prod_idx'),
+        ]
+
+
+class StripeEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.event_id
+
+
+for catalog_model in (Category, Product, Gallery, Specification, Size, Color):
+    post_save.connect(bump_catalog_version, sender=catalog_model)
+    post_delete.connect(bump_catalog_version, sender=catalog_model)
+
+
+def refresh_product_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'title', 'description'} & set(update_fields):
+        return
+    ProductSearch.objects.refresh([instance.pk])
+
+
+def refresh_specification_search(sender, instance, **kwargs):
+    if instance.product_id is not None:
+        ProductSearch.objects.refresh([instance.product_id])
+
+
+post_save.connect(refresh_product_search, sender=Product)
+post_save.connect(refresh_specification_search, sender=Specification)
+post_delete.connect(refresh_specification_search, sender=Specification)
+
+for indexed_model in (Product, Specification, Color, Size):
+    post_save.connect(index_product_changed, sender=indexed_model)
+    post_delete.connect(index_product_changed, sender=indexed_model)
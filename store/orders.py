@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from api.outbox import enqueue_email
+from store.models import CartOrder, CartOrderItem
+from store.stock import reserve_order_stock
+
+
+def mark_order_paid(order):
+    """
+    Flip an order to paid, take its stock and queue the confirmation mail.
+
+    Only the caller that actually changes the status does the work, so
+    duplicate webhook deliveries are harmless. Returns the order items that
+    could not be fulfilled, or None when the order was already paid.
+    """
+    with transaction.atomic():
+        marked_paid = CartOrder.objects.filter(pk=order.pk).exclude(payment_Status='paid').update(payment_Status='paid')
+        if not marked_paid:
+            return None
+        order.payment_Status = 'paid'
+
+        order_items = list(CartOrderItem.objects.filter(order=order).select_related('product'))
+        unfulfilled = reserve_order_stock(order_items)
+
+        context = {'order': order, 'order_item': order_items}
+        subject = "Order Placed successfully"
+        text_body = render_to_string('emails/customer_order_placed.txt', context)
+        html_body = render_to_string('emails/customer_order_placed.html', context)
+        enqueue_email(subject, text_body, [order.email], html_body=html_body, from_email=settings.EMAIL_HOST_USER)
+    return unfulfilled
+
+
+def mark_order_cancelled(order):
+    """Cancel an unpaid order whose checkout session expired or failed."""
+    return CartOrder.objects.filter(pk=order.pk).exclude(payment_Status='paid').update(payment_Status='Cancelled')
@@ -0,0 +1,131 @@
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the whole ordering, which always ends on `id`.
+
+    DRF's cursor holds the first ordering field plus an offset past the rows
+    sharing its value, and the offset is capped at offset_cutoff, so a run
+    of ties longer than that (products that never sold, say) could not be
+    paged through. Here the position is every ordering value of the row, a
+    unique key, and a page starts after it with a row value comparison:
+    (a > x) OR (a = x AND id > y). The offset is then always 0.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering[-1].lstrip('-') != 'id':
+            # Break ties on client-chosen orderings the same way as the first field.
+            tiebreak = '-id' if ordering[0].startswith('-') else 'id'
+            ordering = tuple(ordering) + (tiebreak,)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset() with the position filter on the whole keyset
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*(order[1:] if order.startswith('-') else f'-{order}' for order in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(self._after(current_position, reverse))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def _after(self, position, reverse):
+        """Rows past position in the direction of travel, as (a > x) OR (a = x AND b > y) OR ..."""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q(pk__in=[])
+        equal = Q()
+        for order, value in zip(self.ordering, values):
+            field = order.lstrip('-')
+            # descending fields go down, and a reverse cursor walks the other way
+            lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            attr = instance[field_name] if isinstance(instance, dict) else getattr(instance, field_name)
+            values.append(str(attr))
+        return json.dumps(values, separators=(',', ':'))
+
+
+class ProductCursorPagination(KeysetPagination):
+    ordering = ('-date', '-id')
+
+
+class CategoryCursorPagination(KeysetPagination):
+    # slug is unique and never null, unlike title, and its unique index serves the keyset
+    ordering = ('slug', 'id')
+
+
+class CartCursorPagination(KeysetPagination):
+    ordering = ('-date', '-id')
+
+
+class ProductSearchPagination(PageNumberPagination):
+    """Relevance ranks are floats and not unique, so search results are paged by number."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,277 @@
+"""
+Stripe checkout sessions behind one gateway object.
+
+StripeGateway talks to Stripe through a StripeClient of its own instead of
+the SDK's module-level functions:
+
+- one requests connection pool shared by the worker's threads, so calls
+  reuse open TLS connections; async callers get an httpx pool per event
+  loop (an httpx.AsyncClient belongs to the loop that first used it)
+- (connect, read) timeouts from STRIPE_TIMEOUT, so a slow Stripe cannot
+  hold a worker indefinitely
+- network errors, 429s and 5xx answers are retried STRIPE_MAX_RETRIES times
+  with exponential backoff and full jitter; creates carry an idempotency key
+  so a retried create cannot open a second session
+- a circuit breaker that fails calls fast for STRIPE_BREAKER_RESET seconds
+  after STRIPE_BREAKER_THRESHOLD calls in a row have failed
+- retrieved sessions are cached per session id for
+  STRIPE_SESSION_CACHE_TIMEOUT seconds; webhooks refresh the cached copy
+- a latency histogram per operation (store/metrics.py), one observation
+  per attempt
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from store.metrics import Histogram
+
+
+class PaymentGatewayUnavailable(stripe.APIConnectionError):
+    """Raised without calling Stripe while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    closed: calls go through. After `threshold` failed calls in a row it
+    opens and rejects calls for `reset_timeout` seconds, then lets a single
+    trial call through (half-open): its success closes the breaker again,
+    its failure reopens it.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self._trial or self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+                self._trial = False
+
+    def release_trial(self):
+        """End a trial call that gave no verdict (cancelled, or not a Stripe error); the next call is the trial."""
+        with self._lock:
+            self._trial = False
+
+
+class StripeGateway:
+    operations = ('session.create', 'session.retrieve')
+
+    def __init__(self, api_key, api_base, timeout=(3, 10), max_retries=2, backoff=0.25, max_backoff=2.0,
+                 pool_size=10, breaker=None, session_cache_timeout=60, sleep=time.sleep):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session_cache_timeout = session_cache_timeout
+        self.sleep = sleep
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = {operation: Histogram() for operation in self.operations}
+        self.outcomes = Counter()
+
+        pool = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        pool.mount('https://', adapter)
+        pool.mount('http://', adapter)
+        self.client = self._client(stripe.RequestsClient(timeout=timeout, session=pool))
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _client(self, http_client):
+        # retries are ours, with jitter and breaker accounting
+        return stripe.StripeClient(self.api_key, base_addresses={'api': self.api_base},
+                                   http_client=http_client, max_network_retries=0)
+
+    def async_client(self):
+        """The StripeClient of the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import httpx
+
+            connect, read = self.timeout
+            client = self._async_clients[loop] = self._client(
+                stripe.HTTPXClient(timeout=httpx.Timeout(read, connect=connect)),
+            )
+        return client
+
+    # checkout sessions
+
+    def create_checkout_session(self, params):
+        options = {'idempotency_key': f'checkout-{uuid.uuid4()}'}
+        session = self._call('session.create', lambda: self.client.checkout.sessions.create(params=params, options=options))
+        self.remember_session(session)
+        return session
+
+    async def acreate_checkout_session(self, params):
+        options = {'idempotency_key': f'checkout-{uuid.uuid4()}'}
+        client = self.async_client()
+        session = await self._acall('session.create', lambda: client.checkout.sessions.create_async(params=params, options=options))
+        self.remember_session(session)
+        return session
+
+    def retrieve_checkout_session(self, session_id):
+        cached = cache.get(self._cache_key(session_id))
+        if cached is not None:
+            self.outcomes['session.retrieve', 'cached'] += 1
+            return stripe.checkout.Session.construct_from(cached, self.api_key)
+        session = self._call('session.retrieve', lambda: self.client.checkout.sessions.retrieve(session_id))
+        self.remember_session(session)
+        return session
+
+    def remember_session(self, session):
+        """Cache a session object, e.g. the fresher copy a webhook event carries."""
+        if self.session_cache_timeout:
+            cache.set(self._cache_key(session['id']), json.loads(str(session)), self.session_cache_timeout)
+
+    def _cache_key(self, session_id):
+        return f'stripe:session:{session_id}'
+
+    # retries and circuit breaking
+
+    def retryable(self, error):
+        if isinstance(error, PaymentGatewayUnavailable):
+            return False
+        if isinstance(error, (stripe.APIConnectionError, stripe.RateLimitError)):
+            return True
+        return (error.http_status or 0) >= 500
+
+    def retry_delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _before_call(self, operation):
+        if not self.breaker.allow():
+            self.outcomes[operation, 'rejected'] += 1
+            raise PaymentGatewayUnavailable('Stripe is unavailable, try again shortly')
+
+    def _attempt_failed(self, operation, error, attempt):
+        """True when the call should be retried, otherwise settles the breaker."""
+        if not self.retryable(error):
+            # Stripe answered; the request itself was refused
+            self.breaker.record_success()
+            self.outcomes[operation, 'error'] += 1
+            return False
+        if attempt < self.max_retries:
+            self.outcomes[operation, 'retry'] += 1
+            return True
+        self.breaker.record_failure()
+        self.outcomes[operation, 'failed'] += 1
+        return False
+
+    def _succeeded(self, operation):
+        self.breaker.record_success()
+        self.outcomes[operation, 'ok'] += 1
+
+    def _unsettled(self, error):
+        # Stripe errors have settled the breaker; anything else (a cancelled
+        # request, a bug) must not leave a half-open trial held forever
+        if not isinstance(error, stripe.StripeError):
+            self.breaker.release_trial()
+
+    def _call(self, operation, request):
+        self._before_call(operation)
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with self.latency[operation].time():
+                        result = request()
+                except stripe.StripeError as error:
+                    if not self._attempt_failed(operation, error, attempt):
+                        raise
+                    self.sleep(self.retry_delay(attempt))
+                else:
+                    self._succeeded(operation)
+                    return result
+        except BaseException as error:
+            self._unsettled(error)
+            raise
+
+    async def _acall(self, operation, request):
+        self._before_call(operation)
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with self.latency[operation].time():
+                        result = await request()
+                except stripe.StripeError as error:
+                    if not self._attempt_failed(operation, error, attempt):
+                        raise
+                    await asyncio.sleep(self.retry_delay(attempt))
+                else:
+                    self._succeeded(operation)
+                    return result
+        except BaseException as error:
+            self._unsettled(error)
+            raise
+
+    def stats(self):
+        return {
+            'breaker': self.breaker.state,
+            'outcomes': {f'{operation}:{outcome}': count for (operation, outcome), count in self.outcomes.items()},
+            'latency': {operation: histogram.snapshot() for operation, histogram in self.latency.items()},
+        }
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide gateway, rebuilt when the Stripe key or address settings change."""
+    global _gateway
+    gateway = _gateway
+    if gateway is None or (gateway.api_key, gateway.api_base) != (settings.STRIPE_SECRET_KEY, settings.STRIPE_API_BASE):
+        with _gateway_lock:
+            gateway = _gateway
+            if gateway is None or (gateway.api_key, gateway.api_base) != (settings.STRIPE_SECRET_KEY, settings.STRIPE_API_BASE):
+                gateway = _gateway = StripeGateway(
+                    settings.STRIPE_SECRET_KEY,
+                    settings.STRIPE_API_BASE,
+                    timeout=settings.STRIPE_TIMEOUT,
+                    max_retries=settings.STRIPE_MAX_RETRIES,
+                    pool_size=settings.STRIPE_POOL_SIZE,
+                    breaker=CircuitBreaker(settings.STRIPE_BREAKER_THRESHOLD, settings.STRIPE_BREAKER_RESET),
+                    session_cache_timeout=settings.STRIPE_SESSION_CACHE_TIMEOUT,
+                )
+    return gateway
@@ -0,0 +1,194 @@
+"""
+Product search for /products/search/ and /products/autocomplete/.
+
+By default matching and ranking use the store_productsearch vectors
+(PostgreSQL full text search over a GIN index) and facet counts for the
+matched products come from one GROUPING SETS query. With
+PRODUCT_SEARCH_BACKEND = 'memory' the in-process index of
+store/search_index.py ranks the products instead, and facets are counted
+with plain grouped queries, so search also works on SQLite.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from rest_framework.exceptions import ValidationError
+
+from store.models import Category, Color, Product, Size
+from store.search_index import get_index, search_index_enabled, tokenize
+
+
+def price_bands():
+    """[(label, lower, upper)] from PRODUCT_PRICE_BANDS; the last band is open ended."""
+    bounds = [Decimal(bound) for bound in settings.PRODUCT_PRICE_BANDS]
+    bands = []
+    for lower, upper in zip(bounds, bounds[1:] + [None]):
+        label = f'{lower}-{upper}' if upper is not None else f'{lower}+'
+        bands.append((label, lower, upper))
+    return bands
+
+
+def search_products(queryset, params):
+    """
+    Narrow queryset by the search query string parameters:
+
+    q           full-text query (websearch syntax), results ranked by relevance
+    category    category id
+    color       color title
+    size        size title
+    price_band  one of the price_bands() labels, e.g. `25-50` or `250+`
+    in_stock    true / false
+    """
+    text = params.get('q', '').strip()
+    if text and search_index_enabled():
+        hits = get_index().search(text, limit=settings.PRODUCT_SEARCH_MAX_HITS)
+        queryset = queryset.filter(pk__in=[pk for pk, score in hits]).annotate(
+            search_position=position_of([pk for pk, score in hits]),
+        ).order_by('search_position')
+    elif text:
+        query = SearchQuery(text, config=settings.PRODUCT_SEARCH_CONFIG, search_type='websearch')
+        queryset = queryset.filter(search__vector=query).annotate(
+            rank=SearchRank(F('search__vector'), query),
+        ).order_by('-rank', '-id')
+    else:
+        queryset = queryset.order_by('-date', '-id')
+
+    category = params.get('category')
+    if category:
+        try:
+            queryset = queryset.filter(category_id=int(category))
+        except ValueError:
+            raise ValidationError({'category': 'Must be a category id.'})
+    if params.get('color'):
+        queryset = queryset.filter(pk__in=Color.objects.filter(title=params['color']).values('product_id'))
+    if params.get('size'):
+        queryset = queryset.filter(pk__in=Size.objects.filter(title=params['size']).values('product_id'))
+
+    band = params.get('price_band')
+    if band:
+        for label, lower, upper in price_bands():
+            if label == band:
+                queryset = queryset.filter(price__gte=lower)
+                if upper is not None:
+                    queryset = queryset.filter(price__lt=upper)
+                break
+        else:
+            raise ValidationError({'price_band': f"Must be one of {', '.join(b[0] for b in price_bands())}."})
+
+    in_stock = params.get('in_stock')
+    if in_stock:
+        if in_stock.lower() not in ('true', 'false', '1', '0'):
+            raise ValidationError({'in_stock': 'Must be true or false.'})
+        queryset = queryset.filter(inStock=in_stock.lower() in ('true', '1'))
+    return queryset
+
+
+def position_of(pks):
+    """Annotation numbering pks in the given order, to order by a ranking made outside the database."""
+    if not pks:
+        return Value(0, output_field=IntegerField())
+    return Case(*[When(pk=pk, then=Value(i)) for i, pk in enumerate(pks)], output_field=IntegerField())
+
+
+def autocomplete(text, limit=10):
+    """[{'id', 'title', 'slug'}] of the best products for a partially typed query."""
+    words = tokenize(text)
+    if not words:
+        return []
+    if search_index_enabled():
+        pks = [pk for pk, score in get_index().search(text, limit=limit, prefix=True)]
+        products = Product.objects.filter(pk__in=pks).annotate(search_position=position_of(pks))
+        return list(products.order_by('search_position').values('id', 'title', 'slug'))
+
+    query = SearchQuery(
+        ' & '.join(words[:-1] + [f'{words[-1]}:*']),
+        config=settings.PRODUCT_SEARCH_CONFIG, search_type='raw',
+    )
+    products = Product.objects.filter(search__vector=query).annotate(rank=SearchRank(F('search__vector'), query))
+    return list(products.order_by('-rank', '-id').values('id', 'title', 'slug')[:limit])
+
+
+def facet_counts(queryset):
+    """
+    Count the products of queryset per category, color, size, price band and
+    inStock, in a single GROUPING SETS query on PostgreSQL.
+    """
+    facets = {'category': [], 'color': [], 'size': [], 'price_band': [], 'inStock': []}
+    bands = price_bands()
+    try:
+        matched_sql, matched_params = queryset.order_by().values('pk').query.sql_with_params()
+    except EmptyResultSet:
+        return facets
+    if connection.vendor != 'postgresql':
+        return grouped_facet_counts(queryset, facets, bands)
+
+    qn = connection.ops.quote_name
+
+    band_case = 'CASE %s END' % ' '.join(
+        f"WHEN {qn('price')} >= %s THEN {index}" for index in reversed(range(len(bands)))
+    )
+    band_params = [lower for label, lower, upper in reversed(bands)]
+
+    sql = (
+        f"SELECT GROUPING(p.{qn('category_id')}), GROUPING(col.{qn('title')}), GROUPING(sz.{qn('title')}), "
+        f"GROUPING(p.band), GROUPING(p.{qn('inStock')}), "
+        f"p.{qn('category_id')}, cat.{qn('title')}, col.{qn('title')}, sz.{qn('title')}, p.band, p.{qn('inStock')}, "
+        f"COUNT(DISTINCT p.{qn('id')}) "
+        f"FROM (SELECT {qn('id')}, {qn('category_id')}, {qn('inStock')}, {band_case} AS band "
+        f"FROM {qn(Product._meta.db_table)} WHERE {qn('id')} IN ({matched_sql})) p "
+        f"LEFT JOIN {qn(Category._meta.db_table)} cat ON cat.{qn('id')} = p.{qn('category_id')} "
+        f"LEFT JOIN {qn(Color._meta.db_table)} col ON col.{qn('product_id')} = p.{qn('id')} "
+        f"LEFT JOIN {qn(Size._meta.db_table)} sz ON sz.{qn('product_id')} = p.{qn('id')} "
+        f"GROUP BY GROUPING SETS ("
+        f"(p.{qn('category_id')}, cat.{qn('title')}), (col.{qn('title')}), (sz.{qn('title')}), "
+        f"(p.band), (p.{qn('inStock')}))"
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, band_params + list(matched_params))
+        rows = cursor.fetchall()
+
+    for g_category, g_color, g_size, g_band, g_stock, category_id, category_title, color, size, band, in_stock, count in rows:
+        if not g_category:
+            facets['category'].append({'id': category_id, 'title': category_title, 'count': count})
+        elif not g_color and color is not None:
+            facets['color'].append({'value': color, 'count': count})
+        elif not g_size and size is not None:
+            facets['size'].append({'value': size, 'count': count})
+        elif not g_band and band is not None:
+            facets['price_band'].append({'value': bands[band][0], 'count': count})
+        elif not g_stock:
+            facets['inStock'].append({'value': in_stock, 'count': count})
+    return sort_facets(facets, bands)
+
+
+def grouped_facet_counts(queryset, facets, bands):
+    """The same counts as facet_counts() with one grouped query per facet, for other databases."""
+    matched = Product.objects.filter(pk__in=queryset.order_by().values('pk'))
+
+    for row in matched.values('category_id', 'category__title').annotate(count=Count('pk')).order_by():
+        facets['category'].append({'id': row['category_id'], 'title': row['category__title'], 'count': row['count']})
+    for name, model in (('color', Color), ('size', Size)):
+        rows = model.objects.filter(product__in=matched).exclude(title=None).values('title')
+        for row in rows.annotate(count=Count('product_id', distinct=True)).order_by():
+            facets[name].append({'value': row['title'], 'count': row['count']})
+    band = Case(
+        *[When(price__gte=lower, then=Value(index)) for index, (label, lower, upper) in reversed(list(enumerate(bands)))],
+        output_field=IntegerField(),
+    )
+    for row in matched.annotate(band=band).exclude(band=None).values('band').annotate(count=Count('pk')).order_by():
+        facets['price_band'].append({'value': bands[row['band']][0], 'count': row['count']})
+    for row in matched.values('inStock').annotate(count=Count('pk')).order_by():
+        facets['inStock'].append({'value': row['inStock'], 'count': row['count']})
+    return sort_facets(facets, bands)
+
+
+def sort_facets(facets, bands):
+    labels = [label for label, lower, upper in bands]
+    facets['price_band'].sort(key=lambda value: labels.index(value['value']))
+    for name in ('category', 'color', 'size', 'inStock'):
+        facets[name].sort(key=lambda value: -value['count'])
+    return facets
@@ -0,0 +1,460 @@
+"""
+In-process inverted index for product search on deployments without
+PostgreSQL full-text search (SQLite, local development).
+
+Enabled with PRODUCT_SEARCH_BACKEND = 'memory'. The index is built from the
+Product, Specification, Color and Size tables on first use and then kept
+current by the save/delete signals connected in store/models.py. It lives in
+the worker process that built it: a write made by another process is only
+picked up after that process restarts, so this is meant for single-process
+servers, not for production fleets (use the PostgreSQL backend there).
+"""
+import math
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from heapq import heappop, heappush, heapreplace, merge, nlargest
+
+from django.conf import settings
+from django.db import transaction
+
+TOKEN_RE = re.compile(r'\w+')
+
+# a title term counts as this many occurrences of the same term elsewhere
+FIELD_WEIGHTS = {'title': 3, 'description': 1, 'specification': 1, 'color': 1, 'size': 1}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class InvertedIndex:
+    """
+    Term -> posting list index with BM25 ranking.
+
+    Posting lists are two parallel arrays per term: ascending document
+    numbers ('I') and term frequencies ('H'). Every (re)indexed product gets a
+    new, higher document number, so updates are appends; the superseded
+    number is tombstoned and the lists are compacted once tombstones make up
+    a quarter of the documents.
+    """
+    k1 = 1.2
+    b = 0.75
+    max_prefix_terms = 64
+    # repeated queries are answered from here until the next add/remove
+    result_cache_size = 1024
+    # terms whose frequency tiers (sets of document numbers) are kept for multi-word queries
+    tier_cache_size = 64
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.postings = {}
+        self.frequencies = {}
+        self.doc_pks = array('q')
+        self.doc_lengths = array('I')
+        self.docs = {}
+        self.deleted = set()
+        self.total_length = 0
+        self._vocabulary = None
+        self._impact_cache = {}
+        self._tier_cache = OrderedDict()
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, pk, fields):
+        """(Re)index product pk from {field name: text}."""
+        counts = Counter()
+        for name, text in fields.items():
+            weight = FIELD_WEIGHTS[name]
+            for term in tokenize(text):
+                counts[term] += weight
+        length = sum(counts.values())
+
+        with self._lock:
+            self._remove(pk)
+            self._results.clear()
+            doc = len(self.doc_pks)
+            self.doc_pks.append(pk)
+            self.doc_lengths.append(length)
+            for term, tf in counts.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = array('I')
+                    self.frequencies[term] = array('H')
+                    self._vocabulary = None
+                postings.append(doc)
+                self.frequencies[term].append(min(tf, 0xFFFF))
+            self.docs[pk] = doc
+            self.total_length += length
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+            self._results.clear()
+
+    def _remove(self, pk):
+        # also reached from add(), whose re-indexing tombstones the old number
+        doc = self.docs.pop(pk, None)
+        if doc is not None:
+            self.deleted.add(doc)
+            self.total_length -= self.doc_lengths[doc]
+            if len(self.deleted) > 1000 and len(self.deleted) * 4 > len(self.doc_pks):
+                self.compact()
+
+    def compact(self):
+        """Drop tombstoned documents and renumber the rest."""
+        with self._lock:
+            renumber = {}
+            doc_pks, doc_lengths = array('q'), array('I')
+            for doc, pk in enumerate(self.doc_pks):
+                if doc not in self.deleted:
+                    renumber[doc] = len(doc_pks)
+                    doc_pks.append(pk)
+                    doc_lengths.append(self.doc_lengths[doc])
+
+            postings, frequencies = {}, {}
+            for term, docs in self.postings.items():
+                kept_docs, kept_tfs = array('I'), array('H')
+                for doc, tf in zip(docs, self.frequencies[term]):
+                    new = renumber.get(doc)
+                    if new is not None:
+                        kept_docs.append(new)
+                        kept_tfs.append(tf)
+                if kept_docs:
+                    postings[term] = kept_docs
+                    frequencies[term] = kept_tfs
+
+            self.postings, self.frequencies = postings, frequencies
+            self.doc_pks, self.doc_lengths = doc_pks, doc_lengths
+            self.docs = {pk: doc for doc, pk in enumerate(doc_pks)}
+            self.deleted = set()
+            self._vocabulary = None
+            self._impact_cache = {}
+            self._tier_cache = OrderedDict()
+            self._results.clear()
+
+    def expand(self, prefix):
+        """Indexed terms starting with prefix, most frequent first."""
+        with self._lock:
+            if self._vocabulary is None:
+                self._vocabulary = sorted(self.postings)
+            vocabulary = self._vocabulary
+            terms = []
+            for term in vocabulary[bisect_left(vocabulary, prefix):]:
+                if not term.startswith(prefix):
+                    break
+                terms.append(term)
+            if len(terms) > self.max_prefix_terms:
+                terms = nlargest(self.max_prefix_terms, terms, key=lambda term: len(self.postings[term]))
+            return terms
+
+    def search(self, text, limit=20, prefix=False):
+        """
+        [(pk, score)] of the best products matching every word of text, best
+        first. With prefix=True the last word also matches longer terms
+        ("cott" finds "cotton"), for search-as-you-type.
+
+        One word (or one prefix) is walked in descending score order and the
+        walk stops once no unseen document can beat the current top `limit`
+        (Fagin's threshold algorithm), so common words do not cost a full
+        posting list scan. Several plain words are answered by _tiered().
+        """
+        words = tokenize(text)
+        if not words:
+            return []
+        key = (tuple(words), limit, prefix)
+        with self._lock:
+            results = self._results.get(key)
+            if results is None:
+                results = self._results[key] = self._search(words, limit, prefix)
+                if len(self._results) > self.result_cache_size:
+                    self._results.popitem(last=False)
+            else:
+                self._results.move_to_end(key)
+            return list(results)
+
+    def _search(self, words, limit, prefix):
+        if not self.docs:
+            return []
+        groups = [[word] for word in words[:-1]]
+        groups.append(self.expand(words[-1]) if prefix else [words[-1]])
+        groups = [[term for term in group if term in self.postings] for group in groups]
+        if not all(groups):
+            return []
+
+        bm25 = self._bm25()
+        idfs = {term: bm25.idf(len(self.postings[term])) for group in groups for term in group}
+        if len(groups) > 1 and all(len(group) == 1 for group in groups):
+            return self._tiered([group[0] for group in groups], limit, idfs, bm25)
+        walks = [self._walk(group, idfs, bm25) for group in groups]
+        # the last score read from each walk bounds what unseen documents can still get
+        frontier = [math.inf] * len(groups)
+        seen = set()
+        top = []
+        while walks:
+            for position, walk in enumerate(walks):
+                step = next(walk, None)
+                if step is None:
+                    # a word ran out: every full match has been seen already
+                    walks = []
+                    break
+                frontier[position], doc = step
+                if doc in seen:
+                    continue
+                seen.add(doc)
+                score = 0
+                for other, group in enumerate(groups):
+                    part = step[0] if other == position else self._lookup(group, doc, idfs, bm25)
+                    if part is None:
+                        break
+                    score += part
+                else:
+                    if len(top) < limit:
+                        heappush(top, (score, doc))
+                    elif (score, doc) > top[0]:
+                        heapreplace(top, (score, doc))
+            if len(top) == limit and sum(frontier) <= top[0][0]:
+                break
+        return [(self.doc_pks[doc], score) for score, doc in sorted(top, reverse=True)]
+
+    def _tiered(self, terms, limit, idfs, bm25):
+        """
+        Several words, each splitting its postings into tiers of equal term
+        frequency (_tiers()). Tier combinations are taken best upper bound
+        first; each is intersected as sets, smallest first, and what is left
+        is scored exactly. Every document sits in exactly one
+        combination, so the search stops at the first combination whose bound
+        cannot beat the current top `limit`. Common words that tie in the
+        threshold walk (say three title words of a tenth of the catalog each)
+        only meet in their title tiers, which are small and few.
+        """
+        dims = []
+        for term in terms:
+            bounded = [(idfs[term] * tier.bound(bm25), tier) for tier in self._tiers(term)]
+            bounded.sort(key=lambda pair: -pair[0])
+            dims.append(bounded)
+
+        def bound(combo):
+            return sum(dims[i][j][0] for i, j in enumerate(combo))
+
+        start = (0,) * len(dims)
+        queue = [(-bound(start), start)]
+        queued = {start}
+        deleted = self.deleted
+        top = []
+        while queue:
+            negative, combo = heappop(queue)
+            if len(top) == limit and -negative <= top[0][0]:
+                break
+            tiers = [dims[i][j][1] for i, j in enumerate(combo)]
+            sets = sorted((tier.docs for tier in tiers), key=len)
+            for doc in sets[0].intersection(*sets[1:]):
+                if doc in deleted:
+                    continue
+                score = sum(idfs[term] * bm25.tf_score(tier.tf, doc) for term, tier in zip(terms, tiers))
+                if len(top) < limit:
+                    heappush(top, (score, doc))
+                elif (score, doc) > top[0]:
+                    heapreplace(top, (score, doc))
+            for i in range(len(combo)):
+                if combo[i] + 1 < len(dims[i]):
+                    following = combo[:i] + (combo[i] + 1,) + combo[i + 1:]
+                    if following not in queued:
+                        queued.add(following)
+                        heappush(queue, (-bound(following), following))
+        return [(self.doc_pks[doc], score) for score, doc in sorted(top, reverse=True)]
+
+    def _tiers(self, term):
+        """The postings of term grouped by term frequency; cached until the term gets new postings."""
+        docs = self.postings[term]
+        cached = self._tier_cache.get(term)
+        if cached is not None and cached[0] == len(docs):
+            self._tier_cache.move_to_end(term)
+            return cached[1]
+        by_tf = {}
+        for doc, tf in zip(docs, self.frequencies[term]):
+            by_tf.setdefault(tf, set()).add(doc)
+        lengths = self.doc_lengths
+        tiers = [_Tier(tf, min(lengths[doc] for doc in tier_docs), tier_docs) for tf, tier_docs in by_tf.items()]
+        self._tier_cache[term] = (len(docs), tiers)
+        self._tier_cache.move_to_end(term)
+        if len(self._tier_cache) > self.tier_cache_size:
+            self._tier_cache.popitem(last=False)
+        return tiers
+
+    def _bm25(self):
+        n = len(self.docs)
+        return _BM25(self.k1, self.b, n, self.total_length / n or 1, self.doc_lengths)
+
+    def _impacts(self, term, bm25):
+        """
+        (docs, impacts) of term sorted by descending idf-less BM25 score. Cached
+        per term; documents appended since are merged in by _walk() until they
+        outgrow a tenth of the cached list or the average length drifts.
+        """
+        docs, tfs = self.postings[term], self.frequencies[term]
+        cached = self._impact_cache.get(term)
+        if cached is not None:
+            size, slope, sorted_docs, impacts = cached
+            if (len(docs) - size) * 10 <= size and abs(slope - bm25.slope) <= bm25.slope * 0.01:
+                return sorted_docs, impacts, size
+        pairs = sorted(
+            ((bm25.tf_score(tf, doc), doc) for doc, tf in zip(docs, tfs)),
+            key=lambda pair: -pair[0],
+        )
+        sorted_docs = array('I', (doc for impact, doc in pairs))
+        impacts = array('d', (impact for impact, doc in pairs))
+        self._impact_cache[term] = (len(docs), bm25.slope, sorted_docs, impacts)
+        return sorted_docs, impacts, len(docs)
+
+    def _term_walk(self, term, idf, bm25):
+        sorted_docs, impacts, size = self._impacts(term, bm25)
+        docs, tfs = self.postings[term], self.frequencies[term]
+        walk = zip(impacts, sorted_docs)
+        if size < len(docs):
+            tail = sorted(
+                ((bm25.tf_score(tfs[i], docs[i]), docs[i]) for i in range(size, len(docs))),
+                key=lambda pair: -pair[0],
+            )
+            walk = merge(walk, tail, key=lambda pair: -pair[0])
+        deleted = self.deleted
+        for impact, doc in walk:
+            if doc not in deleted:
+                yield idf * impact, doc
+
+    def _walk(self, terms, idfs, bm25):
+        """(score, doc) of the documents matching any of terms, best first."""
+        if len(terms) == 1:
+            yield from self._term_walk(terms[0], idfs[terms[0]], bm25)
+            return
+        # a word matching through several prefix terms counts with its best one
+        seen = set()
+        walks = [self._term_walk(term, idfs[term], bm25) for term in terms]
+        for score, doc in merge(*walks, key=lambda pair: -pair[0]):
+            if doc not in seen:
+                seen.add(doc)
+                yield score, doc
+
+    def _lookup(self, terms, doc, idfs, bm25):
+        """Best score of doc for any of terms, None when it contains none of them."""
+        best = None
+        for term in terms:
+            docs = self.postings[term]
+            i = bisect_left(docs, doc)
+            if i < len(docs) and docs[i] == doc:
+                score = idfs[term] * bm25.tf_score(self.frequencies[term][i], doc)
+                if best is None or score > best:
+                    best = score
+        return best
+
+
+class _Tier:
+    """The documents containing a term exactly tf times (a set), and the length of the shortest."""
+    __slots__ = ('tf', 'min_length', 'docs')
+
+    def __init__(self, tf, min_length, docs):
+        self.tf = tf
+        self.min_length = min_length
+        self.docs = docs
+
+    def bound(self, bm25):
+        """Highest idf-less score of a document in the tier: the shortest one's."""
+        return self.tf * (bm25.k1 + 1) / (self.tf + bm25.norm + bm25.slope * self.min_length)
+
+
+class _BM25:
+    """Collection statistics of one query; scores are split into idf and tf parts."""
+
+    def __init__(self, k1, b, n, avg_length, lengths):
+        self.k1 = k1
+        self.n = n
+        self.norm = k1 * (1 - b)
+        self.slope = k1 * b / avg_length
+        self.lengths = lengths
+
+    def idf(self, df):
+        return math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+
+    def tf_score(self, tf, doc):
+        return tf * (self.k1 + 1) / (tf + self.norm + self.slope * self.lengths[doc])
+
+
+def product_documents(products):
+    """{pk: {field: text}} for a Product queryset, in four queries."""
+    from store.models import Color, Size, Specification
+
+    documents = {
+        pk: {'title': title, 'description': description or ''}
+        for pk, title, description in products.values_list('pk', 'title', 'description')
+    }
+    for name, model, column in (
+        ('specification', Specification, 'content'),
+        ('color', Color, 'title'),
+        ('size', Size, 'title'),
+    ):
+        texts = {}
+        rows = model.objects.filter(product__in=products.values('pk')).values_list('product_id', column)
+        for product_id, text in rows:
+            if text:
+                texts.setdefault(product_id, []).append(text)
+        for product_id, values in texts.items():
+            documents[product_id][name] = ' '.join(values)
+    return documents
+
+
+def build_index(products=None):
+    from store.models import Product
+
+    index = InvertedIndex()
+    for pk, fields in product_documents(products if products is not None else Product.objects.all()).items():
+        index.add(pk, fields)
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def search_index_enabled():
+    return getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'postgres') == 'memory'
+
+
+def get_index():
+    """The process-wide index, built from the database on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index()
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def reindex_product(product_id):
+    from store.models import Product
+
+    index = _index
+    if index is None:
+        return
+    documents = product_documents(Product.objects.filter(pk=product_id))
+    if product_id in documents:
+        index.add(product_id, documents[product_id])
+    else:
+        index.remove(product_id)
+
+
+def index_product_changed(sender, instance, **kwargs):
+    """post_save/post_delete of Product and of its Specification, Color and Size rows."""
+    if _index is None or not search_index_enabled():
+        return
+    product_id = instance.pk if sender._meta.model_name == 'product' else instance.product_id
+    if product_id is not None:
+        transaction.on_commit(lambda: reindex_product(product_id))
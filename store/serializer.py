@@ -1,45 +1,77 @@
+import copy
+
 from rest_framework import serializers
+from rest_framework.utils.field_mapping import get_nested_relation_kwargs
+from store.metrics import TimedSerializerMixin
 from store.models import (
     Product, Category, Specification, Color, Size, Gallery,
     Cart, CartOrder, CartOrderItem
 )
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CachedFieldsMixin:
+    """
+    Build the field map once per serializer class and hand each instance a
+    copy, instead of introspecting the model (and every nested depth level)
+    on every construction. The serializers generated for `depth` cache theirs
+    too.
+    """
+
+    def get_fields(self):
+        cls = type(self)
+        fields = cls.__dict__.get('_cached_fields')
+        if fields is None:
+            fields = super().get_fields()
+            cls._cached_fields = fields
+        return copy.deepcopy(fields)
+
+    def build_nested_field(self, field_name, relation_info, nested_depth):
+        class NestedSerializer(CachedFieldsMixin, serializers.ModelSerializer):
+            class Meta:
+                model = relation_info.related_model
+                depth = nested_depth - 1
+                fields = '__all__'
+
+        return NestedSerializer, get_nested_relation_kwargs(relation_info)
+
+
+class CategorySerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
 
-class SpecificationSerializer(serializers.ModelSerializer):
+class SpecificationSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Specification
         fields = '__all__'
 
 
-class ColorSerializer(serializers.ModelSerializer):
+class ColorSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Color
         fields = '__all__'
 
 
-class SizeSerializer(serializers.ModelSerializer):
+class SizeSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Size
         fields = '__all__'
 
 
-class GallerySerializer(serializers.ModelSerializer):
+class GallerySerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Gallery
         fields = '__all__'
 
 
-class ProductSerializer(serializers.ModelSerializer):
-    gallery = GallerySerializer(many=True, read_only=True)
-    color = ColorSerializer(many=True, read_only=True)
-    size = SizeSerializer(many=True, read_only=True)
-    specification = SpecificationSerializer(many=True, read_only=True)
+class ProductSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    # Read the reverse relations directly so Product.objects.catalog() prefetches are used.
+    gallery = GallerySerializer(many=True, read_only=True, source='gallery_set')
+    color = ColorSerializer(many=True, read_only=True, source='color_set')
+    size = SizeSerializer(many=True, read_only=True, source='size_set')
+    specification = SpecificationSerializer(many=True, read_only=True, source='specification_set')
+    orders = serializers.IntegerField(source='orders_count', read_only=True)
 
     class Meta:
         model = Product
@@ -48,58 +80,53 @@ class ProductSerializer(serializers.ModelSerializer):
             'old_price', 'shipping_amount', 'stock_qty', 'inStock',
             'status', 'featured', 'views', 
             'gallery', 'color', 'size', 'specification',
-             'orders',
+             'orders', 'units_sold',
             'pid', 'slug', 'date'
         ]
-
-    def __init__(self, *args, **kwargs):
-        super(ProductSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get('request')
-        if request and request.method == 'POST':
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+        depth = 3
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Cart
         fields = '__all__'
+        depth = 3
+
 
-    def __init__(self, *args, **kwargs):
-        super(CartSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get('request')
-        if request and request.method == 'POST':
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+class CartWriteSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Cart
+        fields = '__all__'
+        depth = 0
 
 
-class CartOrderItemSerializer(serializers.ModelSerializer):
+class CartOrderItemSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CartOrderItem
         fields = '__all__'
+        depth = 3
+
 
-    def __init__(self, *args, **kwargs):
-        super(CartOrderItemSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get('request')
-        if request and request.method == 'POST':
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+class CartOrderItemWriteSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = CartOrderItem
+        fields = '__all__'
+        depth = 0
 
 
-class CartOrderSerializer(serializers.ModelSerializer):
+class CartOrderSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     orderItem = CartOrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = CartOrder
         fields = '__all__'
+        depth = 3
 
-    def __init__(self, *args, **kwargs):
-        super(CartOrderSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get('request')
-        if request and request.method == 'POST':
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+
+class CartOrderWriteSerializer(CachedFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    orderItem = CartOrderItemWriteSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = CartOrder
+        fields = '__all__'
+        depth = 0
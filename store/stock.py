@@ -0,0 +1,55 @@
+from django.db import connection
+
+from store.cache import bump_catalog_version
+from store.models import Product
+
+
+def reserve_stock(quantities):
+    """
+    Take {product_id: qty} out of stock in a single conditional UPDATE.
+
+    A product is only decremented when it still has at least the requested
+    quantity, and inStock is cleared for products that reach zero in the same
+    statement. Returns the set of product ids that could not be fulfilled.
+    """
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return set()
+
+    qn = connection.ops.quote_name
+    table = qn(Product._meta.db_table)
+    pk = qn(Product._meta.pk.column)
+    stock_qty = qn(Product._meta.get_field('stock_qty').column)
+    in_stock = qn(Product._meta.get_field('inStock').column)
+
+    requested = 'CASE %s %s END' % (pk, ' '.join(['WHEN %s THEN %s'] * len(quantities)))
+    requested_params = [value for item in quantities.items() for value in item]
+    ids = ', '.join(['%s'] * len(quantities))
+
+    sql = (
+        f'UPDATE {table} SET '
+        f'{stock_qty} = {stock_qty} - {requested}, '
+        f'{in_stock} = ({in_stock} AND {stock_qty} - {requested} > 0) '
+        f'WHERE {pk} IN ({ids}) AND {stock_qty} >= {requested} '
+        f'RETURNING {pk}'
+    )
+    params = requested_params * 2 + list(quantities) + requested_params
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        reserved = {row[0] for row in cursor.fetchall()}
+    if reserved:
+        bump_catalog_version()
+    return set(quantities) - reserved
+
+
+def reserve_order_stock(order_items):
+    """
+    Reserve stock for the lines of an order. Lines for the same product are
+    reserved together; returns the lines that could not be fulfilled.
+    """
+    quantities = {}
+    for item in order_items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.qty
+    unfulfilled = reserve_stock(quantities)
+    return [item for item in order_items if item.product_id in unfulfilled]
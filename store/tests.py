@@ -1,3 +1,1375 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from threading import Barrier, Lock, Thread
+from unittest import mock, skipIf, skipUnless
+from urllib.parse import urlsplit
 
-# Create your tests here.
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.serializers import ModelSerializer
+from rest_framework.test import APIClient, force_authenticate
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from account.models import User
+from account.serializer import MyTokenObtainPairSerializer
+from api.models import EmailOutbox
+from store import cache as catalog_cache, fast_serializer, search_index
+from store.export import export_blocks, order_export_queryset
+from store.fake_stripe import FakeStripe, sign_payload
+from store.metrics import Histogram
+from store.models import (
+    Category, Product, Gallery, Color, Size, Specification,
+    Cart, CartOrder, CartOrderItem, CartQuerySet, StripeEvent
+)
+from store.payments import CircuitBreaker, PaymentGatewayUnavailable, StripeGateway
+from store.serializer import (
+    CartOrderItemSerializer, CartOrderItemWriteSerializer, CartOrderSerializer, CartOrderWriteSerializer,
+    CartSerializer, CartWriteSerializer, ProductSerializer,
+)
+from store.stock import reserve_order_stock, reserve_stock
+from store.views import AsyncPaymentSuccessView, AsyncStripeCheckoutView, OrderExportAPIView
+
+
+def make_category():
+    return Category.objects.create(title='Shirts', slug='shirts')
+
+
+def make_buyer(**kwargs):
+    return User.objects.create(email='buyer@example.com', username='buyer', **kwargs)
+
+
+def make_product(category, title, **kwargs):
+    product = Product.objects.create(category=category, title=title, price=Decimal('10.00'), **kwargs)
+    Gallery.objects.create(product=product)
+    Color.objects.create(product=product, title='Red', color_code='#f00')
+    Size.objects.create(product=product, title='M', price=Decimal('1.00'))
+    Specification.objects.create(product=product, title='Material', content='Cotton')
+    return product
+
+
+def start_fake_stripe(test, **kwargs):
+    """Run a FakeStripe for the length of a test, with the gateway pointed at it."""
+    fake = test.enterContext(FakeStripe(**kwargs))
+    test.enterContext(override_settings(STRIPE_API_BASE=fake.api_base))
+    return fake
+
+
+class WebhookReceiver(BaseHTTPRequestHandler):
+    """Stands in for the shop's webhook endpoint and keeps what is posted to it."""
+
+    def do_POST(self):
+        payload = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        self.server.received.append((payload, self.headers['Stripe-Signature']))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ProductCatalogQueryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = make_category()
+
+    def test_product_list_query_count_is_constant(self):
+        for i in range(3):
+            make_product(self.category, f'Shirt {i}')
+        # product + category join, four prefetches
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('product-list'))
+        self.assertEqual(len(response.data['results']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3, 10):
+                make_product(self.category, f'Shirt {i}')
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('product-list'))
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_product_payload_reads_prefetched_relations(self):
+        product = make_product(self.category, 'Blue Shirt')
+        user = make_buyer()
+        order = CartOrder.objects.create(buyer=user)
+        CartOrderItem.objects.create(order=order, product=product)
+        CartOrderItem.objects.create(order=order, product=product)
+        call_command('rebuild_product_counters', stdout=StringIO())
+
+        response = self.client.get(reverse('product-detail', kwargs={'slug': product.slug}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['orders'], 2)
+        self.assertEqual(response.data['category']['slug'], 'shirts')
+        self.assertEqual(response.data['color'][0]['title'], 'Red')
+        self.assertEqual(response.data['size'][0]['title'], 'M')
+        self.assertEqual(response.data['specification'][0]['content'], 'Cotton')
+        self.assertEqual(len(response.data['gallery']), 1)
+
+
+class CatalogPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = make_category()
+        self.products = [
+            Product.objects.create(category=category, title=f'Shirt {i}', price=Decimal('10.00'))
+            for i in range(5)
+        ]
+
+    def test_products_are_walked_newest_first_without_overlap(self):
+        seen = []
+        url = reverse('product-list') + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(seen, [p.id for p in reversed(self.products)])
+
+    def test_ties_longer_than_the_offset_cutoff_are_walked_to_the_end(self):
+        catalog_cache.catalog_cache().clear()
+        Product.objects.filter(pk=self.products[1].pk).update(orders_count=5)
+        Product.objects.bulk_create([
+            Product(category=self.products[0].category, title=f'Unsold {i}', slug=f'unsold-{i}', price=Decimal('10.00'))
+            for i in range(1100)
+        ])
+        ids = list(Product.objects.order_by('-orders_count', '-id').values_list('id', flat=True))
+
+        seen, pages = [], 0
+        url = reverse('product-list') + '?ordering=-orders_count&page_size=100'
+        while url:
+            response = self.client.get(url)
+            seen.extend(item['id'] for item in response.data['results'])
+            last_page, url = response.data, response.data['next']
+            pages += 1
+            self.assertLessEqual(pages, 12)
+
+        self.assertEqual(seen, ids)
+        previous = self.client.get(last_page['previous']).data
+        self.assertEqual([item['id'] for item in previous['results']], ids[1000:1100])
+
+    def test_large_page_size_returns_single_page(self):
+        response = self.client.get(reverse('product-list') + '?page_size=1000')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+
+    def test_categories_without_titles_are_walked_by_slug(self):
+        catalog_cache.catalog_cache().clear()
+        Category.objects.bulk_create([Category(title=None, slug=f'untitled-{i}') for i in range(4)])
+        seen = []
+        url = reverse('category-list') + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            seen.extend(item['slug'] for item in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(seen, ['shirts', 'untitled-0', 'untitled-1', 'untitled-2', 'untitled-3'])
+
+
+class ProductCounterTest(TestCase):
+    def setUp(self):
+        catalog_cache.catalog_cache().clear()
+        self.client = APIClient()
+        self.user = make_buyer()
+        category = make_category()
+        self.shirt = Product.objects.create(category=category, title='Shirt', price=Decimal('10.00'))
+        self.hat = Product.objects.create(category=category, title='Hat', price=Decimal('5.00'))
+
+    def add_to_cart(self, product, qty):
+        Cart.objects.create(cart_id='c1', user=self.user, product=product, qty=qty, price=product.price,
+                            sub_total=product.price * qty, total=product.price * qty)
+
+    def test_checkout_bumps_order_counters(self):
+        self.add_to_cart(self.shirt, 2)
+        self.add_to_cart(self.hat, 1)
+        self.client.post(reverse('cart-order-create'), {'cart_id': 'c1', 'user_id': self.user.id}, format='json')
+        self.add_to_cart(self.shirt, 3)
+        self.client.post(reverse('cart-order-create'), {'cart_id': 'c1', 'user_id': self.user.id}, format='json')
+
+        self.shirt.refresh_from_db()
+        self.hat.refresh_from_db()
+        self.assertEqual((self.shirt.orders_count, self.shirt.units_sold), (2, 5))
+        self.assertEqual((self.hat.orders_count, self.hat.units_sold), (1, 1))
+
+    def test_order_revalidates_cached_product_pages(self):
+        url = reverse('product-detail', kwargs={'slug': self.shirt.slug})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.add_to_cart(self.shirt, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cart-order-create'), {'cart_id': 'c1', 'user_id': self.user.id}, format='json')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response['X-Cache'], response.data['orders'], response.data['units_sold']), ('MISS', 1, 2))
+
+    def test_rebuild_matches_order_items(self):
+        order = CartOrder.objects.create(buyer=self.user)
+        CartOrderItem.objects.create(order=order, product=self.shirt, qty=4)
+        Product.objects.filter(pk=self.hat.pk).update(orders_count=7, units_sold=9)
+
+        call_command('rebuild_product_counters', stdout=StringIO())
+
+        self.shirt.refresh_from_db()
+        self.hat.refresh_from_db()
+        self.assertEqual((self.shirt.orders_count, self.shirt.units_sold), (1, 4))
+        self.assertEqual((self.hat.orders_count, self.hat.units_sold), (0, 0))
+
+    def test_products_can_be_listed_by_popularity(self):
+        Product.objects.filter(pk=self.hat.pk).update(orders_count=3)
+        response = self.client.get(reverse('product-list') + '?ordering=-orders_count')
+        self.assertEqual([p['id'] for p in response.data['results']], [self.hat.id, self.shirt.id])
+
+    @override_settings(PRODUCT_VIEWS_FLUSH_EVERY=2)
+    def test_detail_views_are_written_in_batches(self):
+        url = reverse('product-detail', kwargs={'slug': self.shirt.slug})
+        self.client.get(url)
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.views, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(url)
+            self.client.get(url)
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.views, 2)
+        # the flush invalidated the cached page that still said 0
+        self.assertEqual(self.client.get(url).data['views'], 2)
+
+
+class CheckoutTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_buyer()
+        category = make_category()
+        self.products = [
+            Product.objects.create(category=category, title=f'Shirt {i}', price=Decimal('10.00'))
+            for i in range(6)
+        ]
+
+    def fill_cart(self, count):
+        for product in self.products[:count]:
+            Cart.objects.create(cart_id='c1', user=self.user, product=product, qty=2, price=Decimal('10.00'),
+                                sub_total=Decimal('20.00'), shipping_amount=Decimal('3.00'),
+                                total=Decimal('23.00'))
+
+    def checkout(self):
+        return self.client.post(reverse('cart-order-create'), {'cart_id': 'c1', 'user_id': self.user.id}, format='json')
+
+    def test_checkout_copies_lines_and_totals(self):
+        self.fill_cart(3)
+        response = self.checkout()
+
+        order = CartOrder.objects.get(oid=response.data['order_oid'])
+        self.assertEqual(order.sub_total, Decimal('60.00'))
+        self.assertEqual(order.shipping_amount, Decimal('9.00'))
+        self.assertEqual(order.total, Decimal('69.00'))
+        self.assertEqual(order.initial_total, Decimal('69.00'))
+        items = CartOrderItem.objects.filter(order=order)
+        self.assertEqual(items.count(), 3)
+        self.assertEqual(len({item.oid for item in items}), 3)
+        self.assertFalse(Cart.objects.filter(cart_id='c1').exists())
+
+    def test_checkout_query_count_does_not_grow_with_cart(self):
+        self.fill_cart(2)
+        with self.assertNumQueries(8):
+            self.checkout()
+        self.fill_cart(6)
+        with self.assertNumQueries(8):
+            self.checkout()
+
+    def test_line_added_after_the_lock_is_not_charged(self):
+        self.fill_cart(2)
+        create = CartOrder.objects.create
+
+        def create_after_a_concurrent_add(**kwargs):
+            Cart.objects.create(cart_id='c1', user=self.user, product=self.products[5], qty=1, price=Decimal('10.00'),
+                                sub_total=Decimal('10.00'), total=Decimal('10.00'))
+            return create(**kwargs)
+
+        with mock.patch.object(CartOrder.objects, 'create', side_effect=create_after_a_concurrent_add):
+            response = self.checkout()
+
+        order = CartOrder.objects.get(oid=response.data['order_oid'])
+        self.assertEqual(order.total, Decimal('46.00'))
+        self.assertEqual(CartOrderItem.objects.filter(order=order).count(), 2)
+        self.assertEqual(list(Cart.objects.filter(cart_id='c1').values_list('product', flat=True)), [self.products[5].id])
+
+    def test_failed_checkout_leaves_no_partial_order(self):
+        self.fill_cart(3)
+        with mock.patch.object(CartOrderItem.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+
+        self.assertFalse(CartOrder.objects.exists())
+        self.assertEqual(Cart.objects.filter(cart_id='c1').count(), 3)
+
+
+class CartTotalsTest(TestCase):
+    def setUp(self):
+        caches[settings.CART_TOTALS_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.user = make_buyer()
+        category = make_category()
+        self.products = [
+            Product.objects.create(category=category, title=f'Shirt {i}', price=Decimal('10.00'))
+            for i in range(4)
+        ]
+        self.lines = [
+            Cart.objects.create(cart_id='c1', user=self.user, product=product, qty=1, price=Decimal('10.00'),
+                                sub_total=Decimal('10.00'), shipping_amount=Decimal('2.00'),
+                                service_fee=Decimal('0.50'), text_fee=Decimal('1.00'), total=Decimal('13.50'))
+            for product in self.products
+        ]
+
+    def details(self):
+        return self.client.get(reverse('cart-details', kwargs={'cart_id': 'c1'}))
+
+    @override_settings(CART_TOTALS_CACHE_TIMEOUT=0)
+    def test_totals_use_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.details()
+        self.assertEqual(response.data, {
+            'shipping': Decimal('8.00'), 'tax': Decimal('4.00'), 'service_fee': Decimal('2.00'),
+            'sub_total': Decimal('40.00'), 'total': Decimal('54.00'),
+        })
+
+    @override_settings(CART_TOTALS_CACHE_TIMEOUT=300)
+    def test_cached_totals_follow_item_deletion(self):
+        self.details()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.details().data['total'], Decimal('54.00'))
+
+        self.client.delete(reverse('cart-item-delete', kwargs={'cart_id': 'c1', 'item_id': self.lines[0].id}))
+
+        self.assertEqual(self.details().data['total'], Decimal('40.50'))
+
+    @override_settings(CART_TOTALS_CACHE_TIMEOUT=300)
+    def test_fill_racing_a_write_is_not_served(self):
+        aggregate = CartQuerySet.totals
+
+        def racing_totals(queryset):
+            totals = aggregate(queryset)
+            # another request deletes a line between this aggregate and its cache fill
+            self.client.delete(reverse('cart-item-delete', kwargs={'cart_id': 'c1', 'item_id': self.lines[0].id}))
+            return totals
+
+        with mock.patch.object(CartQuerySet, 'totals', racing_totals):
+            self.assertEqual(self.details().data['total'], Decimal('54.00'))
+
+        self.assertEqual(self.details().data['total'], Decimal('40.50'))
+
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.shirt = Product.objects.create(title='Shirt', price=Decimal('10.00'), stock_qty=5)
+        self.hat = Product.objects.create(title='Hat', price=Decimal('5.00'), stock_qty=1)
+
+    def test_reserves_in_one_statement(self):
+        with self.assertNumQueries(1):
+            unfulfilled = reserve_stock({self.shirt.id: 2, self.hat.id: 1})
+
+        self.assertEqual(unfulfilled, set())
+        self.shirt.refresh_from_db()
+        self.hat.refresh_from_db()
+        self.assertEqual((self.shirt.stock_qty, self.shirt.inStock), (3, True))
+        self.assertEqual((self.hat.stock_qty, self.hat.inStock), (0, False))
+
+    def test_short_products_are_reported_and_left_alone(self):
+        unfulfilled = reserve_stock({self.shirt.id: 2, self.hat.id: 3})
+
+        self.assertEqual(unfulfilled, {self.hat.id})
+        self.hat.refresh_from_db()
+        self.assertEqual((self.hat.stock_qty, self.hat.inStock), (1, True))
+
+    def test_order_lines_for_one_product_are_reserved_together(self):
+        order = CartOrder.objects.create()
+        lines = [
+            CartOrderItem.objects.create(order=order, product=self.shirt, qty=3),
+            CartOrderItem.objects.create(order=order, product=self.shirt, qty=3),
+            CartOrderItem.objects.create(order=order, product=self.hat, qty=1),
+        ]
+
+        unfulfilled = reserve_order_stock(lines)
+
+        self.assertEqual(unfulfilled, lines[:2])
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock_qty, 5)
+
+
+@skipIf(connection.vendor == 'sqlite', "SQLite shared-cache test databases lock whole tables under concurrent writers")
+class StockConcurrencyTest(TransactionTestCase):
+    threads = 16
+    attempts_per_thread = 4
+
+    def test_concurrent_reservations_never_oversell(self):
+        product = Product.objects.create(title='Shirt', price=Decimal('10.00'), stock_qty=20)
+        barrier = Barrier(self.threads)
+        lock = Lock()
+        reserved = []
+
+        def buyer():
+            barrier.wait()
+            try:
+                for _ in range(self.attempts_per_thread):
+                    if not reserve_stock({product.id: 1}):
+                        with lock:
+                            reserved.append(1)
+            finally:
+                connection.close()
+
+        workers = [Thread(target=buyer) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(len(reserved), 20)
+        self.assertEqual(product.stock_qty, 0)
+        self.assertFalse(product.inStock)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(title='Shirt', price=Decimal('10.00'), stock_qty=5)
+        self.order = CartOrder.objects.create(email='buyer@example.com', full_name='Buyer', total=Decimal('20.00'))
+        CartOrderItem.objects.create(order=self.order, product=self.product, qty=2)
+        self.fake = start_fake_stripe(self, latency=0.2)
+
+    def checkout(self):
+        response = self.client.post(reverse('stripe-checkout', kwargs={'order_oid': self.order.oid}))
+        self.order.refresh_from_db()
+        return response
+
+    def deliver(self, payload, signature):
+        return self.client.generic('POST', reverse('stripe-webhook'), payload,
+                                   content_type='application/json', HTTP_STRIPE_SIGNATURE=signature)
+
+    def success(self):
+        return self.client.post(reverse('payment-success'),
+                                {'order_oid': self.order.oid, 'session_id': self.order.stripe_session_id},
+                                format='json')
+
+    def test_checkout_creates_session_on_fake_stripe(self):
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 302)
+        session = self.fake.sessions[self.order.stripe_session_id]
+        self.assertEqual(response.url, session['url'])
+        self.assertEqual(session['amount_total'], 2000)
+        self.assertEqual(session['client_reference_id'], self.order.oid)
+
+    def test_opening_the_session_url_pays_and_posts_the_webhook(self):
+        receiver = ThreadingHTTPServer(('127.0.0.1', 0), WebhookReceiver)
+        receiver.received = []
+        Thread(target=receiver.serve_forever, daemon=True).start()
+        self.addCleanup(receiver.server_close)
+        self.addCleanup(receiver.shutdown)
+        host, port = receiver.server_address[:2]
+        self.fake.webhook_url = f'http://{host}:{port}/webhook/'
+        session_url = self.checkout().url
+
+        session_url = urlsplit(session_url)
+        browser = HTTPConnection(session_url.netloc, timeout=5)
+        self.addCleanup(browser.close)
+        browser.request('GET', session_url.path)
+        response = browser.getresponse()
+
+        self.assertEqual(response.status, 303)
+        self.assertEqual(response.getheader('Location'),
+                         f'http://localhost:5173/payment-success/{self.order.oid}?session_id={self.order.stripe_session_id}')
+        self.assertEqual(self.fake.deliveries[0][0], 200)
+        payload, signature = receiver.received[0]
+        self.assertEqual(json.loads(payload)['type'], 'checkout.session.completed')
+        self.assertEqual(self.deliver(payload, signature).data['message'], 'Event processed.')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_Status, 'paid')
+
+    def test_forged_event_is_refused_while_the_secret_is_unset(self):
+        self.checkout()
+        payload, _ = self.fake.pay(self.order.stripe_session_id)
+
+        with override_settings(STRIPE_WEBHOOK_SECRET=''), self.assertLogs('store.views', 'ERROR'):
+            response = self.deliver(payload, sign_payload(payload, ''))
+
+        self.assertEqual(response.status_code, 500)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_Status, 'Pending')
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_paid_event_is_processed_once(self):
+        self.checkout()
+        payload, signature = self.fake.pay(self.order.stripe_session_id)
+
+        self.assertEqual(self.deliver(payload, signature).data['message'], 'Event processed.')
+        self.assertEqual(self.deliver(payload, signature).data['message'], 'Event already processed.')
+
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.order.payment_Status, 'paid')
+        self.assertEqual(self.product.stock_qty, 3)
+        self.assertEqual(EmailOutbox.objects.get().to, ['buyer@example.com'])
+
+    def test_bad_signature_is_rejected(self):
+        self.checkout()
+        payload, _ = self.fake.pay(self.order.stripe_session_id)
+
+        response = self.deliver(payload, 't=1,v1=deadbeef')
+
+        self.assertEqual(response.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_Status, 'Pending')
+
+    def test_expired_session_cancels_order(self):
+        self.checkout()
+        self.deliver(*self.fake.expire(self.order.stripe_session_id))
+
+        self.assertEqual(self.success().data['message'], 'Order Payment Cancelled.')
+
+    def test_success_page_is_a_local_read(self):
+        self.checkout()
+        self.assertEqual(self.success().data['message'], 'Order Payment Pending.')
+        self.deliver(*self.fake.pay(self.order.stripe_session_id))
+        requests_before = len(self.fake.requests)
+
+        started = time.perf_counter()
+        response = self.success()
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(response.data['message'], 'payment Successful')
+        self.assertEqual(len(self.fake.requests), requests_before)
+        self.assertLess(elapsed, self.fake.latency)
+
+    def test_success_rejects_foreign_session_id(self):
+        self.checkout()
+        response = self.client.post(reverse('payment-success'),
+                                    {'order_oid': self.order.oid, 'session_id': 'cs_other'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StripeGatewayTest(TestCase):
+    params = {
+        'mode': 'payment',
+        'line_items': [{'price_data': {'currency': 'usd', 'product_data': {'name': 'Buyer'}, 'unit_amount': 2000}, 'quantity': 1}],
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.fake = start_fake_stripe(self)
+        self.clock = FakeClock()
+        self.delays = []
+        self.gateway = self.make_gateway()
+
+    def make_gateway(self, **kwargs):
+        kwargs.setdefault('breaker', CircuitBreaker(threshold=2, reset_timeout=30, clock=self.clock))
+        return StripeGateway('sk_test', self.fake.api_base, sleep=self.delays.append, **kwargs)
+
+    def test_calls_reuse_one_connection(self):
+        for _ in range(5):
+            self.gateway.create_checkout_session(self.params)
+
+        self.assertEqual(len(self.fake.requests), 5)
+        self.assertEqual(self.fake.connections, 1)
+        self.assertEqual(self.gateway.latency['session.create'].count, 5)
+
+    def test_server_errors_are_retried_with_jitter_and_one_idempotency_key(self):
+        self.fake.fail(2, status=503)
+
+        session = self.gateway.create_checkout_session(self.params)
+
+        self.assertEqual(len(self.fake.requests), 3)
+        self.assertEqual(list(self.fake.sessions), [session.id])
+        self.assertEqual(len(self.delays), 2)
+        self.assertTrue(0 <= self.delays[0] <= 0.25 and 0 <= self.delays[1] <= 0.5)
+        self.assertEqual(self.gateway.outcomes['session.create', 'retry'], 2)
+        self.assertEqual(self.gateway.breaker.state, 'closed')
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(stripe.InvalidRequestError):
+            self.gateway.retrieve_checkout_session('cs_missing')
+
+        self.assertEqual(len(self.fake.requests), 1)
+        self.assertEqual(self.gateway.breaker.failures, 0)
+
+    def test_slow_stripe_times_out(self):
+        self.fake.latency = 0.5
+        gateway = self.make_gateway(timeout=(1, 0.1), max_retries=1)
+
+        started = time.perf_counter()
+        with self.assertRaises(stripe.APIConnectionError):
+            gateway.create_checkout_session(self.params)
+
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(gateway.outcomes['session.create', 'failed'], 1)
+
+    def test_breaker_opens_then_lets_one_trial_through(self):
+        self.fake.fail(6, status=500)
+        for _ in range(2):
+            with self.assertRaises(stripe.APIError):
+                self.gateway.create_checkout_session(self.params)
+        self.assertEqual(self.gateway.breaker.state, 'open')
+
+        with self.assertRaises(PaymentGatewayUnavailable):
+            self.gateway.create_checkout_session(self.params)
+        self.assertEqual(len(self.fake.requests), 6)
+
+        self.clock.now = 30
+        self.assertEqual(self.gateway.breaker.state, 'half-open')
+        self.gateway.create_checkout_session(self.params)
+        self.assertEqual(self.gateway.breaker.state, 'closed')
+
+    def test_failed_trial_reopens_the_breaker(self):
+        self.fake.fail(9, status=500)
+        for _ in range(2):
+            with self.assertRaises(stripe.APIError):
+                self.gateway.create_checkout_session(self.params)
+
+        self.clock.now = 30
+        with self.assertRaises(stripe.APIError):
+            self.gateway.create_checkout_session(self.params)
+        self.assertEqual(self.gateway.breaker.state, 'open')
+
+    def test_cancelled_trial_does_not_hold_the_breaker(self):
+        self.fake.fail(2, status=500)
+        gateway = self.make_gateway(max_retries=0)
+        for _ in range(2):
+            with self.assertRaises(stripe.APIError):
+                gateway.create_checkout_session(self.params)
+        self.clock.now = 30
+
+        async def cancelled():
+            raise asyncio.CancelledError
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(gateway._acall('session.create', cancelled))
+        self.assertEqual(gateway.breaker.state, 'half-open')
+        self.assertTrue(gateway.breaker.allow())
+
+    def test_retrieved_sessions_are_cached_and_refreshed_by_webhooks(self):
+        session = self.gateway.create_checkout_session(self.params)
+        cache.clear()
+
+        self.assertEqual(self.gateway.retrieve_checkout_session(session.id).payment_status, 'unpaid')
+        self.assertEqual(self.gateway.retrieve_checkout_session(session.id).payment_status, 'unpaid')
+        self.assertEqual([method for method, path in self.fake.requests], ['POST', 'GET'])
+
+        payload, _ = self.fake.pay(session.id)
+        self.gateway.remember_session(stripe.Event.construct_from(json.loads(payload), None)['data']['object'])
+        self.assertEqual(self.gateway.retrieve_checkout_session(session.id).payment_status, 'paid')
+        self.assertEqual(len(self.fake.requests), 2)
+
+    @skipUnless(httpx, 'the async Stripe client needs httpx')
+    def test_async_create_is_retried(self):
+        self.fake.fail(1, status=502)
+
+        async def create():
+            with mock.patch('store.payments.asyncio.sleep', new=mock.AsyncMock()):
+                return await self.gateway.acreate_checkout_session(self.params)
+
+        session = asyncio.run(create())
+
+        self.assertEqual(list(self.fake.sessions), [session.id])
+        self.assertEqual(self.gateway.latency['session.create'].count, 2)
+
+
+class HistogramTest(TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['buckets'], [(0.1, 2), (1, 3), ('+Inf', 4)])
+        self.assertAlmostEqual(snapshot['sum'], 3.65)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.99), float('inf'))
+
+
+@skipUnless(httpx, 'the async Stripe client needs httpx')
+class AsyncCheckoutViewsTest(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.orders = [
+            CartOrder.objects.create(email=f'buyer{i}@example.com', full_name='Buyer', total=Decimal('20.00'))
+            for i in range(5)
+        ]
+        self.order = self.orders[0]
+        self.fake = start_fake_stripe(self, latency=0.2)
+
+    async def checkout(self, order_oid):
+        request = self.factory.post(f'/api/checkout/{order_oid}/')
+        return await AsyncStripeCheckoutView.as_view()(request, order_oid=order_oid)
+
+    async def success(self, view, session_id):
+        return await view(self.factory.post('/api/payment-success/', {'order_oid': self.order.oid, 'session_id': session_id},
+                                            content_type='application/json'))
+
+    async def test_checkout_creates_session_on_fake_stripe(self):
+        response = await self.checkout(self.order.oid)
+
+        await self.order.arefresh_from_db()
+        session = self.fake.sessions[self.order.stripe_session_id]
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, session['url'])
+        self.assertEqual(session['amount_total'], 2000)
+
+    async def test_checkouts_wait_for_stripe_side_by_side(self):
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[self.checkout(order.oid) for order in self.orders])
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual([response.status_code for response in responses], [302] * 5)
+        self.assertEqual(self.fake.peak_in_flight, 5)
+        self.assertLess(elapsed, self.fake.latency * 3)
+
+    async def test_unknown_order_matches_sync_view(self):
+        response = await self.checkout('missing')
+
+        self.assertEqual(response.status_code, 404)
+        expected = await sync_to_async(APIClient().post)(reverse('stripe-checkout', kwargs={'order_oid': 'missing'}))
+        self.assertEqual(response.content, expected.content)
+
+    async def test_success_page_matches_sync_view(self):
+        await self.checkout(self.order.oid)
+        await self.order.arefresh_from_db()
+        sync_client = APIClient()
+
+        for session_id in (self.order.stripe_session_id, 'cs_other'):
+            response = await self.success(AsyncPaymentSuccessView.as_view(), session_id)
+            expected = await sync_to_async(sync_client.post)(reverse('payment-success'),
+                                                             {'order_oid': self.order.oid, 'session_id': session_id}, format='json')
+            self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content))
+
+
+@override_settings(PRODUCT_VIEWS_FLUSH_EVERY=100)
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        catalog_cache.catalog_cache().clear()
+        self.client = APIClient()
+        self.category = make_category()
+        self.product = make_product(self.category, 'Shirt')
+        self.url = reverse('product-detail', kwargs={'slug': self.product.slug})
+
+    def test_hot_product_page_skips_the_database(self):
+        hits = catalog_cache.stats['hits']
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['title'], 'Shirt')
+        self.assertEqual(catalog_cache.stats['hits'], hits + 1)
+
+    def test_related_row_save_invalidates(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Color.objects.create(product=self.product, title='Blue', color_code='#00f')
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([c['title'] for c in response.data['color']], ['Red', 'Blue'])
+
+    def test_category_list_is_cached_until_a_category_changes(self):
+        url = reverse('category-list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(url).data['results']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(title='Hats', slug='hats')
+        self.assertEqual(len(self.client.get(url).data['results']), 2)
+
+    def test_version_is_bumped_only_once_the_write_commits(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.title = 'Oxford Shirt'
+            self.product.save()
+            # a read inside the writer's transaction window still gets the old payload
+            response = self.client.get(self.url)
+            self.assertEqual((response['X-Cache'], response.data['title']), ('HIT', 'Shirt'))
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        response = self.client.get(self.url)
+
+        self.assertEqual((response['X-Cache'], response.data['title']), ('MISS', 'Oxford Shirt'))
+
+    def test_missing_product_is_not_cached(self):
+        url = reverse('product-detail', kwargs={'slug': 'nope'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ProductSlugTest(TestCase):
+    def test_duplicate_titles_get_distinct_slugs(self):
+        first = Product.objects.create(title='Blue Shirt', price=Decimal('10.00'))
+        second = Product.objects.create(title='Blue Shirt', price=Decimal('10.00'))
+
+        self.assertEqual(first.slug, 'blue-shirt')
+        self.assertEqual(second.slug, f'blue-shirt-{second.pid}')
+
+
+class CartUpsertTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_buyer()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(title='Shirt', price=Decimal('10.00'))
+
+    def add(self, qty, **overrides):
+        payload = {
+            'cart_id': 'c1', 'user_id': self.user.id, 'product_id': self.product.id, 'qty': qty,
+            'price': '10.00', 'shipping_amount': '2.00', 'country': 'BD', 'size': 'M', 'color': 'Red',
+        }
+        payload.update(overrides)
+        return self.client.post(reverse('cart-create-list'), payload, format='json')
+
+    def test_insert_then_update_in_one_statement_each(self):
+        # PostgreSQL tells an insert from an update in the upsert itself, other backends look the line up first
+        statements = 1 if connection.vendor == 'postgresql' else 2
+        with self.assertNumQueries(statements):
+            created = self.add(1)
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(created.data['data']['total'], '12.00')
+
+        with self.assertNumQueries(statements):
+            updated = self.add(3, size='L')
+        self.assertEqual(updated.status_code, 200)
+        self.assertEqual(updated.data['data']['id'], created.data['data']['id'])
+        self.assertEqual(updated.data['data']['size'], 'L')
+        self.assertEqual(updated.data['data']['total'], '36.00')
+        self.assertEqual(updated.data['data']['date'], created.data['data']['date'])
+
+        line = Cart.objects.get()
+        self.assertEqual((line.qty, line.sub_total, line.shipping_amount), (3, Decimal('30.00'), Decimal('6.00')))
+
+    def test_missing_product_inserts_nothing(self):
+        response = self.add(1, product_id=self.product.id + 100)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_line_without_cart_id_is_rejected(self):
+        # a NULL cart_id would never hit the unique constraint, so every retry would add a line
+        for cart_id in (None, ''):
+            self.assertEqual(self.add(1, cart_id=cart_id).status_code, 400)
+
+        self.assertFalse(Cart.objects.exists())
+
+
+class CartBatchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = make_buyer()
+        self.client.force_authenticate(self.user)
+        self.products = [Product.objects.create(title=f'Shirt {i}', price=Decimal('10.00')) for i in range(5)]
+
+    def batch(self, operations):
+        return self.client.post(reverse('cart-batch', kwargs={'cart_id': 'c1'}),
+                                {'user_id': self.user.id, 'operations': operations}, format='json')
+
+    def add(self, product, qty):
+        return {'op': 'add', 'product_id': product.id, 'qty': qty, 'price': '10.00', 'shipping_amount': '1.00',
+                'size': 'M', 'color': 'Red'}
+
+    def test_restoring_a_cart_is_one_request(self):
+        stale = Cart.objects.create(cart_id='c1', user=self.user, product=self.products[4], qty=1)
+        kept = Cart.objects.create(cart_id='c1', user=self.user, product=self.products[0], qty=1)
+
+        response = self.batch([
+            self.add(self.products[0], 2),
+            self.add(self.products[1], 1),
+            self.add(self.products[2], 1),
+            {'op': 'remove', 'product_id': self.products[2].id},
+            {'op': 'remove', 'item_id': stale.id},
+            dict(self.add(self.products[3], 1), op='update'),
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        lines = {line['product']: line for line in response.data['data']}
+        self.assertEqual(set(lines), {self.products[0].id, self.products[1].id, self.products[3].id})
+        self.assertEqual(lines[self.products[0].id]['id'], kept.id)
+        self.assertEqual(lines[self.products[0].id]['qty'], 2)
+        self.assertEqual(response.data['totals']['total'], Decimal('44.00'))
+
+    def test_query_count_does_not_grow_with_operations(self):
+        with self.assertNumQueries(7):
+            self.batch([self.add(product, 1) for product in self.products[:2]])
+        with self.assertNumQueries(7):
+            self.batch([self.add(product, 2) for product in self.products])
+
+    def test_invalid_operation_changes_nothing(self):
+        response = self.batch([self.add(self.products[0], 1), dict(self.add(self.products[1], 1), qty=0)])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['operation'], 1)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_unknown_product_changes_nothing(self):
+        response = self.batch([self.add(self.products[0], 1), {'op': 'add', 'product_id': 999, 'qty': 1,
+                                                                'price': '1.00', 'size': 'M', 'color': 'Red'}])
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['product_ids'], [999])
+        self.assertFalse(Cart.objects.exists())
+
+
+class SerializerDepthTest(TestCase):
+    def test_write_serializer_does_not_change_read_depth(self):
+        user = make_buyer()
+        product = Product.objects.create(title='Shirt', price=Decimal('10.00'))
+        line = Cart.objects.create(cart_id='c1', user=user, product=product)
+
+        CartWriteSerializer(line).data
+        read = CartSerializer(line).data
+        write = CartWriteSerializer(line).data
+
+        self.assertEqual(read['product']['title'], 'Shirt')
+        self.assertEqual(write['product'], product.id)
+        self.assertEqual(CartSerializer.Meta.depth, 3)
+
+    def test_cached_field_maps_are_not_shared_between_instances(self):
+        first = ProductSerializer().fields
+        second = ProductSerializer().fields
+
+        self.assertEqual(list(first), list(second))
+        self.assertIsNot(first['gallery'], second['gallery'])
+
+    def test_nested_and_write_serializers_introspect_once(self):
+        user = make_buyer()
+        product = make_product(make_category(), 'Shirt')
+        Gallery.objects.create(product=product)
+        line = Cart.objects.create(cart_id='c1', user=user, product=product)
+        order = CartOrder.objects.create(buyer=user, email='buyer@example.com', full_name='Buyer', total=Decimal('10.00'))
+        item = CartOrderItem.objects.create(order=order, product=product, qty=1)
+        serializers = [
+            (CartSerializer, line), (CartWriteSerializer, line), (ProductSerializer, product),
+            (CartOrderSerializer, order), (CartOrderWriteSerializer, order),
+            (CartOrderItemSerializer, item), (CartOrderItemWriteSerializer, item),
+        ]
+        for serializer_class, instance in serializers:
+            serializer_class(instance).data
+
+        with mock.patch.object(ModelSerializer, 'get_fields', autospec=True,
+                               side_effect=ModelSerializer.get_fields) as get_fields:
+            for serializer_class, instance in serializers:
+                data = serializer_class(instance).data
+
+        self.assertEqual(get_fields.call_count, 0)
+        self.assertEqual(data['product'], product.id)
+
+
+GOLDEN_DIR = Path(__file__).resolve().parent / 'testdata'
+
+
+@override_settings(STORE_FAST_SERIALIZERS=True)
+class FastSerializerGoldenTest(TestCase):
+    """
+    The fast list path must render byte for byte what ProductSerializer and
+    CartSerializer render. Run with UPDATE_GOLDEN=1 to rewrite the golden
+    files from the regular serializers after an intended contract change.
+    """
+
+    def setUp(self):
+        catalog_cache.catalog_cache().clear()
+        self.client = APIClient()
+        category = Category.objects.create(id=1, title='Shirts', slug='shirts')
+        shirts = [
+            Product.objects.create(id=1, pid='aaaaaaaaa1', category=category, title='Oxford Shirt', price=Decimal('10.00'), image='product_thumbnail/oxford.jpg'),
+            Product.objects.create(id=2, pid='aaaaaaaaa2', category=category, title='Chemise caf\u00e9 \u2028 line', price=Decimal('12.50'), old_price=Decimal('20')),
+            Product.objects.create(id=3, pid='aaaaaaaaa3', title='Loose Hat', price=Decimal('5.00'), description='No "category"'),
+        ]
+        for i, product in enumerate(shirts, start=1):
+            Gallery.objects.create(id=i, gid=f'ggggggggg{i}', product=product)
+            Color.objects.create(id=i, product=product, title='Red', color_code='#f00')
+            Size.objects.create(id=2 * i - 1, product=product, title='M', price=Decimal('1.00'))
+            Size.objects.create(id=2 * i, product=product, title='L')
+        Specification.objects.create(id=1, product=shirts[0], title='Material', content='Cotton')
+        for i, product in enumerate(shirts, start=1):
+            day = datetime(2025, 1, i, 12, 30, tzinfo=dt_timezone.utc)
+            Product.objects.filter(pk=product.pk).update(date=day, updated=day)
+        Category.objects.filter(pk=category.pk).update(updated=datetime(2024, 12, 1, tzinfo=dt_timezone.utc))
+
+        user = User.objects.create(
+            id=1, email='buyer@example.com', username='buyer', password='not-a-hash',
+            date_joined=datetime(2024, 6, 1, tzinfo=dt_timezone.utc),
+        )
+        group = Group.objects.create(id=1, name='Customers')
+        content_type = ContentType.objects.create(id=9001, app_label='golden', model='fixture')
+        group.permissions.add(Permission.objects.create(id=9001, name='Golden', codename='golden', content_type=content_type))
+        user.groups.add(group)
+        Cart.objects.create(id=1, cart_id='cart-1', user=user, product=shirts[0], qty=2, price=Decimal('10.00'), sub_total=Decimal('20.00'), total=Decimal('20.00'), size='M', color='Red')
+        Cart.objects.create(id=2, cart_id='cart-1', user=user, product=shirts[2], price=Decimal('5.00'), country='Bangladesh')
+        cart_day = datetime(2025, 2, 1, 9, 0, tzinfo=dt_timezone.utc)
+        Cart.objects.filter(cart_id='cart-1').update(date=cart_day, updated=cart_day)
+
+    def render_both(self, url):
+        catalog_cache.catalog_cache().clear()
+        with mock.patch('store.fast_serializer.build', wraps=fast_serializer.build) as build:
+            fast = self.client.get(url)
+        self.assertTrue(build.called)
+        catalog_cache.catalog_cache().clear()
+        with override_settings(STORE_FAST_SERIALIZERS=False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast['Content-Type'], slow['Content-Type'])
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def assertGolden(self, name, content):
+        path = GOLDEN_DIR / name
+        if os.environ.get('UPDATE_GOLDEN'):
+            path.write_bytes(content)
+        self.assertEqual(content, path.read_bytes())
+
+    def test_product_list_pages_match_golden_files(self):
+        first = self.render_both(reverse('product-list') + '?page_size=2')
+        self.assertGolden('products_page1.json', first.content)
+        second = self.render_both(json.loads(first.content)['next'])
+        self.assertGolden('products_page2.json', second.content)
+        self.assertIsNone(json.loads(second.content)['next'])
+
+    def test_product_list_ordering_param(self):
+        self.render_both(reverse('product-list') + '?ordering=units_sold&page_size=2')
+
+    def test_cart_list_matches_golden_file(self):
+        response = self.render_both(reverse('cart-list', kwargs={'cart_id': 'cart-1'}))
+        self.assertGolden('cart.json', response.content)
+
+    def test_cart_list_queries(self):
+        # the ETag aggregate, cart rows with user/product/category joined,
+        # then groups, their permissions and user permissions
+        with self.assertNumQueries(5):
+            self.client.get(reverse('cart-list', kwargs={'cart_id': 'cart-1'}))
+
+    def test_browsable_api_keeps_the_serializer(self):
+        with mock.patch('store.fast_serializer.build') as build:
+            response = self.client.get(reverse('cart-list', kwargs={'cart_id': 'cart-1'}), HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+        build.assert_not_called()
+
+
+@skipUnless(connection.vendor == 'postgresql', "product search uses PostgreSQL full-text search")
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shirts = make_category()
+        self.hats = Category.objects.create(title='Hats', slug='hats')
+        self.oxford = make_product(self.shirts, 'Cotton Oxford Shirt', description='A classic button down.')
+        self.linen = make_product(self.shirts, 'Linen Shirt', description='Light summer shirt.', inStock=False)
+        Product.objects.filter(pk=self.linen.pk).update(price=Decimal('30.00'))
+        self.cap = make_product(self.hats, 'Baseball Cap')
+        Specification.objects.filter(product=self.cap).update(content='Wool')
+        Specification.objects.create(product=self.linen, title='Lining', content='Cotton blend')
+
+    def search(self, **params):
+        response = self.client.get(reverse('product-search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_title_matches_rank_above_specification_matches(self):
+        data = self.search(q='cotton')
+        self.assertEqual([p['id'] for p in data['results']], [self.oxford.id, self.linen.id])
+
+    def test_specification_edits_update_the_index(self):
+        self.assertEqual(self.search(q='cashmere')['count'], 0)
+        Specification.objects.create(product=self.cap, title='Band', content='Cashmere')
+        self.assertEqual([p['id'] for p in self.search(q='cashmere')['results']], [self.cap.id])
+
+    def test_filters(self):
+        self.assertEqual(self.search(q='shirt', price_band='25-50')['count'], 1)
+        self.assertEqual(self.search(category=self.hats.id)['count'], 1)
+        self.assertEqual(self.search(in_stock='false')['count'], 1)
+        response = self.client.get(reverse('product-search'), {'price_band': '7-8'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_facets_are_counted_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.search(q='shirt')
+        self.assertEqual(sum('GROUPING SETS' in q['sql'] for q in queries.captured_queries), 1)
+        facets = data['facets']
+        self.assertEqual(facets['category'], [{'id': self.shirts.id, 'title': 'Shirts', 'count': 2}])
+        self.assertEqual(facets['color'], [{'value': 'Red', 'count': 2}])
+        self.assertEqual(facets['size'], [{'value': 'M', 'count': 2}])
+        self.assertEqual(facets['price_band'], [{'value': '0-25', 'count': 1}, {'value': '25-50', 'count': 1}])
+        self.assertEqual(
+            sorted((f['value'], f['count']) for f in facets['inStock']),
+            [(False, 1), (True, 1)],
+        )
+
+
+class InvertedIndexTest(TestCase):
+    def setUp(self):
+        self.index = search_index.InvertedIndex()
+        self.index.add(1, {'title': 'Cotton Oxford Shirt', 'description': 'A classic button down.'})
+        self.index.add(2, {'title': 'Linen Shirt', 'specification': 'Cotton blend'})
+        self.index.add(3, {'title': 'Baseball Cap', 'color': 'Red', 'size': 'M'})
+
+    def test_bm25_prefers_title_matches(self):
+        self.assertEqual([pk for pk, score in self.index.search('cotton')], [1, 2])
+        self.assertEqual([pk for pk, score in self.index.search('cotton shirt')], [1, 2])
+        self.assertEqual(self.index.search('cotton cap'), [])
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.index.search('cott'), [])
+        self.assertEqual([pk for pk, score in self.index.search('linen sh', prefix=True)], [2])
+        self.assertEqual(sorted(self.index.expand('c')), ['cap', 'classic', 'cotton'])
+
+    def test_threshold_walk_matches_exhaustive_scoring(self):
+        rng = random.Random(16)
+        words = ['cotton', 'linen', 'shirt', 'cap', 'red', 'blue', 'slim', 'classic']
+        index = search_index.InvertedIndex()
+        for pk in range(400):
+            index.add(pk, {'title': ' '.join(rng.sample(words, 3)), 'description': ' '.join(rng.choices(words, k=6))})
+        for pk in range(0, 400, 7):
+            index.remove(pk)
+        bm25 = index._bm25()
+        for query in ('cotton', 'cotton shirt', 'classic red cap'):
+            terms = query.split()
+            idfs = {term: bm25.idf(len(index.postings[term])) for term in terms}
+            expected = []
+            for pk, doc in index.docs.items():
+                parts = [index._lookup([term], doc, idfs, bm25) for term in terms]
+                if None not in parts:
+                    expected.append(sum(parts))
+            expected = sorted(expected, reverse=True)[:10]
+            self.assertEqual([round(score, 9) for pk, score in index.search(query, limit=10)], [round(score, 9) for score in expected])
+
+    def test_multi_word_tiers_follow_index_writes(self):
+        self.assertEqual([pk for pk, score in self.index.search('cotton shirt')], [1, 2])
+        self.index.add(4, {'title': 'Cotton Shirt Cotton Shirt'})
+        self.index.remove(1)
+
+        self.assertEqual([pk for pk, score in self.index.search('cotton shirt')], [4, 2])
+
+    def test_updates_and_compaction(self):
+        self.index.add(3, {'title': 'Cotton Cap'})
+        self.assertEqual([pk for pk, score in self.index.search('cap cotton')], [3])
+        self.assertEqual(self.index.search('red'), [])
+        self.index.remove(1)
+        self.assertEqual([pk for pk, score in self.index.search('oxford')], [])
+        self.index.compact()
+        self.assertEqual(len(self.index.doc_pks), 2)
+        self.assertEqual(sorted(pk for pk, score in self.index.search('cotton')), [2, 3])
+
+    def test_reindexing_one_product_stays_compact(self):
+        for n in range(5000):
+            self.index.add(2, {'title': f'Linen Shirt {n}'})
+
+        self.assertLess(len(self.index.doc_pks), 1500)
+        self.assertEqual([pk for pk, score in self.index.search('linen 4999')], [2])
+
+
+@override_settings(PRODUCT_SEARCH_BACKEND='memory')
+class InMemoryProductSearchTest(TestCase):
+    def setUp(self):
+        search_index.reset_index()
+        self.addCleanup(search_index.reset_index)
+        self.client = APIClient()
+        self.shirts = make_category()
+        self.oxford = make_product(self.shirts, 'Cotton Oxford Shirt')
+        self.linen = make_product(self.shirts, 'Linen Shirt', inStock=False)
+        Specification.objects.create(product=self.linen, title='Lining', content='Cotton blend')
+
+    def test_search_endpoint_ranks_and_counts_facets(self):
+        response = self.client.get(reverse('product-search'), {'q': 'cotton'})
+        self.assertEqual([p['id'] for p in response.data['results']], [self.oxford.id, self.linen.id])
+        facets = response.data['facets']
+        self.assertEqual(facets['category'], [{'id': self.shirts.id, 'title': 'Shirts', 'count': 2}])
+        self.assertEqual(facets['size'], [{'value': 'M', 'count': 2}])
+        self.assertEqual(facets['price_band'], [{'value': '0-25', 'count': 2}])
+
+        response = self.client.get(reverse('product-search'), {'q': 'velvet'})
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['facets']['category'], [])
+
+    def test_saves_and_deletes_reindex_on_commit(self):
+        search_index.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            Specification.objects.create(product=self.oxford, title='Collar', content='Velvet trim')
+        self.assertEqual(
+            [p['id'] for p in self.client.get(reverse('product-search'), {'q': 'velvet'}).data['results']],
+            [self.oxford.id],
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.oxford.delete()
+        self.assertEqual(search_index.get_index().search('velvet'), [])
+
+    def test_autocomplete(self):
+        response = self.client.get(reverse('product-autocomplete'), {'q': 'oxf'})
+        self.assertEqual(response.data, [{'id': self.oxford.id, 'title': 'Cotton Oxford Shirt', 'slug': self.oxford.slug}])
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        catalog_cache.catalog_cache().clear()
+        self.client = APIClient()
+        self.category = make_category()
+        self.product = make_product(self.category, 'Oxford Shirt')
+        self.user = make_buyer()
+        self.line = Cart.objects.create(cart_id='cart-1', user=self.user, product=self.product, price=Decimal('10.00'))
+
+    def test_catalog_endpoints_answer_304_without_queries(self):
+        for url in (reverse('product-list'), reverse('product-detail', kwargs={'slug': self.product.slug}), reverse('category-list')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Last-Modified', response)
+            with self.assertNumQueries(0):
+                cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.content, b'')
+
+    def test_catalog_write_changes_the_etag(self):
+        url = reverse('product-list')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Oxford Shirt, slim'
+            self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_the_representation(self):
+        url = reverse('category-list')
+        json_etag = self.client.get(url)['ETag']
+        html_etag = self.client.get(url, HTTP_ACCEPT='text/html')['ETag']
+        self.assertNotEqual(json_etag, html_etag)
+
+    def test_cart_listing(self):
+        url = reverse('cart-list', kwargs={'cart_id': 'cart-1'})
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.line.qty = 3
+        self.line.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        etag = self.client.get(url)['ETag']
+        self.line.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class OrderExportTest(TestCase):
+    def setUp(self):
+        category = make_category()
+        self.product = Product.objects.create(category=category, title='Linen Shirt', price=Decimal('10.00'))
+        self.orders = []
+        for day, payment_status, lines in ((1, 'paid', 2), (2, 'paid', 1), (3, 'Pending', 0), (5, 'paid', 1)):
+            order = CartOrder.objects.create(email=f'buyer{day}@example.com', full_name='Buyer, Jr.', total=Decimal('20.00'),
+                                             payment_Status=payment_status)
+            CartOrder.objects.filter(pk=order.pk).update(date=datetime(2025, 1, day, 12, tzinfo=dt_timezone.utc))
+            for n in range(lines):
+                CartOrderItem.objects.create(order=order, product=self.product, qty=n + 1, price=Decimal('10.00'),
+                                             total=Decimal('10.00') * (n + 1), size='M')
+            self.orders.append(order)
+        self.staff = User.objects.create(email='finance@example.com', username='finance', is_staff=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {MyTokenObtainPairSerializer.get_token(self.staff).access_token}')
+
+    def export(self, **params):
+        response = self.client.get(reverse('order-export'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_has_a_row_per_order_line(self):
+        response, body = self.export()
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual([row['order_oid'] for row in rows], [self.orders[0].oid] * 2 + [order.oid for order in self.orders[1:]])
+        self.assertEqual((rows[1]['item_qty'], rows[1]['item_total'], rows[1]['item_product_title']), ('2', '20.00', 'Linen Shirt'))
+        self.assertEqual((rows[0]['order_full_name'], rows[3]['item_oid']), ('Buyer, Jr.', ''))
+
+    def test_csv_cells_are_not_read_as_formulas(self):
+        CartOrder.objects.filter(pk=self.orders[0].pk).update(
+            full_name='=HYPERLINK("http://evil.example","Click")', phone='+8801700000000', city='@SUM(A1)',
+            discount=Decimal('-5.00'),
+        )
+
+        rows = list(csv.DictReader(StringIO(self.export()[1])))
+
+        self.assertEqual(rows[0]['order_full_name'], '\'=HYPERLINK("http://evil.example","Click")')
+        self.assertEqual(rows[0]['order_city'], "'@SUM(A1)")
+        self.assertEqual((rows[0]['order_phone'], rows[0]['order_discount']), ('+8801700000000', '-5.00'))
+        self.assertEqual(rows[2]['order_full_name'], 'Buyer, Jr.')
+
+    def test_jsonl_filtered_by_date_range_and_status(self):
+        response, body = self.export(output='jsonl', **{'from': '2025-01-02', 'to': '2025-01-05', 'payment_status': 'paid'})
+
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([record['oid'] for record in records], [self.orders[1].oid, self.orders[3].oid])
+        self.assertEqual(records[0]['items'][0]['product_id'], self.product.id)
+        self.assertEqual(records[0]['total'], '20.00')
+
+    def test_bad_filters_and_non_staff_are_rejected(self):
+        self.assertEqual(self.client.get(reverse('order-export'), {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('order-export'), {'order_status': 'Lost'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('order-export'), {'output': 'xlsx'}).status_code, 400)
+
+        buyer = make_buyer()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {MyTokenObtainPairSerializer.get_token(buyer).access_token}')
+        self.assertEqual(client.get(reverse('order-export')).status_code, 403)
+
+    def test_lines_are_fetched_once_per_chunk(self):
+        # the orders query, then one items query per chunk of two orders
+        with self.assertNumQueries(3):
+            b''.join(export_blocks(order_export_queryset(), 'csv', chunk_size=2))
+
+    def test_command_writes_the_export(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'orders.jsonl'
+
+        call_command('export_orders', format='jsonl', output=str(path), order_status='Processing', stderr=StringIO())
+
+        self.assertEqual(len(path.read_text().splitlines()), 4)
+
+    async def test_asgi_requests_stream_asynchronously(self):
+        request = AsyncRequestFactory().get('/api/orders/export/', {'output': 'jsonl'})
+        force_authenticate(request, self.staff)
+
+        response = await sync_to_async(OrderExportAPIView.as_view())(request)
+
+        self.assertTrue(response.is_async)
+        body = b''.join([block async for block in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 4)
@@ -1,41 +1,114 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.filters import OrderingFilter
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import Q
 from decimal import Decimal
+import json
+import logging
 import stripe
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
 
-from store.models import Category, Product, Cart, CartOrder, CartOrderItem
+from store.models import Category, Product, Cart, CartOrder, CartOrderItem, CartQuerySet, StripeEvent
 from account.models import User
-from store.serializer import CategorySerializer, ProductSerializer, CartSerializer, CartOrderSerializer
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-class CategoryListAPIView(generics.ListAPIView):
+from store.serializer import CategorySerializer, ProductSerializer, CartSerializer, CartWriteSerializer, CartOrderWriteSerializer
+from store.cache import CatalogCacheMixin, record_product_view
+from store.conditional import cart_condition, catalog_condition
+from store.fast_serializer import FastJSONResponse, FastListMixin
+from store.cart import get_cart_totals, invalidate_cart_totals, totals_summary
+from store.export import CONTENT_TYPES, EXPORT_FORMATS, ExportFilterError, aexport_blocks, export_blocks, order_export_queryset
+from store.orders import mark_order_paid, mark_order_cancelled
+from store.payments import get_gateway
+from store.pagination import CategoryCursorPagination, ProductCursorPagination, CartCursorPagination, ProductSearchPagination
+from store.search import autocomplete, facet_counts, search_products
+
+logger = logging.getLogger(__name__)
+
+@method_decorator(catalog_condition, name='get')
+class CategoryListAPIView(CatalogCacheMixin, generics.ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = (AllowAny,)
+    pagination_class = CategoryCursorPagination
+    cache_namespace = 'categories'
 
-class ProductListAPIView(generics.ListAPIView):
-    queryset = Product.objects.all()
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request.build_absolute_uri(), lambda: super(CategoryListAPIView, self).list(request, *args, **kwargs).data)
+
+@method_decorator(catalog_condition, name='get')
+class ProductListAPIView(FastListMixin, CatalogCacheMixin, generics.ListAPIView):
+    queryset = Product.objects.catalog()
+    serializer_class = ProductSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = ProductCursorPagination
+    filter_backends = (OrderingFilter,)
+    ordering_fields = ('date', 'orders_count', 'units_sold', 'views')
+    cache_namespace = 'products'
+
+    def list(self, request, *args, **kwargs):
+        def build():
+            data = self.fast_list_data(request)
+            if data is None:
+                data = super(ProductListAPIView, self).list(request, *args, **kwargs).data
+            return data
+        return self.cached_response(request.build_absolute_uri(), build)
+
+class ProductSearchAPIView(FastListMixin, generics.ListAPIView):
+    """
+    Ranked full-text product search with facet counts, e.g.
+    /products/search/?q=cotton shirt&price_band=25-50&in_stock=true
+    """
+    queryset = Product.objects.catalog()
     serializer_class = ProductSerializer
     permission_classes = (AllowAny,)
+    pagination_class = ProductSearchPagination
+
+    def get_queryset(self):
+        return search_products(super().get_queryset(), self.request.query_params)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['facets'] = facet_counts(self.get_queryset())
+        return response
+
+class ProductAutocompleteAPIView(generics.GenericAPIView):
+    permission_classes = (AllowAny,)
+
+    def get(self, request, *args, **kwargs):
+        return Response(autocomplete(request.query_params.get('q', '')))
 
-class ProductDetailsAPIView(generics.RetrieveAPIView):
+@method_decorator(catalog_condition, name='get')
+class ProductDetailsAPIView(CatalogCacheMixin, generics.RetrieveAPIView):
     serializer_class = ProductSerializer
     permission_classes = (AllowAny,)
+    cache_namespace = 'product'
 
     def get_object(self):
         slug = self.kwargs['slug']
-        return get_object_or_404(Product, slug=slug)
+        return get_object_or_404(Product.objects.catalog(), slug=slug)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = self.cached_response(self.kwargs['slug'], lambda: self.get_serializer(self.get_object()).data)
+        record_product_view(response.data['id'])
+        return response
 
 class CartAPIView(generics.ListCreateAPIView):
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = CartCursorPagination
+
+    def get_serializer_class(self):
+        if self.request.method == 'POST':
+            return CartWriteSerializer
+        return CartSerializer
 
     def create(self, request, *args, **kwargs):
         payload = request.data
@@ -50,10 +123,9 @@ class CartAPIView(generics.ListCreateAPIView):
         color = payload.get('color')
         cart_id = payload.get('cart_id')
 
-        product = get_object_or_404(Product, id=product_id)
-        user = get_object_or_404(User, id=user_id)
-
         try:
+            product_id = int(product_id)
+            user_id = int(user_id)
             qty = Decimal(qty)
             price = Decimal(price)
             shipping_amount = Decimal(shipping_amount)
@@ -68,55 +140,144 @@ class CartAPIView(generics.ListCreateAPIView):
             return Response({"detail": "Shipping amount cannot be negative."}, status=status.HTTP_400_BAD_REQUEST)
         if not size or not color:
             return Response({"detail": "Size and color must be selected."}, status=status.HTTP_400_BAD_REQUEST)
+        if not cart_id:
+            return Response({"detail": "cart_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        sub_total = price * qty
+        shipping_total = shipping_amount * qty
+        service_fee = Decimal('0.00')
+        text_fee = Decimal('0.00')
+        total = sub_total + shipping_total + service_fee + text_fee
+
+        cart = Cart.objects.upsert_line(
+            cart_id, user_id, product_id,
+            qty=qty,
+            price=price,
+            shipping_amount=shipping_total,
+            text_fee=text_fee,
+            sub_total=sub_total,
+            country=country,
+            size=size,
+            color=color,
+            service_fee=service_fee,
+            total=total,
+        )
+        if cart is None:
+            return Response({"detail": "Product or user not found."}, status=status.HTTP_404_NOT_FOUND)
+        invalidate_cart_totals(cart_id)
 
-        cart = Cart.objects.filter(cart_id=cart_id, product=product, user=user).first()
-
-        if cart:
-            cart.qty = qty
-            cart.price = price
-            cart.shipping_amount = shipping_amount * qty
-            cart.sub_total = price * qty
-            cart.country = country
-            cart.size = size
-            cart.color = color
-            cart.service_fee = Decimal('0.00')
-            cart.text_fee = Decimal('0.00')
-            cart.total = cart.sub_total + cart.shipping_amount
-            cart.save()
-
-            return Response({
-                'message': 'Cart updated successfully.',
-                'data': self.get_serializer(cart).data
-            }, status=status.HTTP_200_OK)
-        else:
-            sub_total = price * qty
-            shipping_total = shipping_amount * qty
-            service_fee = Decimal('0.00')
-            text_fee = Decimal('0.00')
-            total = sub_total + shipping_total + service_fee + text_fee
-
-            cart = Cart.objects.create(
-                product=product,
-                user=user,
-                qty=qty,
-                price=price,
-                shipping_amount=shipping_total,
-                text_fee=text_fee,
-                sub_total=sub_total,
-                country=country,
-                size=size,
-                color=color,
-                cart_id=cart_id,
-                service_fee=service_fee,
-                total=total
-            )
-
+        if cart.created:
             return Response({
                 'message': 'Product added to cart successfully.',
                 'data': self.get_serializer(cart).data
             }, status=status.HTTP_201_CREATED)
+        return Response({
+            'message': 'Cart updated successfully.',
+            'data': self.get_serializer(cart).data
+        }, status=status.HTTP_200_OK)
 
-class CartListView(generics.ListAPIView):
+class CartBatchAPIView(generics.GenericAPIView):
+    serializer_class = CartWriteSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        """
+        Apply a list of add/update/remove operations to one cart in a single
+        transaction. Operations on the same product collapse, the last one wins.
+        """
+        cart_id = self.kwargs['cart_id']
+        payload = request.data
+        operations = payload.get('operations')
+
+        try:
+            user_id = int(payload.get('user_id'))
+        except (TypeError, ValueError):
+            return Response({"detail": "Invalid user id."}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(operations, list) or not operations:
+            return Response({"detail": "operations must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = {}
+        remove_items = set()
+        for index, operation in enumerate(operations):
+            error = None
+            op = operation.get('op') if isinstance(operation, dict) else None
+            try:
+                if op == 'remove':
+                    if operation.get('item_id') is not None:
+                        remove_items.add(int(operation['item_id']))
+                    else:
+                        lines[int(operation['product_id'])] = None
+                elif op in ('add', 'update'):
+                    product_id = int(operation['product_id'])
+                    qty = Decimal(operation.get('qty'))
+                    price = Decimal(operation.get('price'))
+                    shipping_amount = Decimal(operation.get('shipping_amount', 0))
+                    if qty <= 0:
+                        error = "Quantity must be greater than 0."
+                    elif price <= 0:
+                        error = "Price must be greater than 0."
+                    elif shipping_amount < 0:
+                        error = "Shipping amount cannot be negative."
+                    elif not operation.get('size') or not operation.get('color'):
+                        error = "Size and color must be selected."
+                    else:
+                        lines[product_id] = Cart(
+                            cart_id=cart_id,
+                            user_id=user_id,
+                            product_id=product_id,
+                            qty=qty,
+                            price=price,
+                            shipping_amount=shipping_amount * qty,
+                            sub_total=price * qty,
+                            service_fee=Decimal('0.00'),
+                            text_fee=Decimal('0.00'),
+                            total=price * qty + shipping_amount * qty,
+                            country=operation.get('country'),
+                            size=operation.get('size'),
+                            color=operation.get('color'),
+                        )
+                else:
+                    error = "op must be one of add, update, remove."
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                error = "Invalid numeric values."
+            if error:
+                return Response({"detail": error, "operation": index}, status=status.HTTP_400_BAD_REQUEST)
+
+        upserts = [line for line in lines.values() if line is not None]
+        remove_products = [product_id for product_id, line in lines.items() if line is None]
+
+        if not User.objects.filter(id=user_id).exists():
+            return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        upsert_ids = {line.product_id for line in upserts}
+        missing = upsert_ids - set(Product.objects.filter(id__in=upsert_ids).values_list('id', flat=True))
+        if missing:
+            return Response({"detail": "Product not found.", "product_ids": sorted(missing)}, status=status.HTTP_404_NOT_FOUND)
+
+        with transaction.atomic():
+            if remove_items or remove_products:
+                Cart.objects.filter(cart_id=cart_id).filter(
+                    Q(id__in=remove_items) | Q(user_id=user_id, product_id__in=remove_products)
+                ).delete()
+            if upserts:
+                Cart.objects.bulk_create(
+                    upserts,
+                    update_conflicts=True,
+                    unique_fields=['cart_id', 'user', 'product'],
+                    update_fields=['qty', 'price', 'shipping_amount', 'sub_total', 'service_fee', 'text_fee',
+                                   'total', 'country', 'size', 'color', 'updated'],
+                )
+        invalidate_cart_totals(cart_id)
+
+        cart_items = Cart.objects.filter(cart_id=cart_id).order_by('id')
+        totals = get_cart_totals(cart_id)
+        return Response({
+            'message': 'Cart updated successfully.',
+            'data': self.get_serializer(cart_items, many=True).data,
+            'totals': totals_summary(totals),
+        }, status=status.HTTP_200_OK)
+
+@method_decorator(cart_condition, name='get')
+class CartListView(FastListMixin, generics.ListAPIView):
     serializer_class = CartSerializer
     permission_classes = (AllowAny,)
 
@@ -144,22 +305,12 @@ class CartDetailsView(generics.RetrieveAPIView):
         return Cart.objects.filter(cart_id=cart_id)
 
     def get(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-
-        total_shipping = sum([item.shipping_amount for item in queryset])
-        total_tax = sum([item.text_fee for item in queryset])
-        total_service_fee = sum([item.service_fee for item in queryset])
-        total_sub_total = sum([item.sub_total for item in queryset])
-        total_total = sum([item.total for item in queryset])
-
-        data = {
-            "shipping": total_shipping,
-            "tax": total_tax,
-            "service_fee": total_service_fee,
-            "sub_total": total_sub_total,
-            "total": total_total,
-        }
-        return Response(data, status=status.HTTP_200_OK)
+        if self.kwargs.get('user_id'):
+            totals = self.get_queryset().totals()
+        else:
+            totals = get_cart_totals(self.kwargs['cart_id'])
+
+        return Response(totals_summary(totals), status=status.HTTP_200_OK)
 
 class CartItemDeleteAPIView(generics.DestroyAPIView):
     serializer_class = CartSerializer
@@ -175,8 +326,12 @@ class CartItemDeleteAPIView(generics.DestroyAPIView):
             return get_object_or_404(Cart, id=item_id, cart_id=cart_id, user=user)
         return get_object_or_404(Cart, id=item_id, cart_id=cart_id)
 
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_cart_totals(instance.cart_id)
+
 class CartOrderAPIView(generics.CreateAPIView):
-    serializer_class = CartOrderSerializer
+    serializer_class = CartOrderWriteSerializer
     queryset = CartOrder.objects.all()
     permission_classes = (AllowAny,)
 
@@ -195,65 +350,98 @@ class CartOrderAPIView(generics.CreateAPIView):
 
         user = get_object_or_404(User, id=user_id) if user_id != 0 else None
 
-        cart_items = Cart.objects.filter(cart_id=cart_id)
-        total_shipping = Decimal('0.00')
-        total_tax = Decimal('0.00')
-        total_service_fee = Decimal('0.00')
-        total_sub_total = Decimal('0.00')
-        total_initial_total = Decimal('0.00')
-        total_total = Decimal('0.00')
-
-        order = CartOrder.objects.create(
-            buyer=user,
-            address=address,
-            full_name=full_name,
-            phone=phone,
-            email=email,
-            country=country,
-            state=state,
-            city=city,
-            zipcode=pincode,
-        )
-
-        for c in cart_items:
-            CartOrderItem.objects.create(
-                order=order,
-                product=c.product,
-                qty=c.qty,
-                color=c.color,
-                size=c.size,
-                price=c.price,
-                shipping_amount=c.shipping_amount,
-                text_fee=c.text_fee,
-                service_fee=c.service_fee,
-                sub_total=c.sub_total,
-                total=c.total,
-                initial_total=c.total,
+        with transaction.atomic():
+            cart_items = list(Cart.objects.select_for_update().filter(cart_id=cart_id).order_by('id'))
+            # from the locked lines only: a line added meanwhile is neither ordered nor charged
+            totals = {
+                field: sum((getattr(c, field) for c in cart_items), Decimal('0.00'))
+                for field in CartQuerySet.TOTAL_FIELDS
+            }
+
+            order = CartOrder.objects.create(
+                buyer=user,
+                address=address,
+                full_name=full_name,
+                phone=phone,
+                email=email,
+                country=country,
+                state=state,
+                city=city,
+                zipcode=pincode,
+                shipping_amount=totals['shipping_amount'],
+                text_fee=totals['text_fee'],
+                service_fee=totals['service_fee'],
+                sub_total=totals['sub_total'],
+                initial_total=totals['total'],
+                total=totals['total'],
             )
 
-            total_shipping += c.shipping_amount
-            total_tax += c.text_fee
-            total_service_fee += c.service_fee
-            total_sub_total += c.sub_total
-            total_initial_total += c.total
-            total_total += c.total
-
-        order.shipping_amount = total_shipping
-        order.text_fee = total_tax
-        order.service_fee = total_service_fee
-        order.sub_total = total_sub_total
-        order.initial_total = total_initial_total
-        order.total = total_total
-        order.save()
-
-        Cart.objects.filter(cart_id=cart_id).delete()
+            order_items = []
+            product_counts = {}
+            for c in cart_items:
+                order_items.append(CartOrderItem(
+                    order=order,
+                    product_id=c.product_id,
+                    qty=c.qty,
+                    color=c.color,
+                    size=c.size,
+                    price=c.price,
+                    shipping_amount=c.shipping_amount,
+                    text_fee=c.text_fee,
+                    service_fee=c.service_fee,
+                    sub_total=c.sub_total,
+                    total=c.total,
+                    initial_total=c.total,
+                ))
+                order_items_count, units = product_counts.get(c.product_id, (0, 0))
+                product_counts[c.product_id] = (order_items_count + 1, units + c.qty)
+
+            # oids are generated by the ShortUUIDField default when each item is built
+            CartOrderItem.objects.bulk_create(order_items)
+            Product.objects.add_order_counts(product_counts)
+            Cart.objects.filter(pk__in=[c.id for c in cart_items]).delete()
+
+        invalidate_cart_totals(cart_id)
 
         if user_id != 0:
             return Response({"message": "Order Placed Successfully.", "order_oid": order.oid}, status=status.HTTP_201_CREATED)
         return Response({"message": "Order Placed Successfully."}, status=status.HTTP_200_OK)
 
+def checkout_session_params(order):
+    return {
+        'customer_email': order.email,
+        'payment_method_types': ['card'],
+        'line_items': [{
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {'name': order.full_name},
+                'unit_amount': int(order.total * 100),
+            },
+            'quantity': 1,
+        }],
+        'mode': 'payment',
+        'client_reference_id': order.oid,
+        'success_url': f'http://localhost:5173/payment-success/{order.oid}?session_id={{CHECKOUT_SESSION_ID}}',
+        'cancel_url': 'http://localhost:5173/payment-failed/',
+    }
+
+def payment_status_message(order, session_id):
+    """(message, status) the payment success page shows for order."""
+    # payment state is written by StripeWebhookView, this is a local read only
+    if not session_id or session_id == 'null' or session_id != order.stripe_session_id:
+        return "Invalid session id.", status.HTTP_400_BAD_REQUEST
+
+    if order.payment_Status == 'paid':
+        return "payment Successful", status.HTTP_200_OK
+    elif order.payment_Status in ('Pending', 'Processing'):
+        return "Order Payment Pending.", status.HTTP_200_OK
+    elif order.payment_Status == 'Cancelled':
+        return "Order Payment Cancelled.", status.HTTP_200_OK
+    else:
+        return "Order Payment Failed. Try again", status.HTTP_200_OK
+
 class StripeCheckoutView(generics.CreateAPIView):
-    serializer_class = CartOrderSerializer
+    serializer_class = CartOrderWriteSerializer
     permission_classes = (AllowAny,)
     queryset = CartOrder.objects.all()
 
@@ -262,21 +450,7 @@ class StripeCheckoutView(generics.CreateAPIView):
         order = get_object_or_404(CartOrder, oid=order_oid)
 
         try:
-            checkout_session = stripe.checkout.Session.create(
-                customer_email=order.email,
-                payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'usd',
-                        'product_data': {'name': order.full_name},
-                        'unit_amount': int(order.total * 100),
-                    },
-                    'quantity': 1,
-                }],
-                mode='payment',
-                success_url=f'http://localhost:5173/payment-success/{order.oid}?session_id={{CHECKOUT_SESSION_ID}}',
-                cancel_url='http://localhost:5173/payment-failed/',
-            )
+            checkout_session = get_gateway().create_checkout_session(checkout_session_params(order))
             order.stripe_session_id = checkout_session.id
             order.save()
             return redirect(checkout_session.url)
@@ -284,7 +458,7 @@ class StripeCheckoutView(generics.CreateAPIView):
             return Response({"message": f"Error creating checkout session: {str(e)}."}, status=status.HTTP_400_BAD_REQUEST)
 
 class PaymentSuccessView(generics.CreateAPIView):
-    serializer_class = CartOrderSerializer
+    serializer_class = CartOrderWriteSerializer
     permission_classes = (AllowAny,)
     queryset = CartOrder.objects.all()
 
@@ -293,48 +467,114 @@ class PaymentSuccessView(generics.CreateAPIView):
         order_oid = payload.get('order_oid')
         session_id = payload.get('session_id')
         order = get_object_or_404(CartOrder, oid=order_oid)
-        order_items = CartOrderItem.objects.filter(order=order)
-
-        if session_id != 'null':
-            session = stripe.checkout.Session.retrieve(session_id)
-            if session.payment_status == 'paid':
-                if order.payment_Status != 'paid':
-                    order.payment_Status = 'paid'
-                    order.save()
-
-                    # product quantity update
-                    for item in order_items:
-                        product = item.product
-                        if product.stock_qty >= item.qty:
-                            product.stock_qty -= item.qty
-                            product.save()
-
-                    # send emails
-                    context = {'order': order, 'order_item': order_items}
-                    subject = "Order Placed successfully"
-                    text_body = render_to_string('emails/customer_order_placed.txt', context)
-                    html_body = render_to_string('emails/customer_order_placed.html', context)
-                    msg = EmailMultiAlternatives(subject, text_body, settings.EMAIL_HOST_USER, [order.email])
-                    msg.attach_alternative(html_body, 'text/html')
-                    msg.send()
-
-                    for item in order_items:
-                        context = {'order': order, 'order_item': order_items, 'vendor': item.vendor}
-                        subject = "Order Placed successfully"
-                        text_body = render_to_string('emails/vendor_order_placed.txt', context)
-                        html_body = render_to_string('emails/vendor_order_placed.html', context)
-                        msg = EmailMultiAlternatives(subject, text_body, settings.EMAIL_HOST_USER, [item.vendor.email])
-                        msg.attach_alternative(html_body, 'text/html')
-                        msg.send()
-
-                    return Response({"message": "payment Successful"}, status=status.HTTP_200_OK)
-                else:
-                    return Response({"message": "Already paid"}, status=status.HTTP_200_OK)
-            elif session.payment_status == 'pending':
-                return Response({"message": "Order Payment Pending."}, status=status.HTTP_200_OK)
-            elif session.payment_status == 'canceled':
-                return Response({"message": "Order Payment Cancelled."}, status=status.HTTP_200_OK)
-            else:
-                return Response({"message": "Order Payment Failed. Try again"}, status=status.HTTP_200_OK)
-        else:
-            return Response({"message": "Invalid session id."}, status=status.HTTP_400_BAD_REQUEST)
+
+        message, code = payment_status_message(order, session_id)
+        return Response({"message": message}, status=code)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncStripeCheckoutView(View):
+    """
+    StripeCheckoutView for ASGI servers: the order is read and written with
+    the async ORM and the session is created over the event loop's pooled
+    httpx connections (store/payments.py), so a slow Stripe holds no worker
+    thread.
+    """
+
+    async def post(self, request, order_oid):
+        order = await CartOrder.objects.filter(oid=order_oid).afirst()
+        if order is None:
+            return FastJSONResponse({"detail": "No CartOrder matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            checkout_session = await get_gateway().acreate_checkout_session(checkout_session_params(order))
+        except stripe.error.StripeError as e:
+            return FastJSONResponse({"message": f"Error creating checkout session: {str(e)}."}, status=status.HTTP_400_BAD_REQUEST)
+        order.stripe_session_id = checkout_session.id
+        await order.asave(update_fields=['stripe_session_id'])
+        return redirect(checkout_session.url)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPaymentSuccessView(View):
+    """PaymentSuccessView for ASGI servers, one async ORM read."""
+
+    async def post(self, request):
+        try:
+            payload = json.loads(request.body or b'{}') if request.content_type == 'application/json' else request.POST
+        except ValueError as e:
+            return FastJSONResponse({"detail": f"JSON parse error - {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        order = await CartOrder.objects.filter(oid=payload.get('order_oid')).afirst()
+        if order is None:
+            return FastJSONResponse({"detail": "No CartOrder matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+
+        message, code = payment_status_message(order, payload.get('session_id'))
+        return FastJSONResponse({"message": message}, status=code)
+
+class StripeWebhookView(generics.GenericAPIView):
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+    CANCELLED_EVENTS = ('checkout.session.expired', 'checkout.session.async_payment_failed')
+
+    def post(self, request, *args, **kwargs):
+        # construct_event() accepts a signature made with an empty secret, i.e. by anyone
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            logger.error("Rejected a Stripe webhook: STRIPE_WEBHOOK_SECRET is not set.")
+            return Response({"message": "Webhook is not configured."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''), settings.STRIPE_WEBHOOK_SECRET
+            )
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response({"message": "Invalid payload."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # Stripe delivers at least once; the event id makes processing idempotent
+            _, created = StripeEvent.objects.get_or_create(event_id=event['id'], defaults={'type': event['type']})
+            if not created:
+                return Response({"message": "Event already processed."}, status=status.HTTP_200_OK)
+
+            if event['type'] in self.PAID_EVENTS or event['type'] in self.CANCELLED_EVENTS:
+                session = event['data']['object']
+                get_gateway().remember_session(session)
+                order = self.get_order(session)
+                if order is None:
+                    return Response({"message": "Order not found."}, status=status.HTTP_200_OK)
+                if event['type'] in self.PAID_EVENTS and session.get('payment_status') == 'paid':
+                    mark_order_paid(order)
+                elif event['type'] in self.CANCELLED_EVENTS:
+                    mark_order_cancelled(order)
+
+        return Response({"message": "Event processed."}, status=status.HTTP_200_OK)
+
+    def get_order(self, session):
+        orders = CartOrder.objects.all()
+        if session.get('client_reference_id'):
+            return orders.filter(oid=session['client_reference_id']).first()
+        return orders.filter(stripe_session_id=session['id']).first()
+
+
+class OrderExportAPIView(generics.GenericAPIView):
+    """
+    Orders with their lines for accounting, streamed as CSV or JSONL
+    (?output=jsonl) and filtered by ?from, ?to (ISO dates or datetimes),
+    ?payment_status and ?order_status. See store/export.py.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        output = params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({'message': f'output must be one of {", ".join(EXPORT_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            orders = order_export_queryset(params.get('from'), params.get('to'), params.get('payment_status'), params.get('order_status'))
+        except ExportFilterError as error:
+            return Response({'message': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        blocks = export_blocks(orders, output)
+        if isinstance(request._request, ASGIRequest):
+            blocks = aexport_blocks(blocks)
+        response = StreamingHttpResponse(blocks, content_type=CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response